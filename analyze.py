@@ -0,0 +1,213 @@
+"""
+  Batch analyzer for game archives and position lists, built on the headless rules core in rules.py.
+  Every game is replayed move by move, checking each move is legal, and its end is classified as
+  checkmate, stalemate, ongoing (the moves ran out first), illegal (a move didn't match a legal move, or the starting
+  position can't occur in a game) or invalid. Positions (one FEN per line) are classified the same way, with their
+  legal move count. A record that can't be analyzed at all gets status "error" instead of stopping the run.
+
+  The main process only splits the input into chunks of raw text, worker processes parse and replay them,
+  and results are written as JSON lines in input order. At most a few chunks per worker are in flight at once,
+  so memory stays bounded no matter how large the input is.
+  Run "python analyze.py games.pgn --workers 8 > results.jsonl". Per worker throughput is printed to stderr.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from bitboard import Position, IllegalPosition
+from rules import Game, ONGOING, CHECKMATE, STALEMATE
+from pgn import parseGame, parseSan, splitGames
+
+STATUSES = {ONGOING: "ongoing", CHECKMATE: "checkmate", STALEMATE: "stalemate"}
+
+CHUNK_SIZE = 500  # games or positions per task sent to a worker
+IN_FLIGHT = 4  # chunks queued per worker before the reader waits for results
+
+
+def analyzeGame(text):
+    """ Replays one PGN game.
+
+    Returns:
+        dict: status, plies replayed, the declared result, and an error message for illegal or invalid games.
+    """
+    tags, moves, declared = parseGame(text)
+    report = {"status": None, "plies": 0, "result": tags.get("Result", declared)}
+    try:
+        game = Game.fromFen(tags["FEN"]) if "FEN" in tags else Game()
+    except IllegalPosition as e:
+        report.update(status="illegal", error=str(e))
+        return report
+    except ValueError as e:
+        report.update(status="invalid", error=str(e))
+        return report
+    position = game.position
+    for token in moves:
+        try:
+            move = parseSan(position, token)
+        except ValueError as e:
+            report.update(status="illegal", error=str(e))
+            return report
+        position.makeMove(move)
+        report["plies"] += 1
+    report["status"] = STATUSES[game.result()]
+    return report
+
+
+def analyzePosition(fen):
+    """ Classifies one FEN.
+
+    Returns:
+        dict: status, the number of legal moves, and whether the side to move is in check.
+    """
+    # EPD lines have operations like "bm e4;" instead of move counters
+    fields = fen.split()
+    counters = len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit()
+    try:
+        position = Position.fromFen(" ".join(fields[:6] if counters else fields[:4]))
+    except IllegalPosition as e:
+        return {"status": "illegal", "error": str(e)}
+    except ValueError as e:
+        return {"status": "invalid", "error": str(e)}
+    moves = position.legalMoves()
+    inCheck = bool(position.checkers())
+    if moves:
+        status = "ongoing"
+    else:
+        status = "checkmate" if inCheck else "stalemate"
+    return {"status": status, "moves": len(moves), "check": inCheck}
+
+
+def analyzeChunk(kind, first, items):
+    """ Runs in a worker process and analyzes one chunk.
+
+    Args:
+        kind (str): "pgn" or "fen".
+        first (int): The input index of the chunk's first item, so results can be numbered.
+        items (list[str]): Raw game texts or FEN lines.
+
+    Returns:
+        tuple: (pid, JSON lines, items analyzed, plies replayed, seconds spent).
+    """
+    start = time.perf_counter()
+    analyze = analyzeGame if kind == "pgn" else analyzePosition
+    lines = []
+    plies = 0
+    for index, item in enumerate(items, first):
+        try:
+            report = analyze(item)
+        except Exception as e:  # one broken record shouldn't end a run over millions
+            report = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        plies += report.get("plies", 0)
+        if kind == "fen":
+            report["fen"] = item
+        lines.append(json.dumps({"index": index, **report}))
+    return os.getpid(), lines, len(items), plies, time.perf_counter() - start
+
+
+def readItems(paths, kind):
+    # streams games or FEN lines from each file in turn, "-" is standard input
+    for path in paths:
+        file = sys.stdin if path == "-" else open(path)
+        try:
+            if kind == "pgn":
+                yield from splitGames(file)
+            else:
+                for line in file:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        yield line
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+
+def chunks(items, size):
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
+
+
+def run(paths, kind, out, workers=None, chunkSize=CHUNK_SIZE):
+    """ Analyzes every game or position in the input files and writes a JSON line for each, in input order.
+
+    Args:
+        paths (list[str]): Input files.
+        kind (str): "pgn" or "fen".
+        out (io.TextIOBase): Where the results go.
+        workers (int, optional): Worker processes. Defaults to the number of CPUs.
+        chunkSize (int, optional): Items per task. Defaults to CHUNK_SIZE.
+
+    Returns:
+        dict: Per worker totals, pid -> [items, plies, seconds], and the totals and wall time under "total".
+    """
+    workers = workers or os.cpu_count() or 1
+    perWorker = {}
+    counts = {}
+    total = [0, 0]
+    start = time.perf_counter()
+
+    def collect(future):
+        pid, lines, items, plies, seconds = future.result()
+        out.write("\n".join(lines) + "\n")
+        stats = perWorker.setdefault(pid, [0, 0, 0.0])
+        stats[0] += items
+        stats[1] += plies
+        stats[2] += seconds
+        total[0] += items
+        total[1] += plies
+        for line in lines:
+            status = json.loads(line)["status"]
+            counts[status] = counts.get(status, 0) + 1
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        first = 0
+        for chunk in chunks(readItems(paths, kind), chunkSize):
+            pending.append(executor.submit(analyzeChunk, kind, first, chunk))
+            first += len(chunk)
+            # results are written oldest first, which keeps the output in order and bounds how much is queued
+            while len(pending) >= workers * IN_FLIGHT:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+    return {"workers": perWorker, "total": total, "statuses": counts, "seconds": time.perf_counter() - start}
+
+
+def report(summary, stream=sys.stderr):
+    unit = "games" if summary.get("kind") == "pgn" else "positions"
+    for pid, (items, plies, seconds) in sorted(summary["workers"].items()):
+        rate = items / seconds if seconds else 0.0
+        plyRate = plies / seconds if seconds else 0.0
+        print(f"worker {pid}: {items} {unit} in {seconds:.2f}s busy, {rate:.0f} {unit}/s, {plyRate:.0f} plies/s", file=stream)
+    items, plies = summary["total"]
+    seconds = summary["seconds"]
+    print(f"total: {items} {unit}, {plies} plies in {seconds:.2f}s, {items / seconds if seconds else 0:.0f} {unit}/s", file=stream)
+    print("statuses: " + ", ".join(f"{status} {count}" for status, count in sorted(summary["statuses"].items())), file=stream)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay and classify games (PGN) or positions (one FEN per line) in parallel.")
+    parser.add_argument("paths", nargs="*", default=["-"], help="input files, standard input if none are given")
+    parser.add_argument("--format", choices=["pgn", "fen"],
+                        help="input format, guessed from the first file's extension (.fen/.epd are FEN) if not given")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, 0 for one per CPU")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="games or positions per task")
+    parser.add_argument("--output", help="file for the JSON lines, defaults to standard output")
+    args = parser.parse_args()
+    kind = args.format or ("fen" if os.path.splitext(args.paths[0])[1].lower() in (".fen", ".epd") else "pgn")
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        summary = run(args.paths, kind, out, args.workers, args.chunk_size)
+    finally:
+        if args.output:
+            out.close()
+    summary["kind"] = kind
+    report(summary)
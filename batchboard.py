@@ -0,0 +1,379 @@
+"""
+  Attack sets, check detection and legal move counts for many positions at once, for analytics jobs over millions of positions.
+  A PositionBatch holds N positions as NumPy arrays: an N x 12 array of uint64 bitboards in the same order as
+  Position.pieces, plus the side to move, castling rights and en passant square of each. Every operation works on
+  a whole column of bitboards at a time with shifts and masks, so the Python overhead is paid once per batch
+  instead of once per position. Sliding attacks use Kogge-Stone fills and moves are counted a direction at a
+  time rather than a piece at a time, so the cost doesn't depend on how many pieces a position has.
+
+  Legal move counts follow Position.legalMoves() exactly, including pins, check evasions, en passant and castling.
+  Needs NumPy. Run "python batchboard.py --positions 100000" to check the counts against Position on random positions
+  and compare the throughput.
+"""
+
+import numpy as np
+
+from bitboard import *
+
+ZERO = np.uint64(0)
+ONE = np.uint64(1)
+ALL = np.uint64(FULL)
+
+# what a step with a column change must mask out of the result, so pieces don't wrap around to the other edge
+COLUMN_MASKS = {
+    0: ALL,
+    1: np.uint64(~COL_MASKS[0] & FULL),
+    -1: np.uint64(~COL_MASKS[7] & FULL),
+    2: np.uint64(~(COL_MASKS[0] | COL_MASKS[1]) & FULL),
+    -2: np.uint64(~(COL_MASKS[6] | COL_MASKS[7]) & FULL),
+}
+
+# the rows a pawn of each color promotes on, and where its double push lands after the first step
+PROMOTION_ROWS = [np.uint64(ROW_MASKS[0]), np.uint64(ROW_MASKS[7])]
+DOUBLE_PUSH_ROWS = [np.uint64(ROW_MASKS[5]), np.uint64(ROW_MASKS[2])]
+FORWARD = [-1, 1]  # row direction pawns of each color move in
+PAWN_CAPTURES = [[(-1, -1), (-1, 1)], [(1, -1), (1, 1)]]
+
+
+def shift(bb, amount):
+    # towards higher squares for a positive amount
+    return bb << np.uint64(amount) if amount > 0 else bb >> np.uint64(-amount)
+
+
+def step(bb, direction):
+    """ Moves every bit one step in a (row, col) direction, dropping bits that would leave the board. """
+    x, y = direction
+    return shift(bb, x * 8 + y) & COLUMN_MASKS[y]
+
+
+def slide(bb, empty, direction):
+    """ Kogge-Stone fill: the squares each bit's slider reaches in one direction, up to and including the first blocker. """
+    x, y = direction
+    amount = x * 8 + y
+    mask = COLUMN_MASKS[y]
+    propagate = empty & mask
+    bb = bb | (propagate & shift(bb, amount))
+    propagate = propagate & shift(propagate, amount)
+    bb = bb | (propagate & shift(bb, 2 * amount))
+    propagate = propagate & shift(propagate, 2 * amount)
+    bb = bb | (propagate & shift(bb, 4 * amount))
+    return shift(bb, amount) & mask
+
+
+def slides(bb, empty, directions):
+    result = slide(bb, empty, directions[0])
+    for direction in directions[1:]:
+        result |= slide(bb, empty, direction)
+    return result
+
+
+def steps(bb, directions):
+    result = step(bb, directions[0])
+    for direction in directions[1:]:
+        result |= step(bb, direction)
+    return result
+
+
+if hasattr(np, "bitwise_count"):  # NumPy 2.0 and later
+    def popcount(bb):
+        return np.bitwise_count(bb)
+else:
+    def popcount(bb):
+        bb = bb - ((bb >> ONE) & np.uint64(0x5555555555555555))
+        bb = (bb & np.uint64(0x3333333333333333)) + ((bb >> np.uint64(2)) & np.uint64(0x3333333333333333))
+        bb = (bb + (bb >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return (bb * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def pieceAttacks(bb, ptype, color, empty):
+    """ The squares attacked by every piece in a column of bitboards, all of one type and color.
+
+    Args:
+        bb (np.ndarray): uint64 bitboards of the pieces.
+        ptype (int): PAWN through KING.
+        color (int): WHITE or BLACK, only matters for pawns.
+        empty (np.ndarray): uint64 bitboards of the empty squares, which sliders pass through.
+    """
+    if ptype == PAWN:
+        return steps(bb, PAWN_CAPTURES[color])
+    if ptype == KNIGHT:
+        return steps(bb, KNIGHT_DIRECTIONS)
+    if ptype == BISHOP:
+        return slides(bb, empty, BISHOP_DIRECTIONS)
+    if ptype == ROOK:
+        return slides(bb, empty, ROOK_DIRECTIONS)
+    if ptype == QUEEN:
+        return slides(bb, empty, KING_DIRECTIONS)
+    return steps(bb, KING_DIRECTIONS)
+
+
+class PositionBatch:
+    """ N positions stored as NumPy columns, with the same piece order and square numbering as bitboard.Position. """
+
+    def __init__(self, pieces, sides, castling=None, epSquares=None):
+        """
+        Args:
+            pieces (np.ndarray): N x 12 uint64 bitboards, indexed by color * 6 + piece type like Position.pieces.
+            sides (np.ndarray): N side to move values, WHITE or BLACK.
+            castling (np.ndarray, optional): N castling rights, bits as in Position.castling. Defaults to none.
+            epSquares (np.ndarray, optional): N en passant squares, -1 for none. Defaults to none.
+        """
+        self.pieces = np.ascontiguousarray(pieces, dtype=np.uint64)
+        count = len(self.pieces)
+        self.sides = np.asarray(sides, dtype=np.uint8)
+        self.castling = np.zeros(count, np.uint8) if castling is None else np.asarray(castling, dtype=np.uint8)
+        self.epSquares = np.full(count, -1, np.int8) if epSquares is None else np.asarray(epSquares, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.pieces)
+
+    @classmethod
+    def fromPositions(cls, positions):
+        """ Copies a list of Position objects into a batch. """
+        positions = list(positions)
+        return cls(np.array([position.pieces for position in positions], dtype=np.uint64).reshape(len(positions), 12),
+                   [position.side for position in positions], [position.castling for position in positions],
+                   [position.epSquare for position in positions])
+
+    @classmethod
+    def fromFens(cls, fens):
+        return cls.fromPositions(Position.fromFen(fen) for fen in fens)
+
+    @classmethod
+    def fromPlanes(cls, planes, sides, castling=None, epSquares=None):
+        """ Builds a batch from an N x 64 int8 array of piece codes per square, EMPTY (-1) for empty squares,
+            like Position.squares. The other arguments are the same as the constructor's.
+        """
+        planes = np.asarray(planes, dtype=np.int8)
+        pieces = np.empty((len(planes), 12), np.uint64)
+        for piece in range(12):
+            # bit n of byte k is square 8k + n, so the 8 bytes read as a little endian uint64 are the bitboard
+            packed = np.packbits(planes == piece, axis=1, bitorder="little")
+            pieces[:, piece] = np.ascontiguousarray(packed).view("<u8").reshape(len(planes))
+        return cls(pieces, sides, castling, epSquares)
+
+    def occupied(self, color=None):
+        """ The squares occupied by one color's pieces, or by both if no color is given. """
+        if color is None:
+            return np.bitwise_or.reduce(self.pieces, axis=1)
+        return np.bitwise_or.reduce(self.pieces[:, color * 6:color * 6 + 6], axis=1)
+
+    def attackSets(self):
+        """ The squares attacked by each of the 12 piece sets.
+
+        Returns:
+            np.ndarray: N x 12 uint64 bitboards, indexed like pieces.
+        """
+        empty = ~self.occupied()
+        result = np.empty_like(self.pieces)
+        for piece in range(12):
+            result[:, piece] = pieceAttacks(self.pieces[:, piece], piece % 6, piece // 6, empty)
+        return result
+
+    def attacks(self, color):
+        """ Every square one color attacks, as N uint64 bitboards. """
+        return attackMap(self.pieces, color, ~self.occupied())
+
+    def inCheck(self):
+        """ Whether the side to move is in check in each position.
+
+        Returns:
+            np.ndarray: N bools.
+        """
+        empty = ~self.occupied()
+        white = self.sides == WHITE
+        result = np.zeros(len(self), bool)
+        for color, rows in ((WHITE, white), (BLACK, ~white)):
+            if rows.any():
+                pieces = self.pieces[rows]
+                result[rows] = checkers(pieces, color, empty[rows]) != ZERO
+        return result
+
+    def legalMoveCounts(self):
+        """ The number of legal moves in each position, the same as len(Position.legalMoves()).
+
+        Returns:
+            np.ndarray: N int32 counts, 0 for checkmate and stalemate.
+        """
+        white = self.sides == WHITE
+        result = np.zeros(len(self), np.int32)
+        for color, rows in ((WHITE, white), (BLACK, ~white)):
+            if rows.any():
+                result[rows] = legalMoveCounts(self.pieces[rows], color, self.castling[rows], self.epSquares[rows])
+        return result
+
+
+def attackMap(pieces, color, empty):
+    # every square attacked by one color's pieces, with sliders stopped by anything not in empty
+    base = color * 6
+    result = pieceAttacks(pieces[:, base + PAWN], PAWN, color, empty)
+    result |= steps(pieces[:, base + KNIGHT], KNIGHT_DIRECTIONS)
+    result |= slides(pieces[:, base + BISHOP] | pieces[:, base + QUEEN], empty, BISHOP_DIRECTIONS)
+    result |= slides(pieces[:, base + ROOK] | pieces[:, base + QUEEN], empty, ROOK_DIRECTIONS)
+    result |= steps(pieces[:, base + KING], KING_DIRECTIONS)
+    return result
+
+
+def checkers(pieces, color, empty):
+    # the enemy pieces attacking color's King, found by looking out from the King as each kind of piece
+    them = (color ^ 1) * 6
+    king = pieces[:, color * 6 + KING]
+    return (steps(king, PAWN_CAPTURES[color]) & pieces[:, them + PAWN]) \
+        | (steps(king, KNIGHT_DIRECTIONS) & pieces[:, them + KNIGHT]) \
+        | (slides(king, empty, BISHOP_DIRECTIONS) & (pieces[:, them + BISHOP] | pieces[:, them + QUEEN])) \
+        | (slides(king, empty, ROOK_DIRECTIONS) & (pieces[:, them + ROOK] | pieces[:, them + QUEEN]))
+
+
+def axis(direction):
+    # the line a direction lies on, the same for a direction and its opposite
+    x, y = direction
+    return (x, y) if (x, y) > (-x, -y) else (-x, -y)
+
+
+def legalMoveCounts(pieces, color, castling, epSquares):
+    """ Counts the legal moves of positions that all have the same side to move, the way Position.legalMoves() finds them.
+        Moves are counted a direction at a time rather than a piece at a time: two sliders' rays in the same direction
+        can't overlap since each stops at the other, so one fill of all of them counts every slider move that way.
+        A pinned piece can only move along its pin, so it's left out of the fills in every other direction.
+
+    Args:
+        pieces (np.ndarray): N x 12 uint64 bitboards.
+        color (int): The side to move in every position.
+        castling (np.ndarray): N castling rights.
+        epSquares (np.ndarray): N en passant squares, -1 for none.
+
+    Returns:
+        np.ndarray: N int32 counts.
+    """
+    us, them = color * 6, (color ^ 1) * 6
+    own = np.bitwise_or.reduce(pieces[:, us:us + 6], axis=1)
+    enemy = np.bitwise_or.reduce(pieces[:, them:them + 6], axis=1)
+    occupied = own | enemy
+    empty = ~occupied
+    king = pieces[:, us + KING]
+    enemyDiagonal = pieces[:, them + BISHOP] | pieces[:, them + QUEEN]
+    enemyStraight = pieces[:, them + ROOK] | pieces[:, them + QUEEN]
+
+    # the King is taken off the board so it can't hide behind itself when stepping away from a slider
+    danger = attackMap(pieces, color ^ 1, empty | king)
+    count = popcount(steps(king, KING_DIRECTIONS) & ~own & ~danger).astype(np.int32)
+
+    # each ray out from the King gives a slider checking it, the line that check can be blocked on, and pins
+    attackers = (steps(king, PAWN_CAPTURES[color]) & pieces[:, them + PAWN]) \
+        | (steps(king, KNIGHT_DIRECTIONS) & pieces[:, them + KNIGHT])
+    checkLine = attackers.copy()
+    pinned = np.zeros_like(king)
+    pinnedOn = {}  # axis -> pieces pinned along it
+    for direction in KING_DIRECTIONS:
+        snipers = enemyDiagonal if direction in BISHOP_DIRECTIONS else enemyStraight
+        ray = slide(king, empty, direction)
+        checker = ray & snipers
+        attackers |= checker
+        checkLine |= np.where(checker != ZERO, ray, ZERO)
+        # looking through the first own piece on the ray, a sniper behind it pins it
+        blocker = ray & own
+        line = slide(king, empty | blocker, direction)
+        pin = np.where((line & ~ray & snipers) != ZERO, blocker, ZERO)
+        pinned |= pin
+        pinnedOn[axis(direction)] = pinnedOn.get(axis(direction), ZERO) | pin
+    checks = popcount(attackers)
+    # in double check only the King can move
+    targets = np.where(checks == 0, ~own, np.where(checks == 1, checkLine, ZERO))
+
+    def movable(bb, direction):
+        # the pieces of bb that can move in a direction: unpinned ones, and ones pinned along that direction's line
+        return bb & (~pinned | pinnedOn[axis(direction)])
+
+    # pawns, a promotion counts as four moves
+    pawns = pieces[:, us + PAWN]
+    forward = (FORWARD[color], 0)
+    promotion = PROMOTION_ROWS[color]
+    single = step(movable(pawns, forward), forward) & empty
+    double = step(single & DOUBLE_PUSH_ROWS[color], forward) & empty & targets
+    count += popcount(double)
+    for bb in [single & targets] + [step(movable(pawns, direction), direction) & enemy & targets
+                                    for direction in PAWN_CAPTURES[color]]:
+        count += popcount(bb & ~promotion) + 4 * popcount(bb & promotion).astype(np.int32)
+
+    # pinned knights can never move
+    knights = pieces[:, us + KNIGHT] & ~pinned
+    for direction in KNIGHT_DIRECTIONS:
+        count += popcount(step(knights, direction) & targets)
+    diagonal = pieces[:, us + BISHOP] | pieces[:, us + QUEEN]
+    straight = pieces[:, us + ROOK] | pieces[:, us + QUEEN]
+    for direction in KING_DIRECTIONS:
+        sliders = diagonal if direction in BISHOP_DIRECTIONS else straight
+        count += popcount(slide(movable(sliders, direction), empty, direction) & targets)
+
+    # en passant: the captured pawn and the capturing pawn both leave their squares, which can uncover the King,
+    # so it's checked like Position.isLegal() does, only for the few positions where a pawn can take en passant
+    rows = np.nonzero(epSquares >= 0)[0]
+    if len(rows):
+        target = ONE << epSquares[rows].astype(np.uint64)
+        candidates = steps(target, PAWN_CAPTURES[color ^ 1]) & pawns[rows]
+        rows, target = rows[candidates != ZERO], target[candidates != ZERO]
+    if len(rows):
+        captured = step(target, (-FORWARD[color], 0))
+        sliders = enemyDiagonal[rows], enemyStraight[rows]
+        # checks by a knight or pawn that capturing doesn't remove
+        others = attackers[rows] & ~captured & ~(sliders[0] | sliders[1])
+        for direction in PAWN_CAPTURES[color ^ 1]:
+            capturer = step(target, direction) & pawns[rows]
+            vacant = ~((occupied[rows] ^ capturer ^ captured) | target)
+            exposed = others | (slides(king[rows], vacant, BISHOP_DIRECTIONS) & sliders[0]) \
+                | (slides(king[rows], vacant, ROOK_DIRECTIONS) & sliders[1])
+            count[rows] += ((capturer != ZERO) & (exposed == ZERO)).astype(np.int32)
+
+    for right, kingFrom, _, _, _, between, crossing in CASTLING_MOVES:
+        if right not in ((WHITE_KINGSIDE, WHITE_QUEENSIDE), (BLACK_KINGSIDE, BLACK_QUEENSIDE))[color]:
+            continue
+        crossed = np.uint64((1 << crossing[0]) | (1 << crossing[1]))
+        count += (((castling & right) != 0) & (king == np.uint64(1 << kingFrom)) & (checks == 0)
+                  & ((occupied & np.uint64(between)) == ZERO) & ((danger & crossed) == ZERO)).astype(np.int32)
+    return count
+
+
+def randomPositions(count, seed=0, maxPlies=120):
+    """ Positions reached by random legal moves from the start, for checking and timing the batch functions. """
+    import random
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = Position.initial()
+        for _ in range(rng.randrange(maxPlies)):
+            moves = position.legalMoves()
+            if not moves:
+                break
+            position.makeMove(rng.choice(moves))
+        positions.append(position)
+    return positions
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Check the batch counts against Position and compare their throughput.")
+    parser.add_argument("--positions", type=int, default=100000, help="random positions to test")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # random games take a while to play out, so a few thousand are repeated up to the requested number
+    unique = randomPositions(min(args.positions, 5000), args.seed)
+    positions = [unique[index % len(unique)] for index in range(args.positions)]
+
+    start = time.perf_counter()
+    expectedChecks = [position.inCheck() for position in positions]
+    expectedCounts = [len(position.legalMoves()) for position in positions]
+    loopSeconds = time.perf_counter() - start
+
+    batch = PositionBatch.fromPositions(positions)
+    start = time.perf_counter()
+    checks = batch.inCheck()
+    counts = batch.legalMoveCounts()
+    batchSeconds = time.perf_counter() - start
+
+    mismatches = int((checks != np.array(expectedChecks)).sum() + (counts != np.array(expectedCounts)).sum())
+    print(f"{len(positions)} positions, {mismatches} mismatches")
+    print(f"Position loop: {loopSeconds:.2f}s, {len(positions) / loopSeconds:.0f} positions/s")
+    print(f"PositionBatch: {batchSeconds:.2f}s, {len(positions) / batchSeconds:.0f} positions/s, "
+          f"{loopSeconds / batchSeconds:.1f}x faster")
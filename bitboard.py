@@ -0,0 +1,956 @@
+"""
+  Bitboard position and move generator used for the chess rules.
+  Squares are numbered row * 8 + col so they line up with board[row][col] in board.py.
+  Square 0 is the top-left corner (black's queen side rook) and square 63 is white's king side rook.
+  Player 0 (white) moves towards row 0 and player 1 (black) moves towards row 7, just like in pieces.py.
+"""
+
+import struct
+
+WHITE, BLACK = 0, 1
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+EMPTY = -1
+
+FULL = (1 << 64) - 1
+
+# move flags, a move is stored as an int: fromSquare | toSquare << 6 | flag << 12
+QUIET, DOUBLE_PUSH, CASTLE, EN_PASSANT = 0, 1, 2, 3
+PROMOTE_KNIGHT, PROMOTE_BISHOP, PROMOTE_ROOK, PROMOTE_QUEEN = 4, 5, 6, 7
+
+NULL_MOVE = 0  # a1 to a1, which is never a real move
+
+# castling rights bits
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+
+CASTLING_LETTERS = "KQkq"  # FEN letters for the castling rights bits, lowest bit first
+
+# Position.pack() layout: occupied squares, a 4 bit piece code per occupied square (lowest square first, two per byte),
+# side to move and castling rights, en passant square (0xFF for none), halfmove clock, fullmove number
+PACKED = struct.Struct("!Q16sBBHH")
+PACKED_POSITION_SIZE = 26  # the leading bytes that identify the position without its move counters
+
+ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+KNIGHT_DIRECTIONS = [(-2, 1), (2, -1), (-2, -1), (2, 1),
+                     (1, 2), (-1, -2), (-1, 2), (1, -2)]
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+def square(row, col):
+    return row * 8 + col
+
+
+def coords(sq):
+    return divmod(sq, 8)
+
+
+def squareName(sq):
+    # algebraic name, row 0 is the 8th rank
+    return "abcdefgh"[sq % 8] + str(8 - sq // 8)
+
+
+def parseSquare(name):
+    # the inverse of squareName, e.g. "e4" -> 36
+    if len(name) != 2 or name[0] not in "abcdefgh" or name[1] not in "12345678":
+        raise ValueError(f"Invalid square: {name!r}")
+    return square(8 - int(name[1]), ord(name[0]) - ord("a"))
+
+
+def encodeMove(fromSquare, toSquare, flag=QUIET):
+    return fromSquare | toSquare << 6 | flag << 12
+
+
+def moveFrom(move):
+    return move & 63
+
+
+def moveTo(move):
+    return (move >> 6) & 63
+
+
+def moveFlag(move):
+    return move >> 12
+
+
+def squares(bb):
+    """ Yields the index of every set bit in a bitboard, lowest first. """
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def _stepTable(directions):
+    table = []
+    for sq in range(64):
+        row, col = coords(sq)
+        bb = 0
+        for x, y in directions:
+            if 0 <= row + x < 8 and 0 <= col + y < 8:
+                bb |= 1 << square(row + x, col + y)
+        table.append(bb)
+    return table
+
+
+def _rayTable(direction):
+    table = []
+    x, y = direction
+    for sq in range(64):
+        row, col = coords(sq)
+        bb = 0
+        row, col = row + x, col + y
+        while 0 <= row < 8 and 0 <= col < 8:
+            bb |= 1 << square(row, col)
+            row, col = row + x, col + y
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _stepTable(KNIGHT_DIRECTIONS)
+KING_ATTACKS = _stepTable(KING_DIRECTIONS)
+PAWN_ATTACKS = [_stepTable([(-1, -1), (-1, 1)]),  # squares attacked by a white pawn
+                _stepTable([(1, -1), (1, 1)])]    # squares attacked by a black pawn
+RAYS = {direction: _rayTable(direction) for direction in KING_DIRECTIONS}
+
+# a direction is positive when it walks towards higher square numbers, so its nearest blocker is the lowest bit
+POSITIVE = {direction: direction[0] * 8 + direction[1] > 0 for direction in KING_DIRECTIONS}
+
+ROW_MASKS = [0xFF << (8 * row) for row in range(8)]
+COL_MASKS = [0x0101010101010101 << col for col in range(8)]
+
+
+def rayAttacks(sq, occupied, directions):
+    """ Walks the precomputed rays from sq and cuts each one off behind its first blocker.
+
+    Args:
+        sq (int): The square the sliding piece is on.
+        occupied (int): Bitboard of every occupied square.
+        directions (list[tuple]): The directions the piece slides in.
+
+    Returns:
+        int: Bitboard of the attacked squares, including the blockers themselves.
+    """
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][sq]
+        blockers = ray & occupied
+        if blockers:
+            if POSITIVE[direction]:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+
+def _relevantMask(sq, directions):
+    # the last square of each ray never changes the attack set, so it's left out of the lookup key
+    mask = 0
+    for direction in directions:
+        ray = RAYS[direction][sq]
+        if ray:
+            last = ray.bit_length() - 1 if POSITIVE[direction] else (ray & -ray).bit_length() - 1
+            mask |= ray ^ (1 << last)
+    return mask
+
+
+class _SlidingTable(dict):
+    """
+        Maps the relevant occupancy around one square to its attack set.
+        Entries are filled the first time an occupancy is seen, so importing the module stays cheap
+        and the table only ever grows to the occupancies that actually show up in games.
+    """
+
+    def __init__(self, sq, directions):
+        super().__init__()
+        self.sq = sq
+        self.directions = directions
+
+    def __missing__(self, occupied):
+        attacks = rayAttacks(self.sq, occupied, self.directions)
+        self[occupied] = attacks
+        return attacks
+
+
+def _betweenTable():
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for x, y in KING_DIRECTIONS:
+            row, col = coords(sq)
+            row, col = row + x, col + y
+            between = 0
+            while 0 <= row < 8 and 0 <= col < 8:
+                table[sq][square(row, col)] = between
+                between |= 1 << square(row, col)
+                row, col = row + x, col + y
+    return table
+
+
+# BETWEEN[a][b] holds the squares strictly between two squares on the same line, and 0 otherwise
+BETWEEN = _betweenTable()
+
+ROOK_MASKS = [_relevantMask(sq, ROOK_DIRECTIONS) for sq in range(64)]
+BISHOP_MASKS = [_relevantMask(sq, BISHOP_DIRECTIONS) for sq in range(64)]
+ROOK_TABLES = [_SlidingTable(sq, ROOK_DIRECTIONS) for sq in range(64)]
+BISHOP_TABLES = [_SlidingTable(sq, BISHOP_DIRECTIONS) for sq in range(64)]
+ROOK_LINES = [rayAttacks(sq, 0, ROOK_DIRECTIONS) for sq in range(64)]
+BISHOP_LINES = [rayAttacks(sq, 0, BISHOP_DIRECTIONS) for sq in range(64)]
+
+
+def rookAttacks(sq, occupied):
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]]
+
+
+def bishopAttacks(sq, occupied):
+    return BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+
+def queenAttacks(sq, occupied):
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] | BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+
+# castling: (right, king from, king to, rook from, rook to, squares that must be empty, squares the king crosses)
+CASTLING_MOVES = [
+    (WHITE_KINGSIDE, 60, 62, 63, 61, (1 << 61) | (1 << 62), (61, 62)),
+    (WHITE_QUEENSIDE, 60, 58, 56, 59, (1 << 57) | (1 << 58) | (1 << 59), (59, 58)),
+    (BLACK_KINGSIDE, 4, 6, 7, 5, (1 << 5) | (1 << 6), (5, 6)),
+    (BLACK_QUEENSIDE, 4, 2, 0, 3, (1 << 1) | (1 << 2) | (1 << 3), (3, 2)),
+]
+
+# castling rights that survive a move touching the square, e.g. moving the a1 rook drops white's queen side right
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASKS[63] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASKS[56] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASKS[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASKS[7] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASKS[0] = 15 & ~BLACK_QUEENSIDE
+
+PROMOTION_FLAGS = (PROMOTE_QUEEN, PROMOTE_ROOK, PROMOTE_BISHOP, PROMOTE_KNIGHT)
+
+# where the rook goes for each castling move, keyed by the King's destination
+CASTLING_ROOKS = {kingTo: (rookFrom, rookTo) for _, _, kingTo, rookFrom, rookTo, _, _ in CASTLING_MOVES}
+
+
+def _zobristKeys(seed=0x5EED):
+    # fixed seed so hashes are the same in every process and can be stored on disk
+    import random
+    generator = random.Random(seed)
+    pieceKeys = [[generator.getrandbits(64) for _ in range(64)] for _ in range(12)]
+    castlingKeys = [generator.getrandbits(64) for _ in range(16)]
+    epKeys = [generator.getrandbits(64) for _ in range(8)]
+    return pieceKeys, castlingKeys, epKeys, generator.getrandbits(64)
+
+
+class IllegalPosition(ValueError):
+    """ A well formed FEN describing a position that can't occur in a game, e.g. with a missing king. """
+
+
+# Zobrist keys: one per piece and square, castling rights value, en passant column, and one for black to move
+ZOBRIST_PIECES, ZOBRIST_CASTLING, ZOBRIST_EP, ZOBRIST_SIDE = _zobristKeys()
+
+
+class Position:
+    """
+        A chess position stored as one bitboard per color and piece type.
+        pieces[color * 6 + pieceType] holds the bitboard for that piece, and squares[sq] holds the same
+        information per square (EMPTY or color * 6 + pieceType) so captures can be looked up directly.
+    """
+
+    def __init__(self):
+        self.pieces = [0] * 12
+        self.occupied = [0, 0]
+        self.squares = [EMPTY] * 64
+        self.side = WHITE
+        self.castling = 0
+        self.epSquare = -1
+        self.halfmoveClock = 0
+        self.fullmoveNumber = 1
+        self.history = []
+        self.hash = 0
+
+    @classmethod
+    def initial(cls):
+        # same setup as Board.restartPieces()
+        position = cls()
+        backRow = [ROOK, KNIGHT, BISHOP, QUEEN, KING, BISHOP, KNIGHT, ROOK]
+        for col in range(8):
+            position.putPiece(BLACK, backRow[col], square(0, col))
+            position.putPiece(BLACK, PAWN, square(1, col))
+            position.putPiece(WHITE, PAWN, square(6, col))
+            position.putPiece(WHITE, backRow[col], square(7, col))
+        position.castling = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        position.hash = position.computeHash()
+        return position
+
+    @classmethod
+    def fromFen(cls, fen):
+        """ Builds a position from a FEN string.
+
+        Args:
+            fen (str): The FEN record. The move counters may be left off.
+
+        Returns:
+            Position: The position the FEN describes.
+
+        Raises:
+            ValueError: If the FEN is malformed.
+            IllegalPosition: If it doesn't have one king per side, or has castling rights or an en passant square
+                the position can't have.
+        """
+        fields = fen.split()
+        rows = fields[0].split("/") if fields else []
+        if len(fields) not in (4, 6) or len(rows) != 8 or fields[1] not in ("w", "b"):
+            raise ValueError(f"Invalid FEN: {fen!r}")
+        position = cls()
+        for row, text in enumerate(rows):
+            col = 0
+            for char in text:
+                if char in "12345678":
+                    col += int(char)
+                elif char.lower() in "pnbrqk" and col < 8:
+                    color = WHITE if char.isupper() else BLACK
+                    position.putPiece(color, "pnbrqk".index(char.lower()), square(row, col))
+                    col += 1
+                else:
+                    raise ValueError(f"Invalid FEN: {fen!r}")
+            if col != 8:
+                raise ValueError(f"Invalid FEN: {fen!r}")
+        # positions without exactly one King per side break every check and move generation routine
+        if any(bin(position.pieces[color * 6 + KING]).count("1") != 1 for color in (WHITE, BLACK)):
+            raise IllegalPosition(f"Impossible position in FEN, each side needs exactly one king: {fen!r}")
+        position.side = WHITE if fields[1] == "w" else BLACK
+        if fields[2] != "-":
+            if not fields[2] or any(char not in CASTLING_LETTERS for char in fields[2]) \
+                    or len(set(fields[2])) != len(fields[2]):
+                raise ValueError(f"Invalid FEN castling rights: {fen!r}")
+            for bit, char in enumerate(CASTLING_LETTERS):
+                if char in fields[2]:
+                    position.castling |= 1 << bit
+            # a right is only real if its King and Rook are still on their home squares
+            for right, kingFrom, _, rookFrom, _, _, _ in CASTLING_MOVES:
+                color = WHITE if right in (WHITE_KINGSIDE, WHITE_QUEENSIDE) else BLACK
+                if position.castling & right and (position.squares[kingFrom] != color * 6 + KING
+                                                  or position.squares[rookFrom] != color * 6 + ROOK):
+                    raise IllegalPosition(f"Impossible castling rights in FEN: {fen!r}")
+        if fields[3] != "-":
+            epSquare = parseSquare(fields[3])
+            # the square a pawn of the side not to move just passed with a double push: the pawn is in front of it
+            # and the square it came from is empty again
+            forward = -8 if position.side == WHITE else 8
+            enemyPawn = (position.side ^ 1) * 6 + PAWN
+            if epSquare // 8 != (2 if position.side == WHITE else 5) or position.squares[epSquare] != EMPTY \
+                    or position.squares[epSquare - forward] != enemyPawn \
+                    or position.squares[epSquare + forward] != EMPTY:
+                raise IllegalPosition(f"Impossible en passant square in FEN: {fen!r}")
+            position.epSquare = epSquare
+        if len(fields) > 5:
+            try:
+                position.halfmoveClock, position.fullmoveNumber = int(fields[4]), int(fields[5])
+            except ValueError:
+                raise ValueError(f"Invalid FEN: {fen!r}")
+        position.hash = position.computeHash()
+        return position
+
+    def toFen(self):
+        """ Writes the position as a FEN string, including the castling rights, en passant square and move counters. """
+        rows = []
+        for row in range(8):
+            text, empty = "", 0
+            for piece in self.squares[row * 8:row * 8 + 8]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                letter = "pnbrqk"[piece % 6]
+                text += letter.upper() if piece < 6 else letter
+            rows.append(text + (str(empty) if empty else ""))
+        castling = "".join(char for bit, char in enumerate(CASTLING_LETTERS) if self.castling & 1 << bit) or "-"
+        enPassant = squareName(self.epSquare) if self.epSquare >= 0 else "-"
+        return f"{'/'.join(rows)} {'wb'[self.side]} {castling} {enPassant} {self.halfmoveClock} {self.fullmoveNumber}"
+
+    def pack(self):
+        """ Encodes the position in PACKED.size (30) bytes, e.g. for storing millions of positions or sending them in bulk.
+            The first PACKED_POSITION_SIZE bytes leave out the move counters, so they can be used as a key for the position itself.
+
+        Returns:
+            bytes: The packed position, see unpack().
+        """
+        occupied = self.occupied[0] | self.occupied[1]
+        codes = [self.squares[sq] for sq in squares(occupied)]
+        if len(codes) > 32:
+            raise ValueError("Can't pack a position with more than 32 pieces")
+        codes += [0] * (32 - len(codes))
+        nibbles = bytes(codes[index] << 4 | codes[index + 1] for index in range(0, 32, 2))
+        return PACKED.pack(occupied, nibbles, self.side << 7 | self.castling, self.epSquare & 0xFF,
+                           min(self.halfmoveClock, 0xFFFF), min(self.fullmoveNumber, 0xFFFF))
+
+    @classmethod
+    def unpack(cls, data):
+        """ Rebuilds a position from pack()'s bytes. """
+        occupied, nibbles, flags, epSquare, halfmoveClock, fullmoveNumber = PACKED.unpack(data)
+        position = cls()
+        for index, sq in enumerate(squares(occupied)):
+            piece = nibbles[index >> 1] >> (0 if index & 1 else 4) & 15
+            position.putPiece(piece // 6, piece % 6, sq)
+        position.side = flags >> 7
+        position.castling = flags & 15
+        position.epSquare = -1 if epSquare == 0xFF else epSquare
+        position.halfmoveClock, position.fullmoveNumber = halfmoveClock, fullmoveNumber
+        position.hash = position.computeHash()
+        return position
+
+    def copy(self):
+        position = Position()
+        position.pieces = self.pieces[:]
+        position.occupied = self.occupied[:]
+        position.squares = self.squares[:]
+        position.side = self.side
+        position.castling = self.castling
+        position.epSquare = self.epSquare
+        position.halfmoveClock = self.halfmoveClock
+        position.fullmoveNumber = self.fullmoveNumber
+        position.history = self.history[:]
+        position.hash = self.hash
+        return position
+
+    def computeHash(self):
+        """ Computes the Zobrist hash from scratch. makeMove() and unmakeMove() keep self.hash up to date incrementally. """
+        key = ZOBRIST_CASTLING[self.castling]
+        for sq, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                key ^= ZOBRIST_PIECES[piece][sq]
+        if self.epSquare >= 0:
+            key ^= ZOBRIST_EP[self.epSquare % 8]
+        if self.side == BLACK:
+            key ^= ZOBRIST_SIDE
+        return key
+
+    def repetitions(self):
+        """ Counts how many earlier positions since the last capture or pawn move are the same as this one. """
+        count = 0
+        history = self.history
+        # only positions with the same side to move can repeat, and nothing before an irreversible move can
+        for index in range(len(history) - 2, max(len(history) - self.halfmoveClock, 0) - 2, -2):
+            if history[index][5] == self.hash:
+                count += 1
+        return count
+
+    def putPiece(self, color, pieceType, sq):
+        bit = 1 << sq
+        self.pieces[color * 6 + pieceType] |= bit
+        self.occupied[color] |= bit
+        self.squares[sq] = color * 6 + pieceType
+        self.hash ^= ZOBRIST_PIECES[color * 6 + pieceType][sq]
+
+    def removePiece(self, sq):
+        piece = self.squares[sq]
+        if piece != EMPTY:
+            bit = 1 << sq
+            self.pieces[piece] ^= bit
+            self.occupied[piece // 6] ^= bit
+            self.squares[sq] = EMPTY
+            self.hash ^= ZOBRIST_PIECES[piece][sq]
+        return piece
+
+    def makeMove(self, move):
+        """ Applies a legal move to the position in place and pushes an undo record onto self.history.
+            The record is a small tuple (move, captured piece, castling rights, en passant square, halfmove clock, hash),
+            which is everything unmakeMove() needs to restore the position exactly. The Zobrist hash is updated
+            by XORing out the keys for what changed and XORing in the new ones.
+
+        Args:
+            move (int): An encoded move from legalMoves().
+
+        Returns:
+            int: The captured piece (color * 6 + pieceType), or EMPTY if nothing was captured.
+        """
+        frm, to, flag = move & 63, (move >> 6) & 63, move >> 12
+        us = self.side
+        pieces, occupied, board = self.pieces, self.occupied, self.squares
+        piece = board[frm]
+        captured = board[to]
+        fromBit, toBit = 1 << frm, 1 << to
+        self.history.append((move, captured, self.castling, self.epSquare, self.halfmoveClock, self.hash))
+        key = self.hash ^ ZOBRIST_PIECES[piece][frm] ^ ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_SIDE
+        if self.epSquare >= 0:
+            key ^= ZOBRIST_EP[self.epSquare % 8]
+
+        if captured != EMPTY:
+            pieces[captured] ^= toBit
+            occupied[us ^ 1] ^= toBit
+            key ^= ZOBRIST_PIECES[captured][to]
+        newPiece = us * 6 + flag - PROMOTE_KNIGHT + KNIGHT if flag >= PROMOTE_KNIGHT else piece
+        pieces[piece] ^= fromBit
+        pieces[newPiece] |= toBit
+        occupied[us] ^= fromBit | toBit
+        board[frm] = EMPTY
+        board[to] = newPiece
+        key ^= ZOBRIST_PIECES[newPiece][to]
+
+        if flag == EN_PASSANT:
+            pawnSquare = to + 8 if us == WHITE else to - 8
+            captured = board[pawnSquare]
+            assert captured != EMPTY, "en passant without a pawn to capture"
+            board[pawnSquare] = EMPTY
+            pieces[captured] ^= 1 << pawnSquare
+            occupied[us ^ 1] ^= 1 << pawnSquare
+            key ^= ZOBRIST_PIECES[captured][pawnSquare]
+        elif flag == CASTLE:
+            rookFrom, rookTo = CASTLING_ROOKS[to]
+            rook = board[rookFrom]
+            pieces[rook] ^= (1 << rookFrom) | (1 << rookTo)
+            occupied[us] ^= (1 << rookFrom) | (1 << rookTo)
+            board[rookFrom] = EMPTY
+            board[rookTo] = rook
+            key ^= ZOBRIST_PIECES[rook][rookFrom] ^ ZOBRIST_PIECES[rook][rookTo]
+
+        self.castling &= CASTLING_MASKS[frm] & CASTLING_MASKS[to]
+        key ^= ZOBRIST_CASTLING[self.castling]
+        if flag == DOUBLE_PUSH:
+            self.epSquare = (frm + to) // 2
+            key ^= ZOBRIST_EP[to % 8]
+        else:
+            self.epSquare = -1
+        self.hash = key
+        if piece % 6 == PAWN or captured != EMPTY:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if us == BLACK:
+            self.fullmoveNumber += 1
+        self.side = us ^ 1
+        return captured
+
+    def makeNullMove(self):
+        """ Passes the turn without moving, for null move pruning in engine.py. Undo it with unmakeNullMove(). """
+        self.history.append((NULL_MOVE, EMPTY, self.castling, self.epSquare, self.halfmoveClock, self.hash))
+        key = self.hash ^ ZOBRIST_SIDE
+        if self.epSquare >= 0:
+            key ^= ZOBRIST_EP[self.epSquare % 8]
+            self.epSquare = -1
+        self.hash = key
+        self.halfmoveClock = 0  # so repetitions() doesn't look back across the null move
+        self.side ^= 1
+
+    def unmakeNullMove(self):
+        _, _, self.castling, self.epSquare, self.halfmoveClock, self.hash = self.history.pop()
+        self.side ^= 1
+
+    def unmakeMove(self):
+        """ Takes back the last move applied with makeMove().
+
+        Returns:
+            int: The move that was taken back.
+        """
+        move, captured, self.castling, self.epSquare, self.halfmoveClock, self.hash = self.history.pop()
+        frm, to, flag = move & 63, (move >> 6) & 63, move >> 12
+        us = self.side ^ 1
+        self.side = us
+        if us == BLACK:
+            self.fullmoveNumber -= 1
+        pieces, occupied, board = self.pieces, self.occupied, self.squares
+        fromBit, toBit = 1 << frm, 1 << to
+
+        piece = board[to]
+        original = us * 6 + PAWN if flag >= PROMOTE_KNIGHT else piece
+        pieces[piece] ^= toBit
+        pieces[original] |= fromBit
+        occupied[us] ^= fromBit | toBit
+        board[frm] = original
+        board[to] = captured
+        if captured != EMPTY:
+            pieces[captured] |= toBit
+            occupied[us ^ 1] |= toBit
+
+        if flag == EN_PASSANT:
+            pawnSquare = to + 8 if us == WHITE else to - 8
+            pawn = (us ^ 1) * 6 + PAWN
+            board[pawnSquare] = pawn
+            pieces[pawn] |= 1 << pawnSquare
+            occupied[us ^ 1] |= 1 << pawnSquare
+        elif flag == CASTLE:
+            rookFrom, rookTo = CASTLING_ROOKS[to]
+            rook = board[rookTo]
+            pieces[rook] ^= (1 << rookFrom) | (1 << rookTo)
+            occupied[us] ^= (1 << rookFrom) | (1 << rookTo)
+            board[rookTo] = EMPTY
+            board[rookFrom] = rook
+        return move
+
+    def pieceAt(self, sq):
+        """ Returns a (color, pieceType) tuple for the piece on sq, or None if the square is empty. """
+        piece = self.squares[sq]
+        return None if piece == EMPTY else divmod(piece, 6)
+
+    def kingSquare(self, color):
+        return self.pieces[color * 6 + KING].bit_length() - 1
+
+    def attackersTo(self, sq, occupied, color):
+        """ Finds every piece of the given color that attacks sq when the board has the given occupancy.
+
+        Returns:
+            int: Bitboard of the attacking pieces.
+        """
+        pieces = self.pieces
+        base = color * 6
+        queens = pieces[base + QUEEN]
+        return (PAWN_ATTACKS[color ^ 1][sq] & pieces[base + PAWN]) \
+            | (KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT]) \
+            | (KING_ATTACKS[sq] & pieces[base + KING]) \
+            | (BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]] & (pieces[base + BISHOP] | queens)) \
+            | (ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] & (pieces[base + ROOK] | queens))
+
+    def isAttacked(self, sq, color):
+        return self.attackersTo(sq, self.occupied[0] | self.occupied[1], color) != 0
+
+    def inCheck(self, color=None):
+        color = self.side if color is None else color
+        return self.isAttacked(self.kingSquare(color), color ^ 1)
+
+    def attackMap(self, color, occupied=None):
+        """ Finds every square the given color attacks, using set-wise shifts for pawns and table lookups for the rest.
+
+        Args:
+            color (int): The player whose attacks are collected.
+            occupied (int, optional): Occupancy to slide through. Defaults to the current occupancy.
+
+        Returns:
+            int: Bitboard of attacked squares.
+        """
+        if occupied is None:
+            occupied = self.occupied[0] | self.occupied[1]
+        pieces = self.pieces
+        base = color * 6
+        pawns = pieces[base + PAWN]
+        if color == WHITE:
+            attacks = ((pawns & ~COL_MASKS[0]) >> 9) | ((pawns & ~COL_MASKS[7]) >> 7)
+        else:
+            attacks = (((pawns & ~COL_MASKS[0]) << 7) | ((pawns & ~COL_MASKS[7]) << 9)) & FULL
+        for sq in squares(pieces[base + KNIGHT]):
+            attacks |= KNIGHT_ATTACKS[sq]
+        for sq in squares(pieces[base + BISHOP] | pieces[base + QUEEN]):
+            attacks |= BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+        for sq in squares(pieces[base + ROOK] | pieces[base + QUEEN]):
+            attacks |= ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]]
+        return attacks | KING_ATTACKS[self.kingSquare(color)]
+
+    def checkers(self, color=None):
+        """ Returns a bitboard of the enemy pieces giving check to the given color's King (the side to move by default). """
+        color = self.side if color is None else color
+        return self.attackersTo(self.kingSquare(color), self.occupied[0] | self.occupied[1], color ^ 1)
+
+    def pins(self, color=None):
+        """ Finds the pieces pinned to the given color's King.
+
+        Returns:
+            tuple[int, dict]: Bitboard of pinned pieces, and for each pinned square the ray it may still move along
+                (the squares between the King and the pinning piece, plus the pinning piece itself).
+        """
+        color = self.side if color is None else color
+        them = (color ^ 1) * 6
+        pieces = self.pieces
+        own = self.occupied[color]
+        occupied = own | self.occupied[color ^ 1]
+        king = self.kingSquare(color)
+        snipers = (ROOK_LINES[king] & (pieces[them + ROOK] | pieces[them + QUEEN])) \
+            | (BISHOP_LINES[king] & (pieces[them + BISHOP] | pieces[them + QUEEN]))
+        pinned = 0
+        rays = {}
+        for sniper in squares(snipers):
+            blockers = BETWEEN[king][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinned |= blockers
+                rays[blockers.bit_length() - 1] = BETWEEN[king][sniper] | (1 << sniper)
+        return pinned, rays
+
+    def pseudoLegalMoves(self):
+        """ Generates every move for the side to move without testing whether it leaves the King in check.
+
+        Returns:
+            list[int]: The encoded moves.
+        """
+        moves = []
+        append = moves.append
+        us = self.side
+        them = us ^ 1
+        base = us * 6
+        pieces = self.pieces
+        own = self.occupied[us]
+        enemy = self.occupied[them]
+        occupied = own | enemy
+        empty = ~occupied & FULL
+        targets = ~own & FULL
+
+        # pawns are generated set-wise with shifts, then split into moves
+        pawns = pieces[base + PAWN]
+        if us == WHITE:
+            single = (pawns >> 8) & empty
+            double = ((single & ROW_MASKS[5]) >> 8) & empty
+            left = ((pawns & ~COL_MASKS[0]) >> 9) & enemy
+            right = ((pawns & ~COL_MASKS[7]) >> 7) & enemy
+            forward, leftStep, rightStep, promotionRow = -8, -9, -7, ROW_MASKS[0]
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & ROW_MASKS[2]) << 8) & empty
+            left = ((pawns & ~COL_MASKS[0]) << 7) & enemy
+            right = ((pawns & ~COL_MASKS[7]) << 9) & enemy
+            forward, leftStep, rightStep, promotionRow = 8, 7, 9, ROW_MASKS[7]
+
+        for bb, step in ((single, forward), (left, leftStep), (right, rightStep)):
+            for to in squares(bb & ~promotionRow):
+                append((to - step) | to << 6)
+            for to in squares(bb & promotionRow):
+                for flag in PROMOTION_FLAGS:
+                    append((to - step) | to << 6 | flag << 12)
+        for to in squares(double):
+            append((to - 2 * forward) | to << 6 | DOUBLE_PUSH << 12)
+        if self.epSquare >= 0:
+            for frm in squares(PAWN_ATTACKS[them][self.epSquare] & pawns):
+                append(frm | self.epSquare << 6 | EN_PASSANT << 12)
+
+        for frm in squares(pieces[base + KNIGHT]):
+            for to in squares(KNIGHT_ATTACKS[frm] & targets):
+                append(frm | to << 6)
+        for frm in squares(pieces[base + BISHOP]):
+            for to in squares(bishopAttacks(frm, occupied) & targets):
+                append(frm | to << 6)
+        for frm in squares(pieces[base + ROOK]):
+            for to in squares(rookAttacks(frm, occupied) & targets):
+                append(frm | to << 6)
+        for frm in squares(pieces[base + QUEEN]):
+            for to in squares(queenAttacks(frm, occupied) & targets):
+                append(frm | to << 6)
+        king = self.kingSquare(us)
+        for to in squares(KING_ATTACKS[king] & targets):
+            append(king | to << 6)
+
+        for right, kingFrom, kingTo, _, _, between, crossing in CASTLING_MOVES:
+            if self.castling & right and kingFrom == king and not (occupied & between):
+                append(kingFrom | kingTo << 6 | CASTLE << 12)
+        return moves
+
+    def isLegal(self, move):
+        """ Tests a pseudo legal move by checking if the mover's King would be attacked afterwards.
+
+        Args:
+            move (int): An encoded move from pseudoLegalMoves().
+
+        Returns:
+            bool: True if the move doesn't leave the King in check.
+        """
+        us = self.side
+        them = us ^ 1
+        frm, to, flag = move & 63, (move >> 6) & 63, move >> 12
+        occupied = self.occupied[0] | self.occupied[1]
+
+        if flag == CASTLE:
+            # the King can't castle out of, through, or into check
+            if self.attackersTo(frm, occupied, them):
+                return False
+            crossing = to + 1 if to < frm else to - 1
+            return not self.attackersTo(crossing, occupied, them) and not self.attackersTo(to, occupied, them)
+
+        captured = 1 << to
+        occupied = (occupied & ~(1 << frm)) | captured
+        if flag == EN_PASSANT:
+            captured = 1 << (to + 8 if us == WHITE else to - 8)
+            occupied &= ~captured
+        king = to if self.squares[frm] == us * 6 + KING else self.kingSquare(us)
+        return not (self.attackersTo(king, occupied, them) & ~captured)
+
+    def legalMoves(self, capturesOnly=False):
+        """ Generates the legal moves for the side to move.
+            The checkers, pinned pieces, and enemy attack map are worked out once up front, so only en passant
+            captures still need the full isLegal() test.
+
+        Args:
+            capturesOnly (bool, optional): Only generate captures and promotions, e.g. for a quiescence search. Defaults to False.
+
+        Returns:
+            list[int]: The encoded moves.
+        """
+        moves = []
+        append = moves.append
+        us = self.side
+        them = us ^ 1
+        base = us * 6
+        pieces = self.pieces
+        own = self.occupied[us]
+        enemy = self.occupied[them]
+        occupied = own | enemy
+        empty = ~occupied & FULL
+        king = self.kingSquare(us)
+
+        # the King is taken off the board so it can't hide behind itself when stepping away from a slider
+        danger = self.attackMap(them, occupied ^ (1 << king))
+        captureMask = enemy if capturesOnly else FULL
+        for to in squares(KING_ATTACKS[king] & ~own & ~danger & captureMask):
+            append(king | to << 6)
+
+        checkers = self.attackersTo(king, occupied, them)
+        if checkers & (checkers - 1):  # double check, only the King can move
+            return moves
+        if checkers:
+            targets = BETWEEN[king][checkers.bit_length() - 1] | checkers
+        else:
+            targets = ~own & FULL
+        pinned, rays = self.pins(us)
+
+        pawns = pieces[base + PAWN]
+        if us == WHITE:
+            single = (pawns >> 8) & empty
+            double = ((single & ROW_MASKS[5]) >> 8) & empty & targets
+            left = ((pawns & ~COL_MASKS[0]) >> 9) & enemy & targets
+            right = ((pawns & ~COL_MASKS[7]) >> 7) & enemy & targets
+            forward, leftStep, rightStep, promotionRow = -8, -9, -7, ROW_MASKS[0]
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & ROW_MASKS[2]) << 8) & empty & targets
+            left = ((pawns & ~COL_MASKS[0]) << 7) & enemy & targets
+            right = ((pawns & ~COL_MASKS[7]) << 9) & enemy & targets
+            forward, leftStep, rightStep, promotionRow = 8, 7, 9, ROW_MASKS[7]
+        single &= targets
+        if capturesOnly:  # pushes only count when they promote
+            single &= promotionRow
+            double = 0
+        targets &= captureMask
+
+        for bb, step in ((single, forward), (left, leftStep), (right, rightStep), (double, 2 * forward)):
+            for to in squares(bb):
+                frm = to - step
+                if (1 << frm) & pinned and not (1 << to) & rays[frm]:
+                    continue
+                if (1 << to) & promotionRow:
+                    for flag in PROMOTION_FLAGS:
+                        append(frm | to << 6 | flag << 12)
+                elif step == 2 * forward:
+                    append(frm | to << 6 | DOUBLE_PUSH << 12)
+                else:
+                    append(frm | to << 6)
+        if self.epSquare >= 0:
+            for frm in squares(PAWN_ATTACKS[them][self.epSquare] & pawns):
+                move = frm | self.epSquare << 6 | EN_PASSANT << 12
+                if self.isLegal(move):
+                    append(move)
+
+        # pinned knights can never move, pinned sliders stay on the line between their King and the pinner
+        for frm in squares(pieces[base + KNIGHT] & ~pinned):
+            for to in squares(KNIGHT_ATTACKS[frm] & targets):
+                append(frm | to << 6)
+        for frm in squares(pieces[base + BISHOP] | pieces[base + QUEEN]):
+            mask = targets & rays[frm] if (1 << frm) & pinned else targets
+            for to in squares(BISHOP_TABLES[frm][occupied & BISHOP_MASKS[frm]] & mask):
+                append(frm | to << 6)
+        for frm in squares(pieces[base + ROOK] | pieces[base + QUEEN]):
+            mask = targets & rays[frm] if (1 << frm) & pinned else targets
+            for to in squares(ROOK_TABLES[frm][occupied & ROOK_MASKS[frm]] & mask):
+                append(frm | to << 6)
+
+        if not checkers and not capturesOnly:
+            for right, kingFrom, kingTo, _, _, between, crossing in CASTLING_MOVES:
+                if self.castling & right and kingFrom == king and not (occupied & between) \
+                        and not (danger >> crossing[0]) & 1 and not (danger >> crossing[1]) & 1:
+                    append(kingFrom | kingTo << 6 | CASTLE << 12)
+        return moves
+
+    def hasLegalMove(self):
+        """ Tests if the side to move has at least one legal move without generating all of them.
+            Outside of check, any unpinned piece with a square to go to has a legal move, which settles almost every position
+            after a few table lookups. King moves are tried next, and only then are all the moves generated.
+        """
+        us = self.side
+        pieces = self.pieces
+        base = us * 6
+        own = self.occupied[us]
+        occupied = own | self.occupied[us ^ 1]
+        targets = ~own & FULL
+        king = self.kingSquare(us)
+        if not self.checkers(us):
+            pinned, _ = self.pins(us)
+            pawns = pieces[base + PAWN] & ~pinned
+            empty = ~occupied & FULL
+            if (pawns >> 8 if us == WHITE else pawns << 8) & empty:
+                return True
+            for sq in squares(pieces[base + KNIGHT] & ~pinned):
+                if KNIGHT_ATTACKS[sq] & targets:
+                    return True
+            for sq in squares((pieces[base + BISHOP] | pieces[base + QUEEN]) & ~pinned):
+                if BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]] & targets:
+                    return True
+            for sq in squares((pieces[base + ROOK] | pieces[base + QUEEN]) & ~pinned):
+                if ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] & targets:
+                    return True
+        if KING_ATTACKS[king] & targets & ~self.attackMap(us ^ 1, occupied ^ (1 << king)):
+            return True
+        return len(self.legalMoves()) > 0
+
+    def isPseudoLegal(self, move):
+        """ Tests if an arbitrary encoded move, e.g. one received over the network, follows how its piece moves.
+            The flag has to match what legalMoves() would generate, and King safety isn't tested (see isLegal()).
+
+        Returns:
+            bool: True if the move is in pseudoLegalMoves().
+        """
+        frm, to, flag = move & 63, (move >> 6) & 63, move >> 12
+        us = self.side
+        board = self.squares
+        piece = board[frm]
+        if piece == EMPTY or piece // 6 != us or flag > PROMOTE_QUEEN:
+            return False
+        target = board[to]
+        if target != EMPTY and target // 6 == us:
+            return False
+        pieceType = piece % 6
+        occupied = self.occupied[0] | self.occupied[1]
+
+        if pieceType == PAWN:
+            forward = -8 if us == WHITE else 8
+            if flag == EN_PASSANT:
+                return to == self.epSquare and (PAWN_ATTACKS[us][frm] >> to) & 1 == 1
+            if flag == DOUBLE_PUSH:
+                return frm // 8 == (6 if us == WHITE else 1) and to == frm + 2 * forward \
+                    and target == EMPTY and board[frm + forward] == EMPTY
+            if (flag >= PROMOTE_KNIGHT) != (to // 8 == (0 if us == WHITE else 7)) or flag == CASTLE:
+                return False
+            if to == frm + forward:
+                return target == EMPTY
+            return target != EMPTY and (PAWN_ATTACKS[us][frm] >> to) & 1 == 1
+
+        if flag == CASTLE:
+            for right, kingFrom, kingTo, _, _, between, _ in CASTLING_MOVES:
+                if kingFrom == frm and kingTo == to and pieceType == KING:
+                    return self.castling & right != 0 and not occupied & between
+            return False
+        if flag != QUIET:
+            return False
+        if pieceType == KNIGHT:
+            attacks = KNIGHT_ATTACKS[frm]
+        elif pieceType == BISHOP:
+            attacks = bishopAttacks(frm, occupied)
+        elif pieceType == ROOK:
+            attacks = rookAttacks(frm, occupied)
+        elif pieceType == QUEEN:
+            attacks = queenAttacks(frm, occupied)
+        else:
+            attacks = KING_ATTACKS[frm]
+        return (attacks >> to) & 1 == 1
+
+    def isLegalMove(self, move):
+        """ Validates one encoded move in a few microseconds, without generating the full move list.
+
+        Returns:
+            bool: True if the move is in legalMoves().
+        """
+        return self.isPseudoLegal(move) and self.isLegal(move)
+
+    def isCheckmate(self):
+        return self.checkers() != 0 and not self.hasLegalMove()
+
+    def isStalemate(self):
+        return self.checkers() == 0 and not self.hasLegalMove()
@@ -1,10 +1,21 @@
 import pygame
 import sys
 from pieces import *
-import time
+from rules import Game, CHECKMATE, STALEMATE, EMPTY
+from protocol import MOVE, GAME_OVER, REJECTED, WIN, DRAW
 import threading
 from consts import *
 
+# posted by the client's reader thread so a loop waiting in pygame.event.wait() wakes up for new messages
+NETWORK_EVENT = pygame.USEREVENT + 1
+
+
+def wakeDisplay():
+    try:
+        pygame.event.post(pygame.event.Event(NETWORK_EVENT))
+    except pygame.error:  # display already shut down
+        pass
+
 
 class Board:
     """ A class that manages the chess board state and game conditions """
@@ -19,134 +30,171 @@ class Board:
         self.player = player
         self.client = client
         self.lastMove = []
-        self.threadingLock = threading.Lock()
         self.end = threading.Event()
-        self.receiveThread = None
         self.message = 0
+        self.game = None
+        self.pieceSet = [pieceType(player) for player in (0, 1)
+                         for pieceType in (Pawn, Knight, Bishop, Rook, Queen, King)]
+        self.background = None
+        self.moveTargets = []
+        self.dragOffset = None
+        self.dragRect = None
+        self.shownPieces = [[None]*COLS for _ in range(ROWS)]
+        self.shownHighlights = set()
         self.createBoard()
         self.restartPieces()
 
     def createBoard(self):
-        # creates appearance of chess board on pygame screen
+        # draws the board squares once onto a cached surface, frames copy squares from it instead of redrawing them
+        self.background = pygame.Surface((WIDTH, HEIGHT))
         for row in range(ROWS):
             for col in range(COLS):
                 color = COLOR_OPTIONS[0] if (
                     row + col) % 2 == 0 else COLOR_OPTIONS[1]
                 square = pygame.Rect(col * SQUARE_SIZE, row *
                                      SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-                pygame.draw.rect(self.screen, color, square)
+                pygame.draw.rect(self.background, color, square)
+
+    def restartPieces(self):
+        # used to initialize board pieces when game starts
+        self.game = Game()
+        self.syncBoard()
+
+    def loadFen(self, fen):
+        """ Sets the board up from a FEN string instead of the starting position.
+
+        Args:
+            fen (str): The position, e.g. from Board.toFen() or a test suite.
+        """
+        self.game = Game.fromFen(fen)
+        self.lastMove = self.game.lastMove
+        self.currentUser = self.game.sideToMove()
+        self.syncBoard()
+
+    def toFen(self):
+        return self.game.toFen()
 
-    def showPieces(self):
-        # displays each piece centered on the square it is located at
+    def syncBoard(self):
+        # copies the rules position into the 2D list of pieces that gets drawn
+        squares = self.game.position.squares
         for row in range(ROWS):
             for col in range(COLS):
-                piece = self.board[row][col]
-                if piece:
-                    offset = (SQUARE_SIZE-piece.png().get_width())//2
-                    self.screen.blit(
-                        piece.png(), (offset + col * SQUARE_SIZE, offset + row * SQUARE_SIZE))
+                piece = squares[row * COLS + col]
+                self.board[row][col] = 0 if piece == EMPTY else self.pieceSet[piece]
 
-    def restartPieces(self):
-        # used to initialize board pieces when game starts
-        whitePieces = [Rook(1), Knight(1), Bishop(1), Queen(
-            1), King(1), Bishop(1), Knight(1), Rook(1)]
-        blackPieces = [Rook(0), Knight(0), Bishop(0), Queen(
-            0), King(0), Bishop(0), Knight(0), Rook(0)]
-        for col in range(COLS):
-            self.board[0][col] = whitePieces[col]
-            self.board[1][col] = Pawn(1)
-            self.board[6][col] = Pawn(0)
-            self.board[7][col] = blackPieces[col]
-
-    def showMoves(self):
-        # change background color for squares that selected piece can move to
-        if self.movingPiece:
-            for row, col in self.movingPiece.findMoves(self.board, self.initialRow, self.initialCol, self.lastMove):
-                color = COLOR_OPTIONS[2] if (
-                    row + col) % 2 == 0 else COLOR_OPTIONS[3]
-                square = pygame.Rect(
-                    col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-                pygame.draw.rect(self.screen, color, square)
-
-    def showLastMove(self):
-        # change background color for starting and ending positions from last move
-        for row, col in self.lastMove:
-            color = COLOR_OPTIONS[6] if (
-                row + col) % 2 == 0 else COLOR_OPTIONS[7]
-            square = pygame.Rect(
-                col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+    def highlightColor(self, row, col):
+        # valid moves for the selected piece are shown in green, and the last move's squares in purple
+        if (row, col) in self.moveTargets:
+            return COLOR_OPTIONS[2] if (row + col) % 2 == 0 else COLOR_OPTIONS[3]
+        if (row, col) in self.lastMove:
+            return COLOR_OPTIONS[6] if (row + col) % 2 == 0 else COLOR_OPTIONS[7]
+        return None
+
+    def drawSquare(self, row, col):
+        """ Redraws one square: its background or highlight color, then the piece centered on it.
+
+        Returns:
+            pygame.Rect: The area of the screen that changed.
+        """
+        square = pygame.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        color = self.highlightColor(row, col)
+        if color:
             pygame.draw.rect(self.screen, color, square)
+        else:
+            self.screen.blit(self.background, square, square)
+        piece = self.board[row][col]
+        if piece:
+            offset = (SQUARE_SIZE-piece.png().get_width())//2
+            self.screen.blit(
+                piece.png(), (offset + col * SQUARE_SIZE, offset + row * SQUARE_SIZE))
+        self.shownPieces[row][col] = piece
+        return square
+
+    def squaresUnder(self, rect):
+        # the board squares that a screen rectangle overlaps
+        top, bottom = max(rect.top // SQUARE_SIZE, 0), min((rect.bottom - 1) // SQUARE_SIZE, ROWS - 1)
+        left, right = max(rect.left // SQUARE_SIZE, 0), min((rect.right - 1) // SQUARE_SIZE, COLS - 1)
+        return {(row, col) for row in range(top, bottom + 1) for col in range(left, right + 1)}
+
+    def render(self, full=False):
+        """
+            Redraws only what changed since the last frame: squares whose piece changed, squares that gained or lost
+            a highlight, and the squares under the dragged piece's old and new positions.
+            Only those rectangles are sent to pygame.display.update(), and nothing is sent when nothing changed.
 
-    def castle(self, row, col):
-        # change board state if user castled
-        if col < self.initialCol:
-            self.board[row][3] = self.board[row][0]
-            self.board[row][0] = 0
-            self.lastMove.extend([(row, 0), (row, 3)])
+        Args:
+            full (bool, optional): Redraw every square, e.g. when the game starts or the window was exposed. Defaults to False.
+        """
+        highlights = set(self.lastMove) | set(self.moveTargets)
+        if full:
+            dirty = {(row, col) for row in range(ROWS) for col in range(COLS)}
         else:
-            self.board[row][5] = self.board[row][7]
-            self.board[row][7] = 0
-            self.lastMove.extend([(row, 7), (row, 5)])
+            dirty = {(row, col) for row in range(ROWS) for col in range(COLS)
+                     if self.board[row][col] is not self.shownPieces[row][col]}
+            dirty |= highlights ^ self.shownHighlights
+        self.shownHighlights = highlights
+
+        dragRect = None
+        if self.movingPiece:
+            x, y = pygame.mouse.get_pos()
+            dragRect = self.movingPiece.png().get_rect(topleft=(x - self.dragOffset[0], y - self.dragOffset[1]))
+            if dragRect != self.dragRect:
+                dirty |= self.squaresUnder(dragRect)
+        if self.dragRect and dragRect != self.dragRect:
+            dirty |= self.squaresUnder(self.dragRect)
+
+        rects = [self.drawSquare(row, col) for row, col in dirty]
+        if dragRect and (rects or full):
+            self.screen.blit(self.movingPiece.png(), dragRect)
+        self.dragRect = dragRect
+        if rects:
+            pygame.display.update(rects)
 
     def myTurn(self):
         return self.player == self.currentUser
 
-    def updateBoard(self, moves):
-        """ Handle board state given opponent's move. Length of moves signals different tasks for method to account for.
+    def updateBoard(self, message):
+        """ Handle board state given a message from the opponent. The message type signals different tasks for method to account for.
             Game end is determined here, and it sets self.end to close the thread and end game.
 
         Args:
-            moves (list[tuple]): A list with coordinates from opponent's move
+            message (tuple): A (kind, value) message from client.receive(), value is the encoded move for MOVE messages
         """
-        if len(moves) < 1:  # because send/receive methods are not blocking
-            return
-        if len(moves) == 1:  # you won or opponent disconnected, message is 0 by default
-            if moves[0][0] == 0:
+        kind, value = message
+        if kind == GAME_OVER:  # you won, drew, or opponent disconnected, message is 0 by default
+            if value == WIN:
                 self.message = 1  # if you won change message to 1
+            elif value == DRAW:
+                self.message = 3  # opponent was stalemated
+            self.end.set()
+            return
+        if kind == REJECTED:  # the server refused our move, so the boards no longer agree
+            self.message = 4
             self.end.set()
             return
+        if kind != MOVE:
+            return
 
-        # change board state to reflect opponent's move
-        self.lastMove = moves
-        row, col = moves[0]
-        newRow, newCol = moves[1]
-        self.board[newRow][newCol] = self.board[row][col]
-
-        if (newRow == 0 or newRow == 7) and isinstance(self.board[newRow][newCol], Pawn):
-            self.board[newRow][newCol] = Queen(
-                not self.player)  # pawn promotion
-        self.board[row][col] = 0
-        if len(moves) == 3:  # en passant
-            row, col = moves[2]
-            self.board[row][col] = 0
-        elif len(moves) == 4:  # castling
-            row, col = moves[2]
-            newRow, newCol = moves[3]
-            self.board[newRow][newCol] = self.board[row][col]
-            self.board[row][col] = 0
-
-        if not self.validMoves():  # checkmate, you lost
+        # change board state to reflect opponent's move, the rules core handles en passant, castling and promotion
+        lastMove = self.game.tryPlay(value)
+        if lastMove is None:
+            return
+        self.lastMove = lastMove
+        self.syncBoard()
+
+        result = self.game.result()
+        if result == CHECKMATE:  # checkmate, you lost
             self.message = 2
-            self.client.send([(0, 0)])
+            self.client.sendGameOver(WIN)
+            self.end.set()
+        elif result == STALEMATE:  # stalemate, game is drawn
+            self.message = 3
+            self.client.sendGameOver(DRAW)
             self.end.set()
 
     def checkLastMove(self):
         return self.lastMove
 
-    def handleEnPassant(self):
-        """ Tests for en passant using initialRow, initialCol, and lastMove. 
-
-        Returns:
-            tuple | None: if move was en passant then returns the third coordinate to be added to lastMove 
-        """
-        enPassantRow = 3 if self.player == 0 else 4
-        if isinstance(self.movingPiece, Pawn) and self.initialRow == enPassantRow and len(self.lastMove) == 2:
-            initialX, initialY = self.lastMove[0]
-            finalX, finalY = self.lastMove[1]
-            if isinstance(self.board[finalX][finalY], Pawn) and abs(finalX - initialX) == 2 and finalY == initialY and self.initialRow == finalX and abs(finalY - self.initialCol) == 1:
-                self.board[finalX][finalY] = 0
-                return (finalX, finalY)
-
     def handleMove(self, row, col):
         """ If user moves piece to valid square then handles moving of pieces and updates opponent
 
@@ -154,98 +202,85 @@ class Board:
             row (int): x-coordinate of selected piece on board
             col (int): y-coordinate of selected piece on board
         """
-        if (row, col) in self.movingPiece.findMoves(self.board, self.initialRow, self.initialCol, self.lastMove):
-            self.board[row][col] = self.movingPiece
-            self.board[self.initialRow][self.initialCol] = 0
-            enPassant = self.handleEnPassant()
-            self.lastMove = [
-                (self.initialRow, self.initialCol), (row, col)]
-            if enPassant:
-                self.lastMove.append(enPassant)
-            if isinstance(self.movingPiece, King) and abs(col - self.initialCol) == 2:
-                self.castle(row, col)
-            if isinstance(self.movingPiece, King) or isinstance(self.movingPiece, Rook):
-                self.movingPiece.moved()
-            elif isinstance(self.movingPiece, Pawn) and (row == 0 or row == 7):
-                self.board[row][col] = Queen(
-                    self.movingPiece.user())
+        move = self.game.findMove(self.initialRow, self.initialCol, row, col)
+        if move is not None:
+            self.lastMove = self.game.play(move)
+            self.syncBoard()
             self.currentUser = not self.currentUser
-            self.updateOpponent()
+            self.updateOpponent(move)
 
-    def updateOpponent(self):
-        self.client.send(self.lastMove)
+    def updateOpponent(self, move):
+        self.client.sendMove(move)
 
     def receiveOpponentData(self):
         """
-            Runs in continuous loop until game end is set in updateBoard().
-            threadingLock is used here to prevent a new thread from creating on each turn.
-            the threading Event in self.end is needed for startGame and receiveOpponentData to end at the same time.
+            Handles every message the client's reader thread queued since the last frame.
+            Runs on the display loop, so the board is only ever changed from one thread.
+            If the server closes the connection without a game over message, the game ends as a disconnect.
         """
-        while not self.end.is_set():
-            with self.threadingLock:
-                data = self.client.receive()
-                if data:
-                    self.updateBoard(data)
-                    self.currentUser = not self.currentUser
-                else:
-                    time.sleep(1)
+        message = self.client.poll()
+        while message and not self.end.is_set():
+            self.updateBoard(message)
+            # an ignored or illegal frame leaves the position alone, so the turn follows the position
+            self.currentUser = self.game.sideToMove()
+            message = self.client.poll()
+        if self.client.closed.is_set() and self.client.messages.empty():
+            self.end.set()
 
     def validMoves(self):
         """ 
             Tests if a user is in checkmate or has valid moves left. 
+            Reads the game's legal move cache, which is shared with highlighting and drop validation for this ply.
         """
-        for row in range(8):
-            for col in range(8):
-                if self.board[row][col] and self.board[row][col].user() == self.player:
-                    moves = self.board[row][col].findMoves(
-                        self.board, row, col, self.lastMove)
-                    if moves:
-                        return True
-        return False
+        return len(self.game.legalMoves()) > 0
 
     def startGame(self):
         """
-            Used threading because it is intended for I/O bound tasks and was faster than asyncio
+            The client's reader thread receives opponent moves, and they're applied here at the start of each frame.
             Displays the board, pieces, last move, and valid moves for selected pieces until game ends.
             Detects clicks on pieces and handles dragging/setting down of pieces. 
-            Handles closing of client socket and thread before returning.
+            Handles closing of client socket before returning.
 
         Returns:
             int: Tells main.py why the game ended
         """
-        self.receiveThread = threading.Thread(target=self.receiveOpponentData)
-        self.receiveThread.daemon = True
-        self.receiveThread.start()
-        offset = None
+        if self.client.readerThread is None:
+            self.client.listen(wakeDisplay)
+        clock = pygame.time.Clock()
+        self.render(full=True)
         while not self.end.is_set():
-            self.createBoard()
-            self.showLastMove()
-            self.showMoves()
-            self.showPieces()
-            pygame.display.update()
-            for event in pygame.event.get():
+            # while a piece is dragged, frames are capped at FPS, otherwise the loop sleeps until an event or a message arrives
+            if self.movingPiece:
+                clock.tick(FPS)
+                events = pygame.event.get()
+            else:
+                events = [pygame.event.wait()] + pygame.event.get()
+            self.receiveOpponentData()
+            if self.end.is_set():
+                break
+            full = False
+            for event in events:
                 if event.type == pygame.QUIT:
                     self.client.close()
                     pygame.quit()
                     sys.exit()
+                elif event.type == pygame.VIDEOEXPOSE:
+                    full = True
                 elif event.type == pygame.MOUSEBUTTONDOWN:
                     x, y = event.pos
                     row, col = y//SQUARE_SIZE, x//SQUARE_SIZE
                     if self.myTurn() and self.board[row][col] and self.board[row][col].user() == self.currentUser:
                         self.movingPiece = self.board[row][col]
                         self.initialRow, self.initialCol = row, col
-                        offset = [x - col * SQUARE_SIZE, y - row * SQUARE_SIZE]
+                        self.dragOffset = [x - col * SQUARE_SIZE, y - row * SQUARE_SIZE]
+                        self.moveTargets = self.game.movesFrom(row, col)
                 elif event.type == pygame.MOUSEBUTTONUP:
                     if self.movingPiece:
                         x, y = event.pos
                         row, col = y//SQUARE_SIZE, x//SQUARE_SIZE
                         self.handleMove(row, col)
                         self.movingPiece = None
-            if self.movingPiece:
-                x, y = pygame.mouse.get_pos()
-                self.screen.blit(self.movingPiece.png(),
-                                 (x - offset[0], y - offset[1]))
-            pygame.display.update()
-        self.receiveThread.join()
+                        self.moveTargets = []
+            self.render(full)
         self.client.close()
         return self.message
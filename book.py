@@ -0,0 +1,213 @@
+"""
+  Opening book compiled from PGN games, looked up straight from a memory-mapped file.
+  The file holds a short header, a bucket index, then every position's Zobrist hash (see bitboard.py) as a sorted
+  array of 64 bit keys, then a parallel array of (move, weight) pairs, where weight is how many games played the move.
+  A position with several book moves has one entry per move, next to each other since the keys are sorted.
+  The bucket index holds where each run of keys with the same top bits starts, sized so a bucket averages
+  about BUCKET_SIZE keys. A lookup reads the bucket's bounds and bisects that short range of the mapped keys in C,
+  without unpacking any records.
+  Opening a book only maps the file, so it costs the same for a thousand entries or a hundred million, and processes
+  using the same book share its pages through the page cache.
+  Build a book with "python book.py build games.pgn --output book.bin" and try it with "python book.py probe book.bin".
+"""
+
+import mmap
+import os
+import random
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+from bitboard import *
+from pgn import parseGame, parseSan, splitGames, san
+
+MAGIC = b"CHESSBK1"
+HEADER = struct.Struct("<8sQQ")  # magic, number of entries, bits in the bucket index
+BUCKET_SIZE = 16  # average keys per bucket
+MAX_PLIES = 24  # only the first moves of each game go into the book
+MAX_WEIGHT = 0xFFFF
+
+
+def collectMoves(paths, maxPlies=MAX_PLIES):
+    """ Counts how often each move was played in each position, over every game in the PGN files.
+        Games that fail to parse are skipped at the first bad move, keeping the moves before it.
+
+    Args:
+        paths (list[str]): PGN files.
+        maxPlies (int, optional): Moves past this ply aren't counted. Defaults to MAX_PLIES.
+
+    Returns:
+        tuple: ({(key, move): count}, the number of games read).
+    """
+    counts = {}
+    games = 0
+    for path in paths:
+        with open(path) as file:
+            for text in splitGames(file):
+                tags, moves, _ = parseGame(text)
+                games += 1
+                try:
+                    position = Position.fromFen(tags["FEN"]) if "FEN" in tags else Position.initial()
+                except ValueError:
+                    continue
+                for token in moves[:maxPlies]:
+                    try:
+                        move = parseSan(position, token)
+                    except ValueError:
+                        break
+                    entry = (position.hash, move)
+                    counts[entry] = counts.get(entry, 0) + 1
+                    position.makeMove(move)
+    return counts, games
+
+
+def indexBits(count):
+    # enough buckets for about BUCKET_SIZE keys each
+    return min((count // BUCKET_SIZE).bit_length(), 24)
+
+
+def writeBook(counts, path, minGames=1):
+    """ Writes a book file from collectMoves() counts, replacing the file in one rename so readers never see half a book.
+
+    Args:
+        counts (dict): {(key, move): count}.
+        path (str): Where the book goes.
+        minGames (int, optional): Moves played in fewer games than this are left out. Defaults to 1.
+
+    Returns:
+        int: The number of entries written.
+    """
+    entries = sorted(entry for entry, count in counts.items() if count >= minGames)
+    keys = array("Q", (key for key, _ in entries))
+    values = array("H")
+    for entry in entries:
+        values.append(entry[1])
+        values.append(min(counts[entry], MAX_WEIGHT))
+    bits = indexBits(len(keys))
+    buckets = [key >> (64 - bits) for key in keys]
+    # index[bucket] is where the bucket's keys start, and the entry after the last bucket is the number of keys
+    index = array("I", (bisect_left(buckets, bucket) for bucket in range((1 << bits) + 1)))
+    if len(index) % 2:  # keeps the keys 8 byte aligned
+        index.append(0)
+    if sys.byteorder != "little":  # the file is little endian so it reads the same on every machine
+        keys.byteswap()
+        values.byteswap()
+        index.byteswap()
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(entries), bits))
+        index.tofile(file)
+        keys.tofile(file)
+        values.tofile(file)
+    os.replace(temporary, path)
+    return len(entries)
+
+
+class OpeningBook:
+    """ A book file mapped read only. Nothing is read until a lookup touches the pages it needs. """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): A file written by writeBook().
+
+        Raises:
+            ValueError: If the file isn't a book.
+        """
+        if sys.byteorder != "little":
+            raise ValueError("Opening books can only be mapped on little endian machines")
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            self.file.close()
+            raise ValueError(f"Not an opening book: {path}")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.bits = HEADER.unpack_from(self.map)
+        buckets = (1 << self.bits) + 1
+        keysStart = HEADER.size + 4 * (buckets + buckets % 2)
+        keysEnd = keysStart + self.count * 8
+        if magic != MAGIC or size != keysEnd + self.count * 4:
+            self.close()
+            raise ValueError(f"Not an opening book: {path}")
+        view = memoryview(self.map)
+        self.index = view[HEADER.size:HEADER.size + 4 * buckets].cast("I")
+        self.keys = view[keysStart:keysEnd].cast("Q")
+        self.values = view[keysEnd:].cast("H")
+        view.release()
+        self.shift = 64 - self.bits
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, key):
+        """ Finds the book moves for a position hash.
+
+        Args:
+            key (int): The position's Zobrist hash.
+
+        Returns:
+            list[tuple]: (move, weight) for every book move, empty if the position isn't in the book.
+        """
+        keys, values = self.keys, self.values
+        bucket = key >> self.shift
+        index = bisect_left(keys, key, self.index[bucket], self.index[bucket + 1])
+        moves = []
+        while index < self.count and keys[index] == key:
+            moves.append((values[2 * index], values[2 * index + 1]))
+            index += 1
+        return moves
+
+    def probe(self, position):
+        """ The book moves for a position, checked to be legal in case two positions share a hash. """
+        return [(move, weight) for move, weight in self.lookup(position.hash) if position.isLegalMove(move)]
+
+    def choose(self, position, rng=random):
+        """ Picks a book move at random, weighted by how often it was played.
+
+        Returns:
+            int | None: The move, or None if the position isn't in the book.
+        """
+        moves = self.probe(position)
+        if not moves:
+            return None
+        return rng.choices([move for move, _ in moves], weights=[weight for _, weight in moves])[0]
+
+    def close(self):
+        for view in (getattr(self, "index", None), getattr(self, "keys", None), getattr(self, "values", None)):
+            if view is not None:
+                view.release()
+        self.map.close()
+        self.file.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Build an opening book from PGN files, or look positions up in one.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile PGN games into a book")
+    build.add_argument("paths", nargs="+", help="PGN files")
+    build.add_argument("--output", default="book.bin", help="book file to write")
+    build.add_argument("--plies", type=int, default=MAX_PLIES, help="moves per game that go into the book")
+    build.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    probe = commands.add_parser("probe", help="list the book moves for a position")
+    probe.add_argument("book", help="book file")
+    probe.add_argument("--fen", help="position to look up, defaults to the starting position")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        counts, games = collectMoves(args.paths, args.plies)
+        entries = writeBook(counts, args.output, args.min_games)
+        print(f"{games} games, {entries} entries written to {args.output} in {time.perf_counter() - start:.2f}s")
+    else:
+        book = OpeningBook(args.book)
+        position = Position.fromFen(args.fen) if args.fen else Position.initial()
+        start = time.perf_counter()
+        moves = book.probe(position)
+        elapsed = time.perf_counter() - start
+        for move, weight in sorted(moves, key=lambda entry: -entry[1]):
+            print(f"{san(position, move)} {weight}")
+        print(f"{len(moves)} book moves out of {len(book)} entries, found in {elapsed * 1e6:.1f}us")
+        book.close()
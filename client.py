@@ -1,23 +1,36 @@
-import pickle
+import queue
 import socket
+import threading
+from protocol import *
 
 
 class Client:
     """
         Establishes methods for client socket to connect to server, send/receive information, and close.
         Initialized with a timeout so that the blocking behavior won't prevent user from  exiting game.
-        Send and receive methods use pickle for serialization because data type is list of tuples.
+        Messages use the framed binary format in protocol.py, and received bytes are buffered until a whole frame arrives.
+        After listen() is called, a reader thread blocks on the socket and pushes each decoded message into a queue,
+        so messages are handled as soon as they arrive and nothing polls the socket while the game is idle.
     """
 
-    def __init__(self):
+    def __init__(self, port=9593):
+        """
+        Args:
+            port (int, optional): The server's port, or its spectator port (9595) to watch games with sendWatch().
+        """
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.ip = "localhost"  # Fill in with server's ip and port
-        self.port = 9593
+        self.port = port
+        self.buffer = bytearray()
+        self.messages = queue.Queue()
+        self.closed = threading.Event()
+        self.readerThread = None
+        self.wakeUp = None
         self.connected = self.connect()
         self.client.settimeout(1.0)
 
     def connect(self):
-        """ 
+        """
         Connects to server and main.py uses return value to choose next course of action
 
         Returns:
@@ -25,28 +38,108 @@ class Client:
         """
         try:
             self.client.connect((self.ip, self.port))
-            return int(self.client.recv(5).decode())
-        except socket.error as e:
-            print(e)
+            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            message = self.receiveBlocking()
+            if message and message[0] == CONNECTED:
+                return message[1]
             return 0
-        except UnicodeDecodeError as e:
+        except socket.error as e:
             print(e)
             return 0
 
     def validConnection(self):
         return self.connected
 
-    def send(self, board):
+    def sendFrame(self, frame):
         try:
-            self.client.send(pickle.dumps(board))
+            self.client.sendall(frame)
         except socket.error as e:
             print(e)
 
-    def receive(self):
+    def sendMove(self, move):
+        self.sendFrame(encodeMove(move))
+
+    def sendGameOver(self, reason):
+        self.sendFrame(encodeGameOver(reason))
+
+    def sendSeek(self, rating, timeControl):
+        # only used while waiting for an opponent, the server queues clients that never send it with default values
+        self.sendFrame(encodeSeek(rating, timeControl))
+
+    def sendWatch(self, gameId=0):
+        # only for spectators, the server answers with a SNAPSHOT of the game or GAME_OVER with UNKNOWN_GAME
+        self.sendFrame(encodeWatch(gameId))
+
+    def receiveBlocking(self):
+        # waits for one whole message, used before the socket timeout is set
+        message = nextMessage(self.buffer)
+        while message is None:
+            data = self.client.recv(4096)
+            if not data:
+                return None
+            self.buffer += data
+            message = nextMessage(self.buffer)
+        return message
+
+    def listen(self, wakeUp=None):
+        """ Starts the reader thread.
+
+        Args:
+            wakeUp (callable, optional): Called from the reader thread after new messages are queued or the
+                connection closes, e.g. to post a pygame event so the display loop can sleep until then.
+        """
+        self.wakeUp = wakeUp
+        self.client.settimeout(None)
+        self.readerThread = threading.Thread(target=self.readMessages, daemon=True)
+        self.readerThread.start()
+
+    def readMessages(self):
+        # runs on the reader thread, recv blocks until the server sends something or the socket closes
+        while True:
+            message = nextMessage(self.buffer)
+            if message:
+                while message:
+                    self.messages.put(message)
+                    message = nextMessage(self.buffer)
+                if self.wakeUp:
+                    self.wakeUp()
+            try:
+                data = self.client.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                self.closed.set()
+                if self.wakeUp:
+                    self.wakeUp()
+                return
+            self.buffer += data
+
+    def poll(self):
+        """ Returns the next queued message without waiting, or None if there isn't one. Needs listen() to be running. """
+        try:
+            return self.messages.get_nowait()
+        except queue.Empty:
+            return None
+
+    def receive(self, timeout=1.0):
+        """ Returns the next message from the server, or None if a whole message hasn't arrived within the timeout.
+
+        Returns:
+            tuple | None: (kind, value) as decoded by protocol.decode().
+        """
+        if self.readerThread:
+            try:
+                return self.messages.get(timeout=timeout)
+            except queue.Empty:
+                return None
+        message = nextMessage(self.buffer)
+        if message:
+            return message
         try:
             data = self.client.recv(4096)
             if data:
-                return pickle.loads(data)
+                self.buffer += data
+                return nextMessage(self.buffer)
             return None
         except socket.timeout:
             return None
@@ -54,4 +147,9 @@ class Client:
             print(e)
 
     def close(self):
+        # shutdown wakes the reader thread out of recv before the socket is closed
+        try:
+            self.client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         self.client.close()
@@ -14,6 +14,20 @@ COLOR_OPTIONS = [(255, 206, 158), (209, 139, 71),  # chess board colors
 
 SQUARE_SIZE = WIDTH // ROWS
 
+FPS = 60  # frame cap while a piece is being dragged
+
 BUTTON_WIDTH = 420
 
 BUTTON_HEIGHT = 180
+
+OPPONENT_TIMEOUT = 30  # seconds to wait for an online opponent before playing the computer
+
+ENGINE_PLAYER = 1  # the computer plays black
+
+ENGINE_TIME = 2.0  # seconds the computer thinks per move
+
+ENGINE_WORKERS = 0  # processes the computer searches with, 0 for one per CPU
+
+BOOK_FILE = "book.bin"  # opening book for the computer, built with book.py, it plays without one if the file is missing
+
+TABLEBASE_DIRECTORY = "tables"  # endgame tables for the computer, generated with tablebase.py
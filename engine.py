@@ -0,0 +1,574 @@
+"""
+  Computer opponent built on the bitboard rules core.
+  The search is iterative deepening alpha-beta (principal variation search) with a transposition table,
+  null move pruning, late move reductions, and quiescence search over captures and promotions.
+  Moves are ordered by the table's best move, then captures by MVV-LVA, then killer moves and the history heuristic.
+  The evaluation is material plus piece-square tables, updated incrementally as moves are made,
+  with the King's table blended from middlegame to endgame as pieces come off.
+  EngineClient lets Board play against the engine the same way it plays a remote opponent.
+  Run "python engine.py --fen FEN --time 5" to watch the search.
+"""
+
+import queue
+import threading
+import time
+from bitboard import *
+from rules import Game, ONGOING, CHECKMATE, STALEMATE
+from protocol import MOVE, GAME_OVER, REJECTED, WIN, DRAW
+from transposition import TranspositionTable
+
+TIME_LIMIT = 2.0  # seconds per move
+MAX_DEPTH = 64
+
+MATE = 100000
+MATE_BOUND = MATE - 1000  # scores beyond this are mates, stored relative to the node in the transposition table
+INFINITY = MATE + 1
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+NULL_REDUCTION = 2
+CHECK_INTERVAL = 1023  # nodes between clock checks, must be one less than a power of two
+
+PIECE_VALUES = [100, 320, 330, 500, 900, 0]
+PHASE_WEIGHTS = [0, 1, 1, 2, 4, 0]  # 24 with all pieces on the board, 0 with only Kings and pawns
+MAX_PHASE = 24
+
+# piece-square tables from white's side, the first row is the 8th rank, which is row 0 in bitboard.py as well
+PAWN_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0]
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0]
+QUEEN_TABLE = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20]
+KING_MIDDLE_TABLE = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20]
+KING_END_TABLE = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+
+
+def _scoreTables():
+    # SCORES[piece][sq] is the piece's value plus its table entry, positive for white and negative for black
+    # Kings are 0 here because their table depends on the game phase, see kingScore()
+    tables = [PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, [0] * 64]
+    scores = []
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        for pieceType in range(6):
+            flip = 0 if color == WHITE else 56  # mirrors the rows for black
+            scores.append([sign * (PIECE_VALUES[pieceType] + tables[pieceType][sq ^ flip]) for sq in range(64)])
+    return scores
+
+
+SCORES = _scoreTables()
+KING_MIDDLE = [KING_MIDDLE_TABLE, [-KING_MIDDLE_TABLE[sq ^ 56] for sq in range(64)]]
+KING_END = [KING_END_TABLE, [-KING_END_TABLE[sq ^ 56] for sq in range(64)]]
+
+
+def materialScore(position):
+    """ The incremental part of the evaluation, from white's side, computed from scratch. Search updates it with moveDelta(). """
+    return sum(SCORES[piece][sq] for sq, piece in enumerate(position.squares) if piece != EMPTY)
+
+
+def moveDelta(board, move):
+    """ How much a move changes materialScore(), computed before the move is made.
+
+    Args:
+        board (list[int]): Position.squares before the move.
+        move (int): The encoded move.
+    """
+    frm, to, flag = move & 63, (move >> 6) & 63, move >> 12
+    piece = board[frm]
+    captured = board[to]
+    delta = -SCORES[piece][frm]
+    if flag >= PROMOTE_KNIGHT:
+        delta += SCORES[piece + flag - PROMOTE_KNIGHT + KNIGHT][to]
+    else:
+        delta += SCORES[piece][to]
+    if captured != EMPTY:
+        delta -= SCORES[captured][to]
+    elif flag == EN_PASSANT:
+        pawnSquare = to + 8 if piece < 6 else to - 8
+        delta -= SCORES[board[pawnSquare]][pawnSquare]
+    elif flag == CASTLE:
+        rookFrom, rookTo = CASTLING_ROOKS[to]
+        rook = board[rookFrom]
+        delta += SCORES[rook][rookTo] - SCORES[rook][rookFrom]
+    return delta
+
+
+def gamePhase(pieces):
+    phase = 0
+    for pieceType in (KNIGHT, BISHOP, ROOK, QUEEN):
+        phase += PHASE_WEIGHTS[pieceType] * (pieces[pieceType].bit_count() + pieces[6 + pieceType].bit_count())
+    return min(phase, MAX_PHASE)
+
+
+def evaluate(position, score):
+    """ Scores a position for the side to move.
+
+    Args:
+        position (Position): The position.
+        score (int): Its materialScore(), kept up to date by the search.
+
+    Returns:
+        int: Centipawns, positive if the side to move is better.
+    """
+    pieces = position.pieces
+    phase = gamePhase(pieces)
+    white, black = pieces[KING].bit_length() - 1, pieces[6 + KING].bit_length() - 1
+    middle = KING_MIDDLE[WHITE][white] + KING_MIDDLE[BLACK][black]
+    end = KING_END[WHITE][white] + KING_END[BLACK][black]
+    score += (middle * phase + end * (MAX_PHASE - phase)) // MAX_PHASE
+    return score if position.side == WHITE else -score
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Engine:
+    """
+        Searches for the best move in a position within a time budget.
+        The transposition table, killer moves and history scores are kept between moves, since consecutive
+        searches in one game look at overlapping trees. Search statistics for the last search are in self.info.
+    """
+
+    def __init__(self, tableBits=18, table=None):
+        """
+        Args:
+            tableBits (int, optional): The transposition table holds 2 ** tableBits buckets. Defaults to 18.
+            table (TranspositionTable, optional): A table to use instead of a new one, such as the shared table in parallelsearch.py.
+        """
+        self.table = table if table is not None else TranspositionTable(tableBits)
+        self.killers = [[0, 0] for _ in range(MAX_DEPTH + 64)]
+        self.history = [0] * (12 * 64)
+        self.deadline = 0.0
+        self.stopped = False
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.info = {}
+
+    def stop(self):
+        # called from another thread, the search notices on its next clock check
+        self.stopped = True
+
+    def timeUp(self):
+        return self.stopped or time.perf_counter() > self.deadline
+
+    def nextDepth(self, depth):
+        # the depth of the iteration after one to depth, parallelsearch.py skips ahead of other workers here
+        return depth + 1
+
+    def close(self):
+        pass
+
+    def search(self, position, timeLimit=TIME_LIMIT, maxDepth=MAX_DEPTH, report=None):
+        """ Finds a move with iterative deepening, going one ply deeper each iteration until the time runs out.
+
+        Args:
+            position (Position): The position to search. It's copied, so the caller's position isn't touched.
+            timeLimit (float, optional): Seconds to search for. Defaults to TIME_LIMIT.
+            maxDepth (int, optional): The deepest iteration to run. Defaults to MAX_DEPTH.
+            report (callable, optional): Called with self.info after each completed iteration.
+
+        Returns:
+            int | None: The best move found, or None if the side to move has no legal moves.
+        """
+        position = position.copy()
+        start = time.perf_counter()
+        self.deadline = start + timeLimit
+        self.stopped = False
+        self.nodes = self.quiescenceNodes = self.cutoffs = self.firstMoveCutoffs = 0
+        self.info = {}
+        self.table.newSearch()
+        self.history = [value >> 3 for value in self.history]  # older history counts for less
+        moves = position.legalMoves()
+        if not moves:
+            return None
+        bestMove = moves[0]
+        score = materialScore(position)
+        depth = self.nextDepth(0)
+        while depth <= maxDepth:
+            try:
+                value, move = self.searchRoot(position, depth, score)
+            except SearchTimeout:
+                # searchRoot saves a better move than the last iteration's in the table as soon as it's found
+                entry = self.table.probe(position.hash)
+                if entry and entry[1][2] in moves:
+                    bestMove = entry[1][2]
+                break
+            bestMove = move
+            elapsed = time.perf_counter() - start
+            self.info = {
+                "depth": depth,
+                "score": value,
+                "move": bestMove,
+                "nodes": self.nodes,
+                "quiescenceNodes": self.quiescenceNodes,
+                "seconds": elapsed,
+                "nps": int(self.nodes / elapsed) if elapsed else 0,
+                "firstMoveCutoffRate": self.firstMoveCutoffs / self.cutoffs if self.cutoffs else 0.0,
+                "tableHitRate": self.table.hitRate(),
+            }
+            if report:
+                report(self.info)
+            # a forced mate was found, or the next iteration would very likely run out of time
+            if abs(value) >= MATE_BOUND or elapsed > timeLimit / 2:
+                break
+            depth = self.nextDepth(depth)
+        # totals include the unfinished last iteration
+        elapsed = time.perf_counter() - start
+        self.info.update(move=bestMove, nodes=self.nodes, quiescenceNodes=self.quiescenceNodes, seconds=elapsed,
+                         nps=int(self.nodes / elapsed) if elapsed else 0)
+        return bestMove
+
+    def searchRoot(self, position, depth, score):
+        alpha, beta = -INFINITY, INFINITY
+        moves = self.orderMoves(position, position.legalMoves(), self.tableMove(position), 0)
+        bestMove = moves[0]
+        board = position.squares
+        for index, move in enumerate(moves):
+            delta = moveDelta(board, move)
+            position.makeMove(move)
+            try:
+                if index == 0:
+                    value = -self.negamax(position, depth - 1, -beta, -alpha, 1, score + delta, True)
+                else:
+                    value = -self.negamax(position, depth - 1, -alpha - 1, -alpha, 1, score + delta, True)
+                    if value > alpha:
+                        value = -self.negamax(position, depth - 1, -beta, -alpha, 1, score + delta, True)
+            finally:
+                position.unmakeMove()
+            if value > alpha:
+                alpha, bestMove = value, move
+                self.table.store(position.hash, depth, (alpha, LOWER, bestMove))
+        self.table.store(position.hash, depth, (alpha, EXACT, bestMove))
+        return alpha, bestMove
+
+    def tableMove(self, position):
+        entry = self.table.probe(position.hash)
+        return entry[1][2] if entry else NULL_MOVE
+
+    def orderMoves(self, position, moves, tableMove, ply):
+        # the table's move first, then captures by most valuable victim and least valuable attacker, then killers, then history
+        board = position.squares
+        killers = self.killers[ply]
+        history = self.history
+
+        def priority(move):
+            if move == tableMove:
+                return 1 << 30
+            to = (move >> 6) & 63
+            victim = board[to]
+            flag = move >> 12
+            if victim != EMPTY or flag == EN_PASSANT or flag >= PROMOTE_KNIGHT:
+                value = PIECE_VALUES[victim % 6] if victim != EMPTY else PIECE_VALUES[PAWN]
+                if flag >= PROMOTE_KNIGHT:
+                    value += PIECE_VALUES[flag - PROMOTE_KNIGHT + KNIGHT]
+                return (1 << 28) + value * 16 - PIECE_VALUES[board[move & 63] % 6] // 100
+            if move == killers[0]:
+                return (1 << 27) + 1
+            if move == killers[1]:
+                return 1 << 27
+            return history[board[move & 63] * 64 + to]
+
+        moves.sort(key=priority, reverse=True)
+        return moves
+
+    def negamax(self, position, depth, alpha, beta, ply, score, allowNull):
+        if depth <= 0:
+            return self.quiesce(position, alpha, beta, ply, score)
+        self.nodes += 1
+        if not self.nodes & CHECK_INTERVAL and self.timeUp():
+            raise SearchTimeout()
+        if position.halfmoveClock >= 100 or position.repetitions():
+            return 0
+
+        key = position.hash
+        tableMove = NULL_MOVE
+        entry = self.table.probe(key)
+        if entry:
+            entryDepth, (value, bound, tableMove) = entry
+            if entryDepth >= depth:
+                if value > MATE_BOUND:
+                    value -= ply
+                elif value < -MATE_BOUND:
+                    value += ply
+                if bound == EXACT or (bound == LOWER and value >= beta) or (bound == UPPER and value <= alpha):
+                    return value
+
+        inCheck = position.checkers() != 0
+        if inCheck:
+            depth += 1  # check extension
+
+        # null move pruning: if passing still fails high, a real move almost certainly would too
+        us = position.side * 6
+        pieces = position.pieces
+        if allowNull and not inCheck and depth >= 3 and beta < MATE_BOUND \
+                and (pieces[us + KNIGHT] | pieces[us + BISHOP] | pieces[us + ROOK] | pieces[us + QUEEN]) \
+                and evaluate(position, score) >= beta:
+            position.makeNullMove()
+            try:
+                value = -self.negamax(position, depth - 1 - NULL_REDUCTION, -beta, -beta + 1, ply + 1, score, False)
+            finally:
+                position.unmakeNullMove()
+            if value >= beta:
+                return beta
+
+        moves = position.legalMoves()
+        if not moves:
+            return -MATE + ply if inCheck else 0
+        self.orderMoves(position, moves, tableMove, ply)
+
+        board = position.squares
+        originalAlpha = alpha
+        best, bestMove = -INFINITY, moves[0]
+        for index, move in enumerate(moves):
+            flag = move >> 12
+            quiet = board[(move >> 6) & 63] == EMPTY and flag != EN_PASSANT and flag < PROMOTE_KNIGHT
+            delta = moveDelta(board, move)
+            position.makeMove(move)
+            try:
+                if index == 0:
+                    value = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1, score + delta, True)
+                else:
+                    # late quiet moves are searched a ply shallower first and only searched fully if they look good
+                    reduction = 1 if depth >= 3 and index >= 4 and quiet and not inCheck else 0
+                    value = -self.negamax(position, depth - 1 - reduction, -alpha - 1, -alpha, ply + 1, score + delta, True)
+                    if value > alpha and (reduction or value < beta):
+                        value = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1, score + delta, True)
+            finally:
+                position.unmakeMove()
+            if value > best:
+                best, bestMove = value, move
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        if index == 0:
+                            self.firstMoveCutoffs += 1
+                        if quiet:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1], killers[0] = killers[0], move
+                            self.history[board[move & 63] * 64 + ((move >> 6) & 63)] += depth * depth
+                        break
+
+        bound = UPPER if best <= originalAlpha else LOWER if best >= beta else EXACT
+        stored = best + ply if best > MATE_BOUND else best - ply if best < -MATE_BOUND else best
+        self.table.store(key, depth, (stored, bound, bestMove))
+        return best
+
+    def quiesce(self, position, alpha, beta, ply, score):
+        # searches captures and promotions until the position is quiet, so the evaluation isn't taken mid exchange
+        self.nodes += 1
+        self.quiescenceNodes += 1
+        if not self.nodes & CHECK_INTERVAL and self.timeUp():
+            raise SearchTimeout()
+        inCheck = position.checkers() != 0
+        if inCheck:  # every evasion has to be looked at, and standing pat isn't allowed
+            moves = position.legalMoves()
+            if not moves:
+                return -MATE + ply
+            best = -INFINITY
+        else:
+            best = evaluate(position, score)
+            if best >= beta:
+                return best
+            if best > alpha:
+                alpha = best
+            moves = position.legalMoves(capturesOnly=True)
+        board = position.squares
+        self.orderMoves(position, moves, NULL_MOVE, ply)
+        for move in moves:
+            delta = moveDelta(board, move)
+            position.makeMove(move)
+            try:
+                value = -self.quiesce(position, -beta, -alpha, ply + 1, score + delta)
+            finally:
+                position.unmakeMove()
+            if value > best:
+                best = value
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+        return best
+
+
+class EngineClient:
+    """
+        Stands in for client.Client so Board can play the engine exactly like a remote opponent.
+        Moves sent with sendMove() are checked against the engine's own Game, then the engine thinks on a background
+        thread and its reply is queued as a MOVE message, with the same poll(), wakeUp and closed Event that Client has.
+        Like the server, it sends GAME_OVER when the human's move mates or stalemates the engine.
+    """
+
+    def __init__(self, player, timeLimit=TIME_LIMIT, engine=None, book=None, tablebases=None):
+        """
+        Args:
+            player (int): The human's player number, the engine plays the other side.
+            timeLimit (float, optional): The engine's thinking time per move. Defaults to TIME_LIMIT.
+            engine (Engine, optional): The engine to play with, e.g. a ParallelEngine from parallelsearch.py.
+                Defaults to a new single process Engine. It's closed with the client.
+            book (OpeningBook, optional): Book moves from book.py are played without searching while there are any.
+                It's closed with the client.
+            tablebases (Tablebases, optional): Endgames in tablebase.py's tables are played perfectly without searching.
+                They're closed with the client.
+        """
+        self.player = player
+        self.timeLimit = timeLimit
+        self.engine = engine if engine is not None else Engine()
+        self.book = book
+        self.tablebases = tablebases
+        self.game = Game()
+        self.messages = queue.Queue()
+        self.received = queue.Queue()  # the human's moves, waiting for the engine thread
+        self.closed = threading.Event()
+        self.readerThread = None
+        self.wakeUp = None
+        self.connected = 1
+
+    def validConnection(self):
+        return self.connected
+
+    def listen(self, wakeUp=None):
+        self.wakeUp = wakeUp
+        self.readerThread = threading.Thread(target=self.play, daemon=True)
+        self.readerThread.start()
+
+    def push(self, message):
+        self.messages.put(message)
+        if self.wakeUp:
+            self.wakeUp()
+
+    def play(self):
+        # runs on the engine thread, alternating between thinking and waiting for the human's reply
+        while not self.closed.is_set():
+            if self.game.sideToMove() != self.player:
+                move = self.tablebases.bestMove(self.game.position) if self.tablebases else None
+                if move is None and self.book:
+                    move = self.book.choose(self.game.position)
+                if move is None:
+                    move = self.engine.search(self.game.position, self.timeLimit)
+                if move is None or self.closed.is_set():
+                    return
+                self.game.play(move)
+                self.push((MOVE, move))
+                if self.game.result() != ONGOING:  # Board sees the mate or stalemate when it applies the move
+                    return
+            move = self.received.get()
+            if move is None:
+                return
+            if self.game.tryPlay(move) is None:
+                self.push((REJECTED, move))
+                return
+            result = self.game.result()
+            if result != ONGOING:
+                self.push((GAME_OVER, WIN if result == CHECKMATE else DRAW))
+                return
+
+    def sendMove(self, move):
+        self.received.put(move)
+
+    def sendGameOver(self, reason):
+        # Board reports games it sees end, the engine already knows
+        pass
+
+    def poll(self):
+        try:
+            return self.messages.get_nowait()
+        except queue.Empty:
+            return None
+
+    def receive(self, timeout=1.0):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed.set()
+        self.engine.stop()
+        self.received.put(None)
+        # the engine thread stops within a few thousand nodes, after that nothing else uses the engine
+        if self.readerThread and self.readerThread is not threading.current_thread():
+            self.readerThread.join()
+        self.engine.close()
+        if self.book:
+            self.book.close()
+        if self.tablebases:
+            self.tablebases.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    from pgn import san
+    parser = argparse.ArgumentParser(description="Search a position and print statistics for each iteration.")
+    parser.add_argument("--fen", help="position to search, defaults to the starting position")
+    parser.add_argument("--time", type=float, default=TIME_LIMIT, help="seconds to search")
+    parser.add_argument("--depth", type=int, default=MAX_DEPTH, help="deepest iteration")
+    args = parser.parse_args()
+    position = Position.fromFen(args.fen) if args.fen else Position.initial()
+
+    def show(info):
+        print(f"depth {info['depth']} score {info['score']} move {san(position, info['move'])} nodes {info['nodes']} "
+              f"qnodes {info['quiescenceNodes']} nps {info['nps']} time {info['seconds']:.2f}s "
+              f"first move cutoffs {info['firstMoveCutoffRate']:.0%} table hits {info['tableHitRate']:.0%}")
+
+    best = Engine().search(position, args.time, args.depth, show)
+    print("bestmove", san(position, best) if best is not None else "none")
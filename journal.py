@@ -0,0 +1,300 @@
+"""
+  Append-only binary journal of finished games, written by the server.
+  A game is stored as one record: a fixed header, then every move as the 2 byte encoding from bitboard.py,
+  then a CRC32 of the record so a write torn by a crash is found and cut off when the journal is reopened.
+  Records go into numbered segment files, and each segment has an index file of fixed size (game id, offset) entries
+  in the order the games were written, so one game is found by scanning the small index files, not the segments.
+  Game ids come from the server, which numbers games when they start, so they're unique across workers
+  but not in order within a segment since games finish in any order.
+  Writes are buffered in memory and handed to a writer thread in batches (see Journal.maintain), which does the
+  write and the fsync, so recording a game costs the relay a few microseconds and it never waits on the disk.
+"""
+
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+# gameId, start time (seconds since the epoch), result, termination, number of moves
+RECORD_HEADER = struct.Struct("!QdBBH")
+CHECKSUM = struct.Struct("!I")
+INDEX_ENTRY = struct.Struct("!QQ")  # gameId, offset in the segment
+
+WHITE_WINS, BLACK_WINS, DRAWN, UNFINISHED = 0, 1, 2, 3
+NORMAL, ABANDONED = 0, 1
+
+SEGMENT_SIZE = 64 << 20  # bytes before a new segment is started
+BUFFER_SIZE = 1 << 20  # bytes buffered before they're written out, even if it isn't time to sync yet
+SYNC_INTERVAL = 1.0  # seconds between fsyncs, at most this much is lost if the machine crashes
+
+SEGMENT_SUFFIX, INDEX_SUFFIX = ".seg", ".idx"
+
+
+class GameRecord:
+    """ One game read back from the journal. """
+
+    def __init__(self, gameId, started, result, termination, moves):
+        self.gameId = gameId
+        self.started = started
+        self.result = result
+        self.termination = termination
+        self.moves = moves
+
+
+def encodeRecord(gameId, started, result, termination, moves):
+    record = RECORD_HEADER.pack(gameId, started, result, termination, len(moves)) + struct.pack(f"!{len(moves)}H", *moves)
+    return record + CHECKSUM.pack(zlib.crc32(record))
+
+
+def readRecord(file):
+    """ Reads the next record from an open segment.
+
+    Returns:
+        GameRecord | None: The record, or None at the end of the segment or at a torn or corrupt record.
+    """
+    header = file.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    gameId, started, result, termination, count = RECORD_HEADER.unpack(header)
+    body = file.read(2 * count + CHECKSUM.size)
+    if len(body) < 2 * count + CHECKSUM.size:
+        return None
+    if zlib.crc32(header + body[:-CHECKSUM.size]) != CHECKSUM.unpack_from(body, 2 * count)[0]:
+        return None
+    return GameRecord(gameId, started, result, termination, list(struct.unpack_from(f"!{count}H", body)))
+
+
+def readSegment(path):
+    """ Yields every game in a segment file in the order they were written, reading one record at a time.
+
+    Args:
+        path (str): The segment's path.
+    """
+    with open(path, "rb") as file:
+        record = readRecord(file)
+        while record:
+            yield record
+            record = readRecord(file)
+
+
+def listSegments(directory):
+    """ Returns the journal's segment paths in order, oldest first. """
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, name) for name in names]
+
+
+def workerJournals(directory):
+    # the worker-N subdirectories "server.py --workers" writes each worker's journal to, in worker order
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if name.startswith("worker-") and name[7:].isdigit()
+             and os.path.isdir(os.path.join(directory, name))]
+    return [os.path.join(directory, name) for name in sorted(names, key=lambda name: int(name[7:]))]
+
+
+def readJournal(directory):
+    """ Yields every game in a journal directory, oldest first, without loading whole segments into memory.
+        For a directory written by a server running with --workers, each worker's journal is read in turn.
+    """
+    for path in listSegments(directory):
+        yield from readSegment(path)
+    for path in workerJournals(directory):
+        yield from readJournal(path)
+
+
+class Journal:
+    """
+        Writes game records to a directory of segments. Only one Journal should write to a directory at a time,
+        so each server process gets its own directory (see runWorkers in server.py).
+        Game ids are assigned in the order games are written, which keeps segments and indexes sorted by id.
+        Records are buffered by the caller's thread, and a writer thread that owns the open files writes and fsyncs them.
+    """
+
+    def __init__(self, directory, segmentSize=SEGMENT_SIZE, bufferSize=BUFFER_SIZE, syncInterval=SYNC_INTERVAL):
+        """
+        Args:
+            directory (str): Where the segments go. Created if it doesn't exist, and appended to if it does.
+            segmentSize (int, optional): Bytes before a new segment is started. Defaults to SEGMENT_SIZE.
+            bufferSize (int, optional): Bytes buffered in memory before they're written out. Defaults to BUFFER_SIZE.
+            syncInterval (float, optional): Seconds between fsyncs. Defaults to SYNC_INTERVAL.
+        """
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.bufferSize = bufferSize
+        self.syncInterval = syncInterval
+        self.buffer = bytearray()
+        self.indexBuffer = bytearray()
+        self.segment = None  # the open files, only used by the writer thread once it's started
+        self.index = None
+        self.segmentName = None  # the current segment's path without the suffix
+        self.segmentNumber = 0
+        self.offset = 0  # where the next record starts in the current segment, counting buffered bytes
+        self.unsynced = False
+        self.lastSync = time.monotonic()
+        self.nextId = 1  # one more than the highest id recorded, the id given to games appended without one
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+        # (segment bytes, index bytes, fsync them, next segment name or None), or None to stop
+        self.tasks = queue.Queue()
+        self.writer = threading.Thread(target=self.writeLoop, name=f"journal {directory}", daemon=True)
+        self.writer.start()
+
+    def recover(self):
+        # reopens the newest segment, cutting off a record torn by a crash and rebuilding its index to match
+        segments = listSegments(self.directory)
+        if not segments:
+            return
+        path = segments[-1]
+        entries = bytearray()
+        offset = 0
+        with open(path, "rb") as file:
+            record = readRecord(file)
+            while record:
+                entries += INDEX_ENTRY.pack(record.gameId, offset)
+                offset = file.tell()
+                self.nextId = max(self.nextId, record.gameId + 1)
+                record = readRecord(file)
+        # ids aren't in order since games finish in any order, but a segment holds far more games than are ever
+        # in progress at once, so the highest id is in the newest segment or the one before it
+        if len(segments) > 1:
+            self.nextId = max(self.nextId, max((gameId for gameId, _ in self.readIndex(segments[-2])), default=0) + 1)
+        self.segmentName = path[:-len(SEGMENT_SUFFIX)]
+        self.segmentNumber = int(os.path.basename(self.segmentName), 16)
+        self.segment = open(path, "r+b")
+        self.segment.truncate(offset)
+        self.segment.seek(offset)
+        self.index = open(self.segmentName + INDEX_SUFFIX, "wb")
+        self.index.write(entries)
+        self.index.flush()
+        self.offset = offset
+
+    def readIndex(self, path):
+        # a segment's (game id, offset) entries in the order they were written
+        with open(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, "rb") as index:
+            data = index.read()
+        return INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size])
+
+    def startSegment(self):
+        # numbers segments in the order they're started, zero padded so the names sort in that order.
+        # Journals from before game ids came from the server named them after their first id, which sorts the same way
+        self.segmentNumber += 1
+        self.segmentName = os.path.join(self.directory, f"{self.segmentNumber:016x}")
+        self.flush(sync=True, nextSegment=self.segmentName)
+        self.offset = 0
+
+    def append(self, moves, result, termination=NORMAL, started=None, gameId=None):
+        """ Records a finished game. The record is buffered and reaches the disk on a later flush.
+
+        Args:
+            moves (list[int]): The game's moves in bitboard.py's encoding.
+            result (int): WHITE_WINS, BLACK_WINS, DRAWN, or UNFINISHED.
+            termination (int, optional): NORMAL or ABANDONED. Defaults to NORMAL.
+            started (float, optional): When the game started, as time.time(). Defaults to now.
+            gameId (int, optional): The id the server gave the game. Defaults to one more than the highest so far.
+
+        Returns:
+            int: The game's id.
+        """
+        gameId = self.nextId if gameId is None else gameId
+        record = encodeRecord(gameId, time.time() if started is None else started, result, termination, moves)
+        if self.segmentName is None or (self.offset and self.offset + len(record) > self.segmentSize):
+            self.startSegment()
+        self.nextId = max(self.nextId, gameId + 1)
+        self.buffer += record
+        self.indexBuffer += INDEX_ENTRY.pack(gameId, self.offset)
+        self.offset += len(record)
+        self.written += 1
+        self.unsynced = True
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+        return gameId
+
+    def flush(self, sync=False, nextSegment=None):
+        """ Hands buffered records to the writer thread without waiting for them to be written.
+
+        Args:
+            sync (bool, optional): Also fsync the segment and index so the records survive a crash. Defaults to False.
+            nextSegment (str, optional): Close the current segment after this write and start the one with this
+                path, without the suffix.
+        """
+        sync = sync and self.unsynced
+        if not (self.buffer or sync or nextSegment):
+            return
+        # the writer gets the buffers themselves rather than copies, and new ones take their place
+        self.tasks.put((self.buffer, self.indexBuffer, sync, nextSegment))
+        self.buffer, self.indexBuffer = bytearray(), bytearray()
+        if sync:
+            self.unsynced = False
+            self.lastSync = time.monotonic()
+
+    def writeLoop(self):
+        # runs on the writer thread, the only place the segment and index files are used after recover()
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    if self.segment:
+                        self.segment.close()
+                        self.index.close()
+                        self.segment = self.index = None
+                    return
+                records, entries, sync, nextSegment = task
+                try:
+                    self.write(records, entries, sync, nextSegment)
+                except OSError as e:  # e.g. a full disk, the server keeps running without these games
+                    print(f"Journal {self.directory}: write failed, {len(entries) // INDEX_ENTRY.size} games lost: {e}")
+            finally:
+                self.tasks.task_done()
+
+    def write(self, records, entries, sync, nextSegment):
+        # every batch is flushed out of the files' own buffers so find() and readers see it
+        if self.segment and records:
+            self.segment.write(records)
+            self.index.write(entries)
+            self.segment.flush()
+            self.index.flush()
+        if self.segment and (sync or nextSegment):
+            os.fsync(self.segment.fileno())
+            os.fsync(self.index.fileno())
+        if nextSegment:
+            if self.segment:
+                self.segment.close()
+                self.index.close()
+                self.segment = self.index = None
+            self.segment = open(nextSegment + SEGMENT_SUFFIX, "wb")
+            self.index = open(nextSegment + INDEX_SUFFIX, "wb")
+
+    def maintain(self, now=None):
+        # called from the server's event loop, syncs once every syncInterval while there are unsynced games
+        now = time.monotonic() if now is None else now
+        if self.unsynced and now - self.lastSync >= self.syncInterval:
+            self.flush(sync=True)
+
+    def close(self):
+        # waits for everything buffered to be written and synced, then closes the files
+        if self.writer.is_alive():
+            self.flush(sync=True)
+            self.tasks.put(None)
+            self.writer.join()
+
+    def find(self, gameId):
+        """ Looks up one game by id using the segments' indexes, newest segment first.
+
+        Returns:
+            GameRecord | None: The game, or None if it isn't in the journal.
+        """
+        if self.writer.is_alive():
+            self.flush()
+            self.tasks.join()
+        for path in reversed(listSegments(self.directory)):
+            for entryId, offset in self.readIndex(path):
+                if entryId == gameId:
+                    with open(path, "rb") as segment:
+                        segment.seek(offset)
+                        return readRecord(segment)
+        return None
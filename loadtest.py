@@ -0,0 +1,365 @@
+"""
+  Load generator for server.py. Simulated players connect, wait to be matched, play random legal games at a set pace,
+  and connect again for another game, until the test is over. They speak the same protocol.py frames as client.py,
+  but on asyncio streams, so one process runs thousands of players without a window or a thread for each.
+  Add processes with --processes when one core can't keep up with the players' move generation.
+
+  White waits about 1 / move rate seconds before each move and black replies as soon as white's move arrives,
+  so each player moves at the chosen rate, and the time from white sending a move to black's reply arriving is a round
+  trip through the server: two relays, with black picking a random move in between. That's the move round trip reported.
+  Spectators (--spectators) connect to the spectator port and watch the game with the most spectators, watching another
+  each time one ends, so their broadcasts' effect on the players' round trips can be measured.
+  Run "python loadtest.py --players 2000 --duration 60 --move-rate 1" against a running server, and add
+  "--output load.jsonl" to keep a JSON line per run to compare between commits, like benchmark.py.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bitboard import Position
+from protocol import *
+from metrics import Histogram, formatMicros
+from matchmaking import DEFAULT_RATING, DEFAULT_TIME_CONTROL
+from server import HOST, PORT, SPECTATOR_PORT, raiseFileLimit
+from benchmark import currentCommit
+
+CONNECT_TIMEOUT = 5.0  # seconds to connect and be sent CONNECTED
+MATCH_TIMEOUT = 30.0  # seconds to wait for an opponent before giving up and reconnecting
+REPLY_TIMEOUT = 30.0  # seconds to wait for the opponent's move, on top of their pacing
+RETRY_DELAY = 1.0  # seconds before reconnecting after a failed or refused connection
+MAX_PLIES = 200  # random games rarely end in mate, so the player to move leaves after this many plies
+
+
+class LoadStats:
+    """ What one process's players saw. Histograms are in microseconds, like the server's metrics. """
+
+    COUNTERS = ("attempts", "connected", "refused", "failed", "matched", "matchTimeouts", "finished", "abandoned",
+                "left", "opponentLeft", "dropped", "rejected", "illegal", "movesSent", "movesReceived",
+                "bytesSent", "bytesReceived", "watchAttempts", "watching", "watchRefused", "watchFailed",
+                "watchDropped", "snapshots", "watchedMoves", "watchedResults")
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.connectLatency = Histogram("connect", "Time to connect and be sent CONNECTED.")
+        self.matchLatency = Histogram("match", "Time from CONNECTED to MATCHED.")
+        self.roundTrip = Histogram("roundTrip", "Time from sending a move to the opponent's reply arriving.")
+
+    def merge(self, other):
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.connectLatency.merge(other.connectLatency)
+        self.matchLatency.merge(other.matchLatency)
+        self.roundTrip.merge(other.roundTrip)
+
+
+class SimulatedClient:
+    """ client.py's Client on asyncio streams: the same frames, buffered until a whole message arrives. """
+
+    def __init__(self, reader, writer, stats):
+        self.reader = reader
+        self.writer = writer
+        self.stats = stats
+        self.buffer = bytearray()
+
+    async def receive(self, timeout):
+        """ Waits for the next message from the server.
+
+        Returns:
+            tuple | None: (kind, value) as decoded by protocol.decode(), or None if the server closed the connection.
+
+        Raises:
+            TimeoutError: If no whole message arrived within the timeout.
+        """
+        message = nextMessage(self.buffer)
+        while message is None:
+            data = await asyncio.wait_for(self.reader.read(65536), timeout)
+            if not data:
+                return None
+            self.stats.bytesReceived += len(data)
+            self.buffer += data
+            message = nextMessage(self.buffer)
+        return message
+
+    async def sendFrame(self, frame):
+        self.writer.write(frame)
+        self.stats.bytesSent += len(frame)
+        await self.writer.drain()
+
+    async def sendMove(self, move):
+        await self.sendFrame(encodeMove(move))
+
+    async def sendSeek(self, rating, timeControl):
+        await self.sendFrame(encodeSeek(rating, timeControl))
+
+    async def sendWatch(self, gameId=0):
+        await self.sendFrame(encodeWatch(gameId))
+
+    def close(self):
+        self.writer.close()
+
+
+async def playGame(client, player, settings, stats, rng):
+    """ Plays random legal moves until the game ends, the ply limit is reached, or the player leaves. """
+    position = Position.initial()
+    plies = 0
+    sentAt = None
+    while True:
+        if position.side == player:
+            if plies >= settings.max_plies:
+                stats.abandoned += 1
+                return
+            if rng.random() < settings.leave_rate:
+                stats.left += 1
+                return
+            if player == 0:
+                await asyncio.sleep(rng.uniform(0.5, 1.5) / settings.move_rate)
+            move = rng.choice(position.legalMoves())
+            position.makeMove(move)
+            plies += 1
+            sentAt = time.perf_counter_ns()
+            await client.sendMove(move)
+            stats.movesSent += 1
+            if not position.hasLegalMove():  # the server tells the player who ended the game
+                await client.receive(REPLY_TIMEOUT)
+                stats.finished += 1
+                return
+            continue
+        message = await client.receive(REPLY_TIMEOUT + 2 / settings.move_rate)
+        if message is None:
+            stats.dropped += 1
+            return
+        kind, value = message
+        if kind == MOVE:
+            stats.movesReceived += 1
+            if player == 0 and sentAt is not None:
+                stats.roundTrip.record((time.perf_counter_ns() - sentAt) // 1000)
+            if not position.isLegalMove(value):
+                stats.illegal += 1
+                return
+            position.makeMove(value)
+            plies += 1
+            if not position.hasLegalMove():
+                stats.finished += 1
+                return
+        elif kind == GAME_OVER:
+            stats.opponentLeft += 1
+            return
+        elif kind == REJECTED:
+            stats.rejected += 1
+            return
+
+
+async def playOnce(settings, stats, rng):
+    """ Connects, waits for a match, plays one game, and disconnects. """
+    stats.attempts += 1
+    start = time.perf_counter_ns()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(settings.host, settings.port), CONNECT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        stats.failed += 1
+        await asyncio.sleep(RETRY_DELAY)
+        return
+    client = SimulatedClient(reader, writer, stats)
+    try:
+        message = await client.receive(CONNECT_TIMEOUT)
+        if message != (CONNECTED, 1):
+            stats.refused += 1
+            await asyncio.sleep(RETRY_DELAY)
+            return
+        connected = time.perf_counter_ns()
+        stats.connected += 1
+        stats.connectLatency.record((connected - start) // 1000)
+        if settings.rating_spread:
+            await client.sendSeek(max(DEFAULT_RATING + int(rng.gauss(0, settings.rating_spread)), 0), DEFAULT_TIME_CONTROL)
+        message = await client.receive(MATCH_TIMEOUT)
+        if message is None or message[0] != MATCHED:
+            stats.matchTimeouts += 1
+            return
+        stats.matched += 1
+        stats.matchLatency.record((time.perf_counter_ns() - connected) // 1000)
+        await playGame(client, message[1], settings, stats, rng)
+    except (OSError, asyncio.TimeoutError):
+        stats.dropped += 1
+    finally:
+        client.close()
+
+
+async def watchGames(settings, stats):
+    """ Connects to the spectator port and watches games until the connection closes.
+        Spectators have their own connection counters so they don't change the players' figures.
+    """
+    stats.watchAttempts += 1
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(settings.host, settings.spectator_port),
+                                                CONNECT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        stats.watchFailed += 1
+        await asyncio.sleep(RETRY_DELAY)
+        return
+    client = SimulatedClient(reader, writer, stats)
+    try:
+        if await client.receive(CONNECT_TIMEOUT) != (CONNECTED, 1):
+            stats.watchRefused += 1
+            await asyncio.sleep(RETRY_DELAY)
+            return
+        stats.watching += 1
+        await client.sendWatch()
+        while True:
+            message = await client.receive(MATCH_TIMEOUT)
+            if message is None:
+                return
+            kind, value = message
+            if kind == SNAPSHOT:
+                stats.snapshots += 1
+            elif kind == MOVE:
+                stats.watchedMoves += 1
+            elif kind == GAME_OVER:
+                if value == UNKNOWN_GAME:  # no games started yet
+                    await asyncio.sleep(RETRY_DELAY)
+                else:
+                    stats.watchedResults += 1
+                await client.sendWatch()
+    except (OSError, asyncio.TimeoutError):
+        stats.watchDropped += 1
+    finally:
+        client.close()
+
+
+async def simulatePlayer(settings, stats, delay, deadline, seed):
+    rng = random.Random(seed)
+    await asyncio.sleep(delay)
+    while time.monotonic() < deadline:
+        await playOnce(settings, stats, rng)
+        if not settings.reconnect:
+            return
+
+
+async def simulateSpectator(settings, stats, delay, deadline):
+    await asyncio.sleep(delay)
+    while time.monotonic() < deadline:
+        await watchGames(settings, stats)
+
+
+async def simulatePlayers(settings, players, spectators, seed):
+    stats = LoadStats()
+    deadline = time.monotonic() + settings.duration
+    tasks = [asyncio.create_task(simulatePlayer(settings, stats, index * settings.ramp / players, deadline, seed + index))
+             for index in range(players)]
+    tasks += [asyncio.create_task(simulateSpectator(settings, stats, settings.ramp + index * settings.ramp / spectators, deadline))
+              for index in range(spectators)]
+    # players finishing a game after the deadline are stopped where they are
+    await asyncio.wait(tasks, timeout=max(deadline - time.monotonic(), 0))
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats
+
+
+def runProcess(settings, players, spectators, seed):
+    raiseFileLimit(players + spectators)
+    return asyncio.run(simulatePlayers(settings, players, spectators, seed))
+
+
+def run(settings):
+    """ Runs the players, split between settings.processes processes.
+
+    Returns:
+        tuple[LoadStats, float]: Everyone's statistics merged, and the seconds the test ran for.
+    """
+    start = time.perf_counter()
+    processes = max(settings.processes, 1)
+
+    def split(total):
+        return [total // processes + (index < total % processes) for index in range(processes)]
+
+    if processes == 1:
+        stats = runProcess(settings, settings.players, settings.spectators, settings.seed)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(runProcess, settings, players, spectators, settings.seed + index * players)
+                       for index, (players, spectators) in enumerate(zip(split(settings.players), split(settings.spectators)))]
+            stats = LoadStats()
+            for future in futures:
+                stats.merge(future.result())
+    return stats, time.perf_counter() - start
+
+
+def summarize(stats, seconds, settings):
+    """ The figures to size a server by, as one JSON-able dict. Latencies are in microseconds. """
+
+    def percentiles(histogram):
+        return {"p50": histogram.percentile(0.5), "p90": histogram.percentile(0.9), "p99": histogram.percentile(0.99),
+                "p999": histogram.percentile(0.999), "max": histogram.maximum}
+
+    return {
+        "benchmark": "loadtest", "commit": currentCommit(), "players": settings.players, "spectators": settings.spectators,
+        "processes": settings.processes, "moveRate": settings.move_rate, "seconds": round(seconds, 3),
+        **{name: getattr(stats, name) for name in LoadStats.COUNTERS},
+        "connectSuccessRate": stats.connected / stats.attempts if stats.attempts else 0.0,
+        "movesPerSecond": round(stats.movesReceived / seconds, 1) if seconds else 0.0,
+        "connectLatency": percentiles(stats.connectLatency),
+        "matchLatency": percentiles(stats.matchLatency),
+        "roundTrip": percentiles(stats.roundTrip),
+    }
+
+
+def report(summary):
+    def latencies(values):
+        return " ".join(f"{name} {formatMicros(value)}" for name, value in values.items())
+
+    processes = summary["processes"]
+    print(f"{summary['players']} players in {processes} process{'es' if processes != 1 else ''} for {summary['seconds']:.1f}s")
+    print(f"Connections: {summary['attempts']} attempted, {summary['connected']} connected "
+          f"({100 * summary['connectSuccessRate']:.1f}%), {summary['refused']} refused, {summary['failed']} failed, "
+          f"{latencies(summary['connectLatency'])}")
+    print(f"Matchmaking: {summary['matched']} matched, {summary['matchTimeouts']} timed out, "
+          f"{latencies(summary['matchLatency'])}")
+    print(f"Games: {summary['finished']} finished, {summary['abandoned']} reached the ply limit, {summary['left']} left early, "
+          f"{summary['opponentLeft']} opponents left, {summary['dropped']} dropped, "
+          f"{summary['rejected']} rejected and {summary['illegal']} illegal moves")
+    print(f"Moves: {summary['movesSent']} sent, {summary['movesReceived']} relayed, {summary['movesPerSecond']} relayed/s, "
+          f"round trip {latencies(summary['roundTrip'])}")
+    if summary["spectators"]:
+        print(f"Spectators: {summary['watchAttempts']} attempted, {summary['watching']} connected, "
+              f"{summary['watchRefused']} refused, {summary['watchFailed']} failed, {summary['watchDropped']} dropped, "
+              f"{summary['snapshots']} snapshots, "
+              f"{summary['watchedMoves']} moves and {summary['watchedResults']} results received")
+    print(f"Traffic: {summary['bytesSent'] / summary['seconds'] / 1024:.1f}KB/s sent, "
+          f"{summary['bytesReceived'] / summary['seconds'] / 1024:.1f}KB/s received")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate players against a running server and measure it.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--players", type=int, default=100, help="simulated players connected at once")
+    parser.add_argument("--spectators", type=int, default=0, help="simulated spectators, connected after the players")
+    parser.add_argument("--spectator-port", type=int, default=SPECTATOR_PORT)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run for")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which players first connect")
+    parser.add_argument("--move-rate", type=float, default=1.0, help="moves per second each player makes")
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES, help="plies after which a game is abandoned")
+    parser.add_argument("--leave-rate", type=float, default=0.0,
+                        help="chance a player disconnects before each of their moves")
+    parser.add_argument("--no-reconnect", dest="reconnect", action="store_false",
+                        help="play one game per player instead of reconnecting for another")
+    parser.add_argument("--rating-spread", type=int, default=0,
+                        help="send SEEK with ratings spread this much around the default, 0 to not send it")
+    parser.add_argument("--processes", type=int, default=1, help="processes to split the players between")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to append the results to as a JSON line")
+    args = parser.parse_args()
+
+    stats, seconds = run(args)
+    summary = summarize(stats, seconds, args)
+    report(summary)
+    if args.output:
+        with open(args.output, "a") as output:
+            output.write(json.dumps(summary) + "\n")
+    sys.exit(0 if summary["connected"] else 1)
@@ -1,11 +1,19 @@
+import os
 import time
 import pygame
 import sys
 from client import Client
-from board import Board
-import threading
+from protocol import MATCHED
+from board import Board, wakeDisplay
+from engine import EngineClient
+from parallelsearch import createEngine
+from book import OpeningBook
+from tablebase import Tablebases
 from consts import *
 
+# posted once the waiting screen has waited OPPONENT_TIMEOUT seconds, the player is then offered the engine instead
+OPPONENT_TIMEOUT_EVENT = pygame.USEREVENT + 2
+
 
 def drawButton(screen, x, y, text):
     """Draws a button centered at (x,y) with text displaying over it
@@ -31,12 +39,13 @@ def drawButton(screen, x, y, text):
 
 def homeScreen():
     """
-        Displays a home screen, where a user can choose to join a new game and be directed to the next screen.
+        Displays a home screen, where a user can choose to join a new game or play the computer and be directed to the next screen.
     """
     while True:
         screen.fill(COLOR_OPTIONS[4])
 
-        joinGame = drawButton(screen, WIDTH//2, HEIGHT//2, "Join a Game")
+        joinGame = drawButton(screen, WIDTH//2, HEIGHT//2 - 120, "Join a Game")
+        playComputer = drawButton(screen, WIDTH//2, HEIGHT//2 + 120, "Play Computer")
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -48,27 +57,13 @@ def homeScreen():
                 if joinGame.collidepoint(pos):
                     findingOpponent()
                     return
+                if playComputer.collidepoint(pos):
+                    playEngine()
+                    return
 
         pygame.display.update()
 
 
-def waitingForOpponent(client):
-    """ Runs in a loop until opponent is found or user exits.
-
-    Args:
-        client (Client): client object to communicate with the game server.
-    """
-    global stopWaiting, playerNumber
-
-    while not stopWaiting.is_set():
-        message = client.receive()
-        if message and (message == "0" or message == "1"):
-            print("Opponent has been found")
-            playerNumber = int(message)
-            stopWaiting.set()
-        time.sleep(1)
-
-
 def unableToConnect():
     """
         If server is at occupancy limit or client fails to connect, notify user of error.
@@ -87,10 +82,10 @@ def unableToConnect():
 def findingOpponent():
     """
         Handles connection to the server, waiting for opponent, and start/end of game.
-        Uses threading when waiting for opponent to prevent lags in display.
-        The stopWaiting threading event is needed for a user to exit without waitingForOpponent preventing pygame from exiting.
+        The client's reader thread posts a pygame event when a message arrives, so the waiting screen sleeps in
+        pygame.event.wait() and reacts to the match notification as soon as it arrives.
+        If nobody is matched within OPPONENT_TIMEOUT seconds, the player plays the engine instead of waiting forever.
     """
-    global stopWaiting, playerNumber
     player = Client()
     successfulConnection = player.validConnection()
 
@@ -104,23 +99,55 @@ def findingOpponent():
     drawButton(screen, 400, 400, "Looking for Opponent")
     pygame.display.update()
 
-    stopWaiting.clear()
-    waitingThread = threading.Thread(target=waitingForOpponent, args=(player,))
-    waitingThread.start()
-
-    while not stopWaiting.is_set():
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                stopWaiting.set()
-                player.close()
-                pygame.quit()
-                sys.exit()
+    player.listen(wakeDisplay)
+    pygame.time.set_timer(OPPONENT_TIMEOUT_EVENT, int(OPPONENT_TIMEOUT * 1000), loops=1)
+    playerNumber = None
+    while playerNumber is None:
+        event = pygame.event.wait()
+        if event.type == pygame.QUIT:
+            player.close()
+            pygame.quit()
+            sys.exit()
+        if event.type == OPPONENT_TIMEOUT_EVENT:
+            print("No opponent found, playing the computer")
+            player.close()
+            playEngine()
+            return
+        # stop at the match notification, anything after it belongs to the game
+        message = player.poll()
+        while message and playerNumber is None:
+            if message[0] == MATCHED:
+                print("Opponent has been found")
+                playerNumber = message[1]
+            else:
+                message = player.poll()
+        if playerNumber is None and player.closed.is_set():
+            pygame.time.set_timer(OPPONENT_TIMEOUT_EVENT, 0)
+            player.close()
+            unableToConnect()
+            return
+    pygame.time.set_timer(OPPONENT_TIMEOUT_EVENT, 0)
 
     board = Board(player, playerNumber, screen)
     val = board.startGame()
     endGame(val)
 
 
+def playEngine():
+    """
+        Starts a game against the engine in engine.py, which plays black and answers through the same
+        message queue a server connection uses, so the board can't tell the difference.
+        The engine searches on ENGINE_WORKERS processes (see parallelsearch.py), plays from BOOK_FILE
+        (see book.py) while the game is still in the book, and plays endgames in TABLEBASE_DIRECTORY perfectly (see tablebase.py).
+    """
+    book = OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else None
+    tablebases = Tablebases(TABLEBASE_DIRECTORY)
+    client = EngineClient(1 - ENGINE_PLAYER, ENGINE_TIME, createEngine(ENGINE_WORKERS), book, tablebases)
+    board = Board(client, 1 - ENGINE_PLAYER, screen)
+    val = board.startGame()
+    endGame(val)
+
+
 def endGame(reason):
     """Displays a screen with the reason why the game ended.
 
@@ -129,7 +156,8 @@ def endGame(reason):
     """
 
     message = ["Your Opponent Disconnected.",
-               "Congrats! You Won!", "Checkmate. You Lose."]
+               "Congrats! You Won!", "Checkmate. You Lose.", "Stalemate. It's a Draw.",
+               "Move Rejected by Server."]
     screen.fill(COLOR_OPTIONS[5])
     drawButton(screen, 400, 400, message[reason])
     pygame.display.update()
@@ -140,6 +168,4 @@ def endGame(reason):
 pygame.init()
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 pygame.display.set_caption("Chess Game")
-stopWaiting = threading.Event()
-playerNumber = 0
 homeScreen()
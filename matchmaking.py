@@ -0,0 +1,200 @@
+"""
+  Matchmaking queue shared by the event loop server and the multi-worker coordinator in server.py.
+  Players wait in buckets keyed by time control and rating band. Joining, leaving, and taking the longest
+  waiting player out of a bucket are all O(1), so thousands of players can queue at once.
+  Pairing happens in batched ticks. Players are first paired inside their own bucket, and the longer someone
+  waits, the more neighbouring rating bands they can be paired with.
+"""
+
+import time
+from collections import OrderedDict, deque
+
+# time controls a player can ask for, the server only uses them to keep different kinds of games apart
+BULLET, BLITZ, RAPID, CLASSICAL = 0, 1, 2, 3
+
+# what a client that never sends a SEEK message is queued with
+DEFAULT_RATING = 1200
+DEFAULT_TIME_CONTROL = RAPID
+
+BAND_WIDTH = 100  # rating points per bucket
+WIDEN_AFTER = 5.0  # seconds of waiting before a player can be paired one more band away
+MAX_WIDEN = 5  # the furthest a player can be paired from their own band, in bands
+TICK_INTERVAL = 0.05  # seconds between pairing ticks
+
+
+class Ticket:
+    """ A player's place in the queue. """
+
+    def __init__(self, player, rating, timeControl, band, queuedAt):
+        self.player = player
+        self.rating = rating
+        self.timeControl = timeControl
+        self.band = band
+        self.queuedAt = queuedAt
+
+
+class Matchmaker:
+    """
+        Each bucket is an OrderedDict of tickets in the order players joined, so the longest waiting player
+        is at the front and a player who leaves is unlinked from the middle, both in O(1).
+        Empty buckets are deleted, so a tick only visits buckets that have someone in them.
+    """
+
+    def __init__(self, bandWidth=BAND_WIDTH, widenAfter=WIDEN_AFTER, maxWiden=MAX_WIDEN, sampleSize=10000, waitHistogram=None):
+        """
+        Args:
+            bandWidth (int, optional): Rating points per bucket. Defaults to BAND_WIDTH.
+            widenAfter (float, optional): Seconds of waiting per extra band a player can be paired across. Defaults to WIDEN_AFTER.
+            maxWiden (int, optional): The most extra bands a player can be paired across. Defaults to MAX_WIDEN.
+            sampleSize (int, optional): How many recent queue waits are kept for the wait percentiles. Defaults to 10000.
+            waitHistogram (metrics.Histogram, optional): Also records every queue wait, in microseconds.
+        """
+        self.bandWidth = bandWidth
+        self.widenAfter = widenAfter
+        self.maxWiden = maxWiden
+        self.buckets = {}  # (timeControl, band) -> OrderedDict of player -> Ticket
+        self.tickets = {}  # player -> Ticket
+        self.waits = deque(maxlen=sampleSize)
+        self.matched = 0
+        self.cancelled = 0
+        self.totalWait = 0.0
+        self.longestWait = 0.0
+        self.waitHistogram = waitHistogram
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def __contains__(self, player):
+        return player in self.tickets
+
+    def enqueue(self, player, rating=DEFAULT_RATING, timeControl=DEFAULT_TIME_CONTROL, now=None):
+        """ Adds a player to the queue. A player who is already queued is moved to their new bucket but keeps their place in time.
+
+        Args:
+            player (object): Any hashable object, such as a server Connection.
+            rating (int, optional): The player's rating. Defaults to DEFAULT_RATING.
+            timeControl (int, optional): One of BULLET, BLITZ, RAPID, or CLASSICAL. Defaults to DEFAULT_TIME_CONTROL.
+            now (float, optional): The current time.monotonic(), passed in by callers that already have it.
+        """
+        queuedAt = time.monotonic() if now is None else now
+        previous = self.tickets.get(player)
+        if previous:
+            self.remove(previous)
+            queuedAt = previous.queuedAt
+        ticket = Ticket(player, rating, timeControl, rating // self.bandWidth, queuedAt)
+        self.tickets[player] = ticket
+        key = (timeControl, ticket.band)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = OrderedDict()
+        bucket[player] = ticket
+
+    def cancel(self, player):
+        """ Takes a player out of the queue, e.g. when they disconnect.
+
+        Returns:
+            bool: True if the player was queued.
+        """
+        ticket = self.tickets.get(player)
+        if ticket is None:
+            return False
+        self.remove(ticket)
+        self.cancelled += 1
+        return True
+
+    def remove(self, ticket):
+        del self.tickets[ticket.player]
+        key = (ticket.timeControl, ticket.band)
+        bucket = self.buckets[key]
+        del bucket[ticket.player]
+        if not bucket:
+            del self.buckets[key]
+
+    def oldest(self, timeControl, band):
+        bucket = self.buckets.get((timeControl, band))
+        return next(iter(bucket.values())) if bucket else None
+
+    def tick(self, now=None):
+        """ Pairs everyone who can be paired right now.
+            Players in the same bucket are paired first, longest waiting first. Then anyone left over looks in the
+            nearest bands their wait allows, closest band first and the longer waiting of two equally close players first.
+
+        Args:
+            now (float, optional): The current time.monotonic().
+
+        Returns:
+            list[tuple]: (white, black) players for each new game. The player who waited longer plays white.
+        """
+        now = time.monotonic() if now is None else now
+        pairs = []
+        leftovers = []
+        for key in list(self.buckets):
+            bucket = self.buckets[key]
+            while len(bucket) >= 2:
+                first = next(iter(bucket.values()))
+                self.remove(first)
+                second = next(iter(bucket.values()))
+                self.remove(second)
+                pairs.append(self.record(first, second, now))
+            if len(bucket) == 1:
+                leftovers.append(next(iter(bucket.values())))
+
+        # after pairing inside buckets every bucket holds at most one player
+        leftovers.sort(key=lambda ticket: ticket.queuedAt)
+        for ticket in leftovers:
+            if ticket.player not in self.tickets:  # already taken as someone else's opponent
+                continue
+            reach = min(int((now - ticket.queuedAt) / self.widenAfter), self.maxWiden)
+            for distance in range(1, reach + 1):
+                candidates = [partner for partner in (self.oldest(ticket.timeControl, ticket.band - distance),
+                                                      self.oldest(ticket.timeControl, ticket.band + distance)) if partner]
+                if candidates:
+                    partner = min(candidates, key=lambda partner: partner.queuedAt)
+                    self.remove(ticket)
+                    self.remove(partner)
+                    pairs.append(self.record(ticket, partner, now))
+                    break
+        return pairs
+
+    def record(self, first, second, now):
+        # updates the wait metrics for a new pair and returns it with the longer waiting player first
+        if second.queuedAt < first.queuedAt:
+            first, second = second, first
+        for ticket in (first, second):
+            wait = now - ticket.queuedAt
+            self.waits.append(wait)
+            self.totalWait += wait
+            self.longestWait = max(self.longestWait, wait)
+            if self.waitHistogram:
+                self.waitHistogram.record(int(wait * 1e6))
+        self.matched += 2
+        return first.player, second.player
+
+    def stats(self):
+        """ Queue size and how long matched players waited.
+
+        Returns:
+            dict: queued, buckets, matched, cancelled, meanWait, maxWait, and p50Wait/p90Wait/p99Wait over recent matches, in seconds.
+        """
+        waits = sorted(self.waits)
+
+        def percentile(fraction):
+            return waits[min(int(fraction * len(waits)), len(waits) - 1)] if waits else 0.0
+
+        return {
+            "queued": len(self.tickets),
+            "buckets": len(self.buckets),
+            "matched": self.matched,
+            "cancelled": self.cancelled,
+            "meanWait": self.totalWait / self.matched if self.matched else 0.0,
+            "maxWait": self.longestWait,
+            "p50Wait": percentile(0.5),
+            "p90Wait": percentile(0.9),
+            "p99Wait": percentile(0.99),
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"Matchmaking: {stats['queued']} queued in {stats['buckets']} buckets, {stats['matched']} matched, "
+                f"{stats['cancelled']} cancelled, wait mean {stats['meanWait']:.3f}s p50 {stats['p50Wait']:.3f}s "
+                f"p90 {stats['p90Wait']:.3f}s p99 {stats['p99Wait']:.3f}s max {stats['maxWait']:.3f}s")
@@ -0,0 +1,252 @@
+"""
+  Counters, gauges and latency histograms for the server, exposed over HTTP in the Prometheus text format.
+  Metrics are updated by the event loop that owns them without any locks: a counter is an int attribute and
+  recording a latency is a few integer operations, so they're cheap enough to leave on all the time.
+  The HTTP endpoint runs on its own thread and only reads, so a scrape may see a histogram mid update,
+  which is off by at most the one observation being recorded.
+
+  Histograms use log-linear buckets like HdrHistogram: exact below 32, then 16 buckets for every power of two,
+  so any value is within about 6% of its bucket's bounds, with no fixed range to configure.
+  Values are recorded in microseconds and exported in seconds.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = 9594
+SUMMARY_INTERVAL = 60.0  # seconds between summary lines in the server's log
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_VALUE = (1 << 40) - 1  # larger values (about 12 days in microseconds) are counted as this
+BUCKETS = ((MAX_VALUE.bit_length() - SUB_BUCKET_BITS) << SUB_BUCKET_BITS) + SUB_BUCKETS
+
+# the Prometheus buckets histograms are exported with, in microseconds
+EXPORT_BOUNDS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+                 1000000, 2500000, 5000000, 10000000, 30000000, 60000000]
+
+
+def bucketIndex(value):
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+
+def bucketBounds(index):
+    # the lowest and highest value counted in a bucket
+    shift = max((index >> SUB_BUCKET_BITS) - 1, 0)
+    mantissa = index - (shift << SUB_BUCKET_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class Counter:
+    """ A value that only goes up, like moves relayed or bytes sent. """
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    """ A value that goes up and down. If a function is given, it's called for the current value at every read. """
+
+    def __init__(self, name, help, function=None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+
+class Histogram:
+    """ Counts observations, in microseconds, in log-linear buckets. """
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+        self.marked = [0] * BUCKETS  # counts when sinceMark() was last called
+
+    def record(self, value):
+        """ Adds one observation.
+
+        Args:
+            value (int): Microseconds.
+        """
+        if value > MAX_VALUE:
+            value = MAX_VALUE
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+        if value < 2 * SUB_BUCKETS:
+            self.counts[value] += 1
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS - 1
+            self.counts[(shift << SUB_BUCKET_BITS) + (value >> shift)] += 1
+
+    def percentile(self, fraction, counts=None):
+        """ The value below which a fraction of observations fall, as the upper bound of its bucket.
+
+        Args:
+            fraction (float): E.g. 0.99.
+            counts (list[int], optional): Bucket counts to use instead of the histogram's, e.g. from sinceMark().
+
+        Returns:
+            int: Microseconds, 0 if nothing was recorded.
+        """
+        counts = self.counts if counts is None else counts
+        total = sum(counts)
+        if not total:
+            return 0
+        target = max(int(fraction * total + 0.5), 1)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+                return min(bucketBounds(index)[1], self.maximum)
+        return self.maximum
+
+    def merge(self, other):
+        # adds another histogram's observations, e.g. one recorded in a different process
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def sinceMark(self):
+        # the bucket counts recorded since the last call, for percentiles over one summary interval
+        counts = self.counts[:]
+        interval = [now - before for now, before in zip(counts, self.marked)]
+        self.marked = counts
+        return interval
+
+    def cumulative(self, bounds=EXPORT_BOUNDS):
+        # the number of observations at or below each bound, to HDR precision
+        result = []
+        seen = 0
+        index = 0
+        counts = self.counts[:]
+        for bound in bounds:
+            last = bucketIndex(bound)
+            while index <= last:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class Registry:
+    """ Holds one process's metrics and writes them in the Prometheus text exposition format. """
+
+    def __init__(self, prefix="chess_", labels=None):
+        """
+        Args:
+            prefix (str, optional): Put in front of every metric name. Defaults to "chess_".
+            labels (dict, optional): Labels added to every sample, e.g. {"worker": "3"}.
+        """
+        self.prefix = prefix
+        self.labels = labels or {}
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.add(Counter(name, help))
+
+    def gauge(self, name, help, function=None):
+        return self.add(Gauge(name, help, function))
+
+    def histogram(self, name, help):
+        return self.add(Histogram(name, help))
+
+    def labelText(self, extra=None):
+        labels = {**self.labels, **(extra or {})}
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+    def exposition(self):
+        """ All metrics in the Prometheus text format. """
+        lines = []
+        plain = self.labelText()
+        for metric in self.metrics:
+            name = self.prefix + metric.name
+            lines.append(f"# HELP {name} {metric.help}")
+            if isinstance(metric, Counter):
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{plain} {metric.value}")
+            elif isinstance(metric, Gauge):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{plain} {metric.get()}")
+            else:
+                lines.append(f"# TYPE {name} histogram")
+                count = metric.count
+                for bound, seen in zip(EXPORT_BOUNDS, metric.cumulative()):
+                    lines.append(f"{name}_bucket{self.labelText({'le': bound / 1e6})} {min(seen, count)}")
+                lines.append(f"{name}_bucket{self.labelText({'le': '+Inf'})} {count}")
+                lines.append(f"{name}_sum{plain} {metric.total / 1e6}")
+                lines.append(f"{name}_count{plain} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsEndpoint:
+    """ Serves a Registry at http://host:port/metrics from a daemon thread. """
+
+    def __init__(self, registry, host="localhost", port=METRICS_PORT):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # scrapes would flood the server's log
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def formatMicros(value):
+    if value >= 1000000:
+        return f"{value / 1e6:.2f}s"
+    if value >= 1000:
+        return f"{value / 1e3:.1f}ms"
+    return f"{value}us"
@@ -0,0 +1,283 @@
+"""
+  Parallel search for the engine in engine.py, using every core at the same time budget.
+  It follows the Lazy SMP scheme: each worker process runs the ordinary iterative deepening search on the same position,
+  and they all read and write one transposition table in shared memory, so a worker picks up the results of
+  every other worker's searches and they spread over different parts of the tree instead of repeating each other.
+  Half the workers search one ply deeper than the deepest iteration finished so far, which adds more variety.
+  The move played comes from the deepest iteration any worker finished.
+
+  Table entries are written without locks. Each slot holds the entry's data and the key xor'ed with the data,
+  so an entry torn by two workers writing at once just doesn't match its key and reads as a miss.
+  Run "python parallelsearch.py --workers 8 --depth 7" to compare the time to reach a depth with one worker
+  and with 8, and to see nodes/second per worker.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from bitboard import *
+from engine import Engine, TIME_LIMIT, MAX_DEPTH, MATE_BOUND, INFINITY
+
+TABLE_BITS = 20  # 2 ** 20 buckets of two 16 byte slots, 32MB shared by all workers
+
+# words at the start of the shared memory, before the table
+GENERATION, STOP, COMPLETED_DEPTH = 0, 1, 2
+HEADER_WORDS = 4
+
+# a table entry's data word: score (offset to be positive), bound, depth, best move, generation
+SCORE_BITS, BOUND_SHIFT, DEPTH_SHIFT, MOVE_SHIFT, GENERATION_SHIFT = 18, 18, 20, 28, 44
+SCORE_MASK = (1 << SCORE_BITS) - 1
+
+
+class SharedTable:
+    """
+        A transposition table in shared memory with the same probe(), store() and newSearch() as transposition.py,
+        for values of the form (score, bound, move) that engine.py stores.
+        Like TranspositionTable, a bucket has a depth preferred slot and an always replaced slot.
+    """
+
+    def __init__(self, bits=TABLE_BITS, name=None):
+        """
+        Args:
+            bits (int, optional): The table holds 2 ** bits buckets of two entries each. Defaults to TABLE_BITS.
+            name (str, optional): Attaches to the shared memory another process created. Creates new memory if not given.
+        """
+        size = (HEADER_WORDS + (2 << bits) * 2) * 8
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.words = self.memory.buf.cast("Q")
+        self.mask = (1 << bits) - 1
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def header(self, index):
+        return self.words[index]
+
+    def setHeader(self, index, value):
+        self.words[index] = value
+
+    def age(self):
+        # called by the process starting a search, workers read the new generation in newSearch()
+        self.words[GENERATION] = (self.words[GENERATION] + 1) & 0xFF
+
+    def newSearch(self):
+        self.generation = self.words[GENERATION]
+
+    def probe(self, key, depth=None):
+        """ Looks up a position.
+
+        Args:
+            key (int): The position's Zobrist hash.
+            depth (int, optional): If given, only an entry stored with this exact depth counts as a hit.
+
+        Returns:
+            tuple | None: (depth, (score, bound, move)) for the stored entry, or None if the position isn't in the table.
+        """
+        self.probes += 1
+        words = self.words
+        index = HEADER_WORDS + ((key & self.mask) << 2)
+        for slot in (index, index + 2):
+            data = words[slot + 1]
+            if words[slot] ^ data == key and data:
+                entryDepth = (data >> DEPTH_SHIFT) & 0xFF
+                if depth is None or entryDepth == depth:
+                    self.hits += 1
+                    return entryDepth, ((data & SCORE_MASK) - INFINITY, (data >> BOUND_SHIFT) & 3, (data >> MOVE_SHIFT) & 0xFFFF)
+        return None
+
+    def store(self, key, depth, value):
+        """ Saves a search result, replacing an older entry if the bucket is full.
+
+        Args:
+            key (int): The position's Zobrist hash.
+            depth (int): The search depth, deeper entries are kept longer.
+            value (tuple): (score, bound, move).
+        """
+        score, bound, move = value
+        words = self.words
+        index = HEADER_WORDS + ((key & self.mask) << 2)
+        first = words[index + 1]
+        if not first or words[index] ^ first == key or depth >= (first >> DEPTH_SHIFT) & 0xFF \
+                or first >> GENERATION_SHIFT != self.generation:
+            slot = index
+        else:
+            slot = index + 2
+        data = (score + INFINITY) | bound << BOUND_SHIFT | depth << DEPTH_SHIFT | move << MOVE_SHIFT \
+            | self.generation << GENERATION_SHIFT
+        words[slot] = key ^ data
+        words[slot + 1] = data
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def close(self):
+        self.words.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class WorkerEngine(Engine):
+    """ The engine each worker process runs, which stops and skips depths based on what the other workers did. """
+
+    def __init__(self, table, index):
+        super().__init__(table=table)
+        self.index = index
+
+    def timeUp(self):
+        return self.table.header(STOP) or super().timeUp()
+
+    def nextDepth(self, depth):
+        # skips past iterations another worker has already finished, and odd workers search one ply further ahead
+        return max(depth + 1, self.table.header(COMPLETED_DEPTH) + 1 + (self.index & 1))
+
+
+worker = None
+
+
+def startWorker(name, bits):
+    global worker
+    worker = WorkerEngine(SharedTable(bits, name), 0)
+
+
+def ready(_):
+    return os.getpid()
+
+
+def searchTask(index, position, timeLimit, maxDepth):
+    """ Runs in a worker process and searches one position until the time runs out or another worker finishes.
+
+    Returns:
+        tuple: (pid, move, info) with the engine's statistics for the search.
+    """
+    table = worker.table
+    worker.index = index
+
+    def finished(info):
+        if info["depth"] > table.header(COMPLETED_DEPTH):
+            table.setHeader(COMPLETED_DEPTH, info["depth"])
+        # a forced mate or the deepest iteration was found, the other workers can stop
+        if abs(info["score"]) >= MATE_BOUND or info["depth"] >= maxDepth:
+            table.setHeader(STOP, 1)
+
+    move = worker.search(position, timeLimit, maxDepth, finished)
+    return os.getpid(), move, worker.info
+
+
+class ParallelEngine:
+    """
+        Has the same search() as engine.Engine, run on a pool of worker processes.
+        The processes are started once and kept, so their killer and history tables carry over between moves
+        like a single Engine's do. Statistics for the last search, including each worker's, are in self.info.
+    """
+
+    def __init__(self, workers=None, tableBits=TABLE_BITS):
+        """
+        Args:
+            workers (int, optional): Worker processes. Defaults to the number of CPUs.
+            tableBits (int, optional): The shared table holds 2 ** tableBits buckets. Defaults to TABLE_BITS.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.table = SharedTable(tableBits)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=startWorker,
+                                            initargs=(self.table.name, tableBits))
+        # starts every process now, so the first move's time isn't spent forking and attaching to the table
+        list(self.executor.map(ready, range(self.workers)))
+        self.info = {}
+
+    def stop(self):
+        self.table.setHeader(STOP, 1)
+
+    def search(self, position, timeLimit=TIME_LIMIT, maxDepth=MAX_DEPTH, report=None):
+        """ Finds a move with every worker searching at once.
+
+        Args:
+            position (Position): The position to search. It's left unchanged.
+            timeLimit (float, optional): Seconds to search for. Defaults to TIME_LIMIT.
+            maxDepth (int, optional): The deepest iteration to run. Defaults to MAX_DEPTH.
+            report (callable, optional): Called with self.info when the search is over.
+
+        Returns:
+            int | None: The best move found, or None if the side to move has no legal moves.
+        """
+        if not position.legalMoves():
+            return None
+        start = time.perf_counter()
+        self.table.age()
+        self.table.setHeader(STOP, 0)
+        self.table.setHeader(COMPLETED_DEPTH, 0)
+        futures = [self.executor.submit(searchTask, index, position, timeLimit, maxDepth) for index in range(self.workers)]
+        results = [future.result() for future in futures]
+        seconds = time.perf_counter() - start
+
+        # the deepest finished iteration wins, ties go to the lower numbered worker, whose depths weren't skipped ahead
+        best = max(range(len(results)), key=lambda index: (results[index][2].get("depth", 0), -index))
+        pid, move, info = results[best]
+        nodes = sum(result[2]["nodes"] for result in results)
+        self.info = {
+            "depth": info.get("depth", 0),
+            "score": info.get("score", -INFINITY),
+            "move": move,
+            "nodes": nodes,
+            "seconds": seconds,
+            "nps": int(nodes / seconds) if seconds else 0,
+            "workers": {pid: {"depth": info.get("depth", 0), "nodes": info["nodes"], "nps": info["nps"]}
+                        for pid, _, info in results},
+        }
+        if report:
+            report(self.info)
+        return move
+
+    def close(self):
+        self.stop()
+        self.executor.shutdown()
+        self.table.close()
+
+
+def createEngine(workers=None):
+    """ A ParallelEngine with the given number of workers, or a plain Engine if that's one, which avoids the process overhead.
+
+    Args:
+        workers (int, optional): Worker processes, 0 or None for one per CPU.
+    """
+    workers = workers or os.cpu_count() or 1
+    return ParallelEngine(workers) if workers > 1 else Engine()
+
+
+def timeToDepth(engine, position, depth):
+    # a fixed depth with no time limit, so one worker and many can be compared by how long they take to get there
+    engine.search(position, INFINITY, depth)
+    return engine.info
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare the parallel search's time to depth with a single worker's.")
+    parser.add_argument("--fen", help="position to search, defaults to the starting position")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, 0 for one per CPU")
+    parser.add_argument("--depth", type=int, default=7, help="depth to search to")
+    args = parser.parse_args()
+    position = Position.fromFen(args.fen) if args.fen else Position.initial()
+
+    results = {}
+    for workers in sorted({1, args.workers or os.cpu_count() or 1}):
+        engine = ParallelEngine(workers)
+        try:
+            info = timeToDepth(engine, position, args.depth)
+        finally:
+            engine.close()
+        results[workers] = info
+        print(f"{workers} workers: depth {info['depth']} in {info['seconds']:.2f}s, {info['nodes']} nodes, {info['nps']} nodes/s")
+        for pid, stats in sorted(info["workers"].items()):
+            print(f"  worker {pid}: depth {stats['depth']}, {stats['nodes']} nodes, {stats['nps']} nodes/s")
+    if len(results) > 1:
+        single, parallel = results[1], results[max(results)]
+        print(f"speedup {single['seconds'] / parallel['seconds']:.2f}x with {max(results)} workers, "
+              f"{parallel['nps'] / single['nps']:.2f}x the nodes/second")
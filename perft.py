@@ -0,0 +1,232 @@
+"""
+  Perft driver for the move generators. Perft counts the leaf nodes of the legal move tree to a fixed depth,
+  which is compared against published counts to catch move generation bugs.
+  Each backend wraps one move generator so the same positions can be run against all of them.
+"""
+
+from bitboard import *
+from transposition import TranspositionTable
+import time
+
+# (name, FEN, published node counts for depth 1, 2, 3, ...)
+POSITIONS = [
+    ("start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+
+class BitboardBackend:
+    """ Runs perft on the bitboard generator in bitboard.py. """
+
+    name = "bitboard"
+
+    def __init__(self, fen):
+        self.position = Position.fromFen(fen)
+
+    def legalMoves(self):
+        return self.position.legalMoves()
+
+    def inCheck(self):
+        return self.position.checkers() != 0
+
+    def hasLegalMove(self):
+        return self.position.hasLegalMove()
+
+    def perft(self, depth):
+        position = self.position
+        moves = position.legalMoves()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            position.makeMove(move)
+            nodes += self.perft(depth - 1)
+            position.unmakeMove()
+        return nodes
+
+    def divide(self, depth):
+        counts = {}
+        for move in self.position.legalMoves():
+            self.position.makeMove(move)
+            counts[move] = self.perft(depth - 1) if depth > 1 else 1
+            self.position.unmakeMove()
+        return counts
+
+
+class HashedBitboardBackend(BitboardBackend):
+    """ Bitboard perft that caches subtree counts in a transposition table, so transpositions are only counted once. """
+
+    name = "bitboard-tt"
+
+    def __init__(self, fen, bits=18):
+        super().__init__(fen)
+        self.table = TranspositionTable(bits)
+
+    def perft(self, depth):
+        position = self.position
+        if depth == 1:
+            return len(position.legalMoves())
+        # the depth is mixed into the key so counts for different depths of one position don't overwrite each other
+        key = position.hash ^ ((depth * 0x9E3779B97F4A7C15) & FULL)
+        entry = self.table.probe(key, depth)
+        if entry:
+            return entry[1]
+        nodes = 0
+        for move in position.legalMoves():
+            position.makeMove(move)
+            nodes += self.perft(depth - 1)
+            position.unmakeMove()
+        self.table.store(key, depth, nodes)
+        return nodes
+
+
+class LegacyBackend:
+    """
+        Runs perft on Pieces.findMoves() from pieces.py, the generator the game used before bitboard.py.
+        Moves are applied to the same 2D list of pieces that board.py used, following the old Board.handleMove rules.
+        findMoves only returns target squares, so a promotion counts as one node (always a Queen).
+        It also allows castling through check and misses en passant discovered checks,
+        so the counts drift from the published ones once those come up.
+    """
+
+    name = "legacy"
+
+    def __init__(self, fen):
+        from pieces import Pawn, Knight, Bishop, Rook, Queen, King
+        self.pieceTypes = [Pawn, Knight, Bishop, Rook, Queen, King]
+        position = Position.fromFen(fen)
+        self.board = [[0] * 8 for _ in range(8)]
+        for sq in range(64):
+            piece = position.pieceAt(sq)
+            if piece:
+                color, pieceType = piece
+                self.board[sq // 8][sq % 8] = self.pieceTypes[pieceType](color)
+
+        # King and Rook keep castling rights as unmoved flags
+        for right, kingFrom, _, rookFrom, _, _, _ in CASTLING_MOVES:
+            for sq in (kingFrom, rookFrom):
+                piece = self.board[sq // 8][sq % 8]
+                if piece and hasattr(piece, "unmoved"):
+                    piece.unmoved = False
+        for right, kingFrom, _, rookFrom, _, _, _ in CASTLING_MOVES:
+            if position.castling & right:
+                self.board[kingFrom // 8][kingFrom % 8].unmoved = True
+                self.board[rookFrom // 8][rookFrom % 8].unmoved = True
+
+        # en passant comes from the last move being a double pawn push
+        self.lastMove = []
+        if position.epSquare >= 0:
+            row, col = coords(position.epSquare)
+            step = 1 if position.side == WHITE else -1
+            self.lastMove = [(row - step, col), (row + step, col)]
+        self.side = position.side
+
+    def legalMoves(self):
+        moves = []
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece and piece.user() == self.side:
+                    for newRow, newCol in piece.findMoves(self.board, row, col, self.lastMove):
+                        moves.append((row, col, newRow, newCol))
+        return moves
+
+    def inCheck(self):
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece and piece.user() == self.side and piece.name == "king":
+                    return piece.checksKing(self.board, row, col, self.lastMove)
+        return False
+
+    def hasLegalMove(self):
+        return len(self.legalMoves()) > 0
+
+    def makeMove(self, move):
+        # applies a move like Board.handleMove did and returns what's needed to take it back
+        row, col, newRow, newCol = move
+        board = self.board
+        piece = board[row][col]
+        changed = [(row, col, piece), (newRow, newCol, board[newRow][newCol])]
+        if piece.name == "pawn" and col != newCol and board[newRow][newCol] == 0:
+            changed.append((row, newCol, board[row][newCol]))
+            board[row][newCol] = 0
+        board[newRow][newCol] = piece
+        board[row][col] = 0
+        if piece.name == "king" and abs(newCol - col) == 2:
+            rookCol, rookNewCol = (0, 3) if newCol < col else (7, 5)
+            changed.extend([(row, rookCol, board[row][rookCol]), (row, rookNewCol, 0)])
+            board[row][rookNewCol] = board[row][rookCol]
+            board[row][rookCol] = 0
+        elif piece.name == "pawn" and newRow in (0, 7):
+            board[newRow][newCol] = self.pieceTypes[QUEEN](piece.user())
+        unmoved = getattr(piece, "unmoved", False)
+        if unmoved:
+            piece.moved()
+        undo = (changed, piece, unmoved, self.lastMove)
+        self.lastMove = [(row, col), (newRow, newCol)]
+        self.side ^= 1
+        return undo
+
+    def unmakeMove(self, undo):
+        changed, piece, unmoved, lastMove = undo
+        for row, col, previous in reversed(changed):
+            self.board[row][col] = previous
+        if unmoved:
+            piece.unmoved = True
+        self.lastMove = lastMove
+        self.side ^= 1
+
+    def perft(self, depth):
+        moves = self.legalMoves()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            undo = self.makeMove(move)
+            nodes += self.perft(depth - 1)
+            self.unmakeMove(undo)
+        return nodes
+
+
+BACKENDS = {backend.name: backend for backend in (BitboardBackend, HashedBitboardBackend, LegacyBackend)}
+
+
+def runPerft(backendName, fen, depth):
+    """ Times a perft run.
+
+    Args:
+        backendName (str): A key of BACKENDS.
+        fen (str): The starting position.
+        depth (int): The number of plies to search.
+
+    Returns:
+        tuple[int, float]: The node count and the seconds it took.
+    """
+    backend = BACKENDS[backendName](fen)
+    start = time.perf_counter()
+    nodes = backend.perft(depth)
+    return nodes, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    # prints the node count below each root move, which helps narrow down a mismatch: python perft.py depth [fen]
+    import sys
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    fen = " ".join(sys.argv[2:]) if len(sys.argv) > 2 else POSITIONS[0][1]
+    counts = BitboardBackend(fen).divide(depth)
+    for move, count in counts.items():
+        (row, col), (newRow, newCol) = coords(moveFrom(move)), coords(moveTo(move))
+        promotion = "nbrq"[moveFlag(move) - PROMOTE_KNIGHT] if moveFlag(move) >= PROMOTE_KNIGHT else ""
+        print(f"{chr(97 + col)}{8 - row}{chr(97 + newCol)}{8 - newRow}{promotion} {count}")
+    print(f"Nodes: {sum(counts.values())}")
@@ -0,0 +1,306 @@
+"""
+  PGN export for games stored in the server's journal (see journal.py), and PGN reading for tools like analyze.py.
+  Games are converted one at a time and written straight to the output, so a journal of any size
+  is exported in constant memory. Run "python pgn.py JOURNAL_DIR > games.pgn".
+"""
+
+import re
+import time
+from bitboard import *
+from journal import readJournal, readSegment, UNFINISHED
+
+RESULTS = ["1-0", "0-1", "1/2-1/2", "*"]
+TERMINATIONS = ["normal", "abandoned"]
+PIECE_LETTERS = "PNBRQK"
+PROMOTION_LETTERS = {PROMOTE_KNIGHT: "N", PROMOTE_BISHOP: "B", PROMOTE_ROOK: "R", PROMOTE_QUEEN: "Q"}
+
+LINE_LENGTH = 79
+
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$")
+TAG_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+RESULT_TOKENS = set(RESULTS)
+
+
+def san(position, move, legalMoves=None):
+    """ Writes a legal move in standard algebraic notation, e.g. "Nbd7", "exd6", "e8=Q+", or "O-O-O#".
+
+    Args:
+        position (Position): The position before the move. It's left unchanged.
+        move (int): The encoded move.
+        legalMoves (list[int], optional): The position's legal moves, if the caller already has them.
+
+    Returns:
+        str: The move in SAN.
+    """
+    frm, to, flag = moveFrom(move), moveTo(move), moveFlag(move)
+    pieceType = position.squares[frm] % 6
+    if flag == CASTLE:
+        text = "O-O" if to % 8 == 6 else "O-O-O"
+    else:
+        capture = position.squares[to] != EMPTY or flag == EN_PASSANT
+        if pieceType == PAWN:
+            text = (squareName(frm)[0] + "x" if capture else "") + squareName(to)
+            if flag >= PROMOTE_KNIGHT:
+                text += "=" + PROMOTION_LETTERS[flag]
+        else:
+            # other pieces of the same type that can also reach the square decide how much of the origin is written
+            if legalMoves is None:
+                legalMoves = position.legalMoves()
+            rivals = [moveFrom(other) for other in legalMoves if moveTo(other) == to and moveFrom(other) != frm
+                      and position.squares[moveFrom(other)] == position.squares[frm]]
+            origin = ""
+            if rivals:
+                name = squareName(frm)
+                if all(rival % 8 != frm % 8 for rival in rivals):
+                    origin = name[0]
+                elif all(rival // 8 != frm // 8 for rival in rivals):
+                    origin = name[1]
+                else:
+                    origin = name
+            text = PIECE_LETTERS[pieceType] + origin + ("x" if capture else "") + squareName(to)
+    position.makeMove(move)
+    if position.inCheck():
+        text += "#" if not position.hasLegalMove() else "+"
+    position.unmakeMove()
+    return text
+
+
+def moveText(moves, position=None):
+    """ Turns a list of moves into numbered SAN, e.g. ["1.", "e4", "e5", "2.", "Nf3"].
+
+    Args:
+        moves (list[int]): Encoded moves played from the position.
+        position (Position, optional): Where the moves start. Defaults to the initial position. It's left unchanged.
+
+    Returns:
+        list[str]: The tokens of the PGN movetext, without the result.
+    """
+    position = position.copy() if position else Position.initial()
+    tokens = []
+    for index, move in enumerate(moves):
+        if position.side == WHITE:
+            tokens.append(f"{position.fullmoveNumber}.")
+        elif index == 0:
+            tokens.append(f"{position.fullmoveNumber}...")
+        tokens.append(san(position, move))
+        position.makeMove(move)
+    return tokens
+
+
+def wrap(tokens, lineLength=LINE_LENGTH):
+    lines, line = [], ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > lineLength:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    if line:
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def formatGame(record):
+    """ Formats one journal GameRecord as a PGN game, tags first and then the movetext.
+
+    Returns:
+        str: The game, ending with a blank line.
+    """
+    result = RESULTS[record.result]
+    tags = [
+        ("Event", "Online game"),
+        ("Site", "?"),
+        ("Date", time.strftime("%Y.%m.%d", time.gmtime(record.started))),
+        ("Round", "-"),
+        ("White", "?"),
+        ("Black", "?"),
+        ("Result", result),
+        ("GameId", str(record.gameId)),
+        ("Termination", "unterminated" if record.result == UNFINISHED else TERMINATIONS[record.termination]),
+    ]
+    header = "\n".join(f'[{name} "{value}"]' for name, value in tags)
+    return f"{header}\n\n{wrap(moveText(record.moves) + [result])}\n\n"
+
+
+def exportGames(records, out):
+    """ Writes games to a text stream as they're read, without holding more than one in memory.
+
+    Args:
+        records (iterable[GameRecord]): E.g. journal.readJournal(directory).
+        out (io.TextIOBase): Where the PGN goes.
+
+    Returns:
+        int: The number of games written.
+    """
+    count = 0
+    for record in records:
+        out.write(formatGame(record))
+        count += 1
+    return count
+
+
+def parseSan(position, text):
+    """ Finds the legal move that a SAN string describes. Check marks, annotations like "!?" and "0-0" castling are accepted.
+        Only the moves the text could mean are built and each is checked with Position.isLegalMove(),
+        which is much cheaper than generating every legal move when replaying long games.
+
+    Args:
+        position (Position): The position the move is played in.
+        text (str): The move in SAN, e.g. "Nbd7" or "exd8=Q+".
+
+    Returns:
+        int: The encoded move.
+
+    Raises:
+        ValueError: If the text isn't SAN or doesn't match exactly one legal move.
+    """
+    side = position.side
+    stripped = text.rstrip("+#!?").replace("0", "O")
+    if stripped in ("O-O", "O-O-O"):
+        kingFrom = 60 if side == WHITE else 4
+        move = encodeMove(kingFrom, kingFrom + (2 if stripped == "O-O" else -2), CASTLE)
+        if position.isLegalMove(move):
+            return move
+        raise ValueError(f"Illegal move: {text}")
+    match = SAN_PATTERN.match(stripped)
+    if not match:
+        raise ValueError(f"Not a SAN move: {text}")
+    letter, fromCol, fromRow, capture, target, promotion = match.groups()
+    to = parseSquare(target)
+    forward = -8 if side == WHITE else 8  # white moves towards row 0
+
+    if letter:
+        pieceType = PIECE_LETTERS.index(letter)
+        occupied = position.occupied[0] | position.occupied[1]
+        if pieceType == KNIGHT:
+            reach = KNIGHT_ATTACKS[to]
+        elif pieceType == BISHOP:
+            reach = bishopAttacks(to, occupied)
+        elif pieceType == ROOK:
+            reach = rookAttacks(to, occupied)
+        elif pieceType == QUEEN:
+            reach = queenAttacks(to, occupied)
+        else:
+            reach = KING_ATTACKS[to]
+        candidates = [encodeMove(frm, to) for frm in squares(reach & position.pieces[side * 6 + pieceType])]
+    else:
+        if capture or fromCol:
+            origins = [to - forward - 1, to - forward + 1]
+        else:
+            origins = [to - forward]
+            if 0 <= to - forward < 64 and position.squares[to - forward] == EMPTY and to // 8 == (4 if side == WHITE else 3):
+                origins.append(to - 2 * forward)
+        candidates = []
+        for frm in origins:
+            if not 0 <= frm < 64 or abs(frm % 8 - to % 8) > 1 or position.squares[frm] != side * 6 + PAWN:
+                continue
+            if abs(frm - to) == 16:
+                flag = DOUBLE_PUSH
+            elif to == position.epSquare and frm % 8 != to % 8:
+                flag = EN_PASSANT
+            elif to // 8 in (0, 7):
+                flag = PROMOTE_KNIGHT + "NBRQ".index(promotion or "Q")
+            else:
+                flag = QUIET
+            candidates.append(encodeMove(frm, to, flag))
+
+    found = None
+    for move in candidates:
+        frm = moveFrom(move)
+        if fromCol and frm % 8 != ord(fromCol) - ord("a"):
+            continue
+        if fromRow and frm // 8 != 8 - int(fromRow):
+            continue
+        if not position.isLegalMove(move):
+            continue
+        if found is not None:
+            raise ValueError(f"Ambiguous move: {text}")
+        found = move
+    if found is None or (promotion and moveFlag(found) < PROMOTE_KNIGHT):
+        raise ValueError(f"Illegal move: {text}")
+    return found
+
+
+def splitGames(lines):
+    """ Splits PGN text into one string per game without parsing the moves, so splitting stays cheap.
+        A new game starts at a tag line that comes after some movetext.
+
+    Args:
+        lines (iterable[str]): Lines of PGN, e.g. an open file.
+
+    Yields:
+        str: The text of each game.
+    """
+    game = []
+    seenMoves = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and seenMoves:
+            yield "".join(game)
+            game = []
+            seenMoves = False
+        if stripped and not stripped.startswith("[") and not stripped.startswith("%"):
+            seenMoves = True
+        game.append(line)
+    if any(line.strip() for line in game):
+        yield "".join(game)
+
+
+def movetextTokens(text):
+    # drops comments, variations, NAGs, and move numbers, leaving the moves and the result
+    text = re.sub(r"\{[^}]*\}", " ", text)
+    tokens = []
+    depth = 0
+    for line in text.splitlines():
+        if line.startswith("%"):
+            continue
+        for token in line.split(";", 1)[0].replace("(", " ( ").replace(")", " ) ").split():
+            if token == "(":
+                depth += 1
+            elif token == ")":
+                depth = max(depth - 1, 0)
+            elif depth == 0 and not token.startswith("$") and token != "e.p.":
+                token = token.split(".")[-1]  # "12.e4" and "12..." become "e4" and ""
+                if token:
+                    tokens.append(token)
+    return tokens
+
+
+def parseGame(text):
+    """ Reads one game's text from splitGames().
+
+    Returns:
+        tuple: (tags, moves, result), the tag pairs as a dict, the SAN moves in order, and the result token or None.
+    """
+    tags = {}
+    movetext = []
+    for line in text.splitlines():
+        match = TAG_PATTERN.match(line.strip())
+        if match:
+            tags[match.group(1)] = match.group(2)
+        else:
+            movetext.append(line)
+    moves = movetextTokens("\n".join(movetext))
+    result = None
+    if moves and moves[-1] in RESULT_TOKENS:
+        result = moves.pop()
+    return tags, moves, result
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+    parser = argparse.ArgumentParser(description="Export games from the server's journal as PGN.")
+    parser.add_argument("paths", nargs="+",
+                        help="journal directories, including a --workers server's with worker-N subdirectories, "
+                             "or single segment files")
+    parser.add_argument("--output", help="file to write, defaults to standard output")
+    args = parser.parse_args()
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for path in args.paths:
+            exportGames(readJournal(path) if os.path.isdir(path) else readSegment(path), out)
+    finally:
+        if args.output:
+            out.close()
@@ -1,12 +1,14 @@
 import os
-import pygame
 
 
 class Pieces:
     """ A superclass for any chess piece. """
 
+    # images are shared by every piece of the same color and name, and only loaded once something is drawn
+    images = {}
+
     def __init__(self, player, name):
-        """Initializes a chess piece and loads/resizes the image corresponding to it.
+        """Initializes a chess piece. The image corresponding to it is loaded/resized the first time png() is called.
 
         Args:
             player (int): The player number for the piece (0 for white, 1 for black)
@@ -15,11 +17,14 @@ class Pieces:
         self.player = player
         self.color = "white" if player == 0 else "black"
         self.name = name
-        self.image = pygame.transform.scale(pygame.image.load(
-            os.path.join(f'images/{self.color}_{self.name}.png')), (75, 75))
 
     def png(self):
-        return self.image
+        key = (self.color, self.name)
+        if key not in Pieces.images:
+            import pygame
+            Pieces.images[key] = pygame.transform.scale(pygame.image.load(
+                os.path.join(f'images/{self.color}_{self.name}.png')), (75, 75))
+        return Pieces.images[key]
 
     def user(self):
         return self.player
@@ -0,0 +1,125 @@
+"""
+  Framed binary messages sent between client.py and server.py.
+  Every message starts with a 3 byte header: a 1 byte message type and a 2 byte payload length in network byte order.
+  Moves are sent as the 2 byte encoding from bitboard.py (from square, to square, and a flag for
+  double pushes, castling, en passant and promotions), so a move is 5 bytes on the wire.
+  Because every frame carries its length, messages that TCP merges or splits are put back together by the reader.
+  Spectators connect to the server's spectator port and send WATCH. They're sent a SNAPSHOT of the game's position,
+  then the same MOVE frames the players exchange, and a GAME_OVER with the result.
+"""
+
+import struct
+
+HEADER = struct.Struct("!BH")
+MOVE_PAYLOAD = struct.Struct("!H")
+SEEK_PAYLOAD = struct.Struct("!HB")
+WATCH_PAYLOAD = struct.Struct("!I")
+SNAPSHOT_HEADER = struct.Struct("!IH")  # game id and last move, followed by the game's Position.pack()
+
+# message types, REJECTED is sent back by the server with a move it refused to relay
+# and SEEK is sent by a client before it's matched to choose its rating and time control
+CONNECTED, MATCHED, MOVE, GAME_OVER, REJECTED, SEEK, WATCH, SNAPSHOT = 1, 2, 3, 4, 5, 6, 7, 8
+
+# game over reasons, from the point of view of the player receiving the message
+WIN, DISCONNECT, DRAW = 0, 1, 2
+
+# game over reasons sent to spectators, DRAW is shared with the players
+WHITE_WON, BLACK_WON, UNKNOWN_GAME = 3, 4, 5
+
+
+def encode(kind, payload=b""):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def encodeConnected(accepted):
+    # 1 if the server accepted the connection, 0 if it's full
+    return encode(CONNECTED, bytes([accepted]))
+
+
+def encodeMatched(player):
+    return encode(MATCHED, bytes([player]))
+
+
+def encodeMove(move):
+    return encode(MOVE, MOVE_PAYLOAD.pack(move))
+
+
+def encodeRejected(move):
+    return encode(REJECTED, MOVE_PAYLOAD.pack(move))
+
+
+def encodeSeek(rating, timeControl):
+    return encode(SEEK, SEEK_PAYLOAD.pack(rating, timeControl))
+
+
+def encodeGameOver(reason):
+    return encode(GAME_OVER, bytes([reason]))
+
+
+def encodeWatch(gameId=0):
+    # 0 watches the game with the most spectators
+    return encode(WATCH, WATCH_PAYLOAD.pack(gameId))
+
+
+def encodeSnapshot(gameId, lastMove, packed):
+    return encode(SNAPSHOT, SNAPSHOT_HEADER.pack(gameId, lastMove) + packed)
+
+
+def frameBoundary(buffer):
+    """ Finds where the complete frames at the start of a buffer end, without looking at the payloads.
+
+    Args:
+        buffer (bytes | bytearray): Received data, possibly ending in a partial frame.
+
+    Returns:
+        int: The number of bytes taken up by complete frames.
+    """
+    offset = 0
+    size = len(buffer)
+    while offset + HEADER.size <= size:
+        end = offset + HEADER.size + HEADER.unpack_from(buffer, offset)[1]
+        if end > size:
+            break
+        offset = end
+    return offset
+
+
+def decode(kind, payload):
+    """ Turns a frame's payload into a value.
+
+    Returns:
+        tuple: (kind, value) where value is the encoded move for MOVE, a number for
+            CONNECTED, MATCHED and GAME_OVER, (rating, timeControl) for SEEK, the game id for WATCH,
+            (gameId, lastMove, packed position) for SNAPSHOT, and the raw payload for anything else.
+    """
+    if kind in (MOVE, REJECTED):
+        return kind, MOVE_PAYLOAD.unpack(payload)[0]
+    if kind == SEEK:
+        return kind, SEEK_PAYLOAD.unpack(payload)
+    if kind == WATCH:
+        return kind, WATCH_PAYLOAD.unpack(payload)[0]
+    if kind == SNAPSHOT:
+        return kind, SNAPSHOT_HEADER.unpack_from(payload) + (bytes(payload[SNAPSHOT_HEADER.size:]),)
+    if kind in (CONNECTED, MATCHED, GAME_OVER):
+        return kind, payload[0]
+    return kind, bytes(payload)
+
+
+def nextMessage(buffer):
+    """ Removes the first complete message from a receive buffer.
+
+    Args:
+        buffer (bytearray): Received data. Consumed bytes are deleted from it.
+
+    Returns:
+        tuple | None: (kind, value) from decode(), or None if no complete message has arrived yet.
+    """
+    if len(buffer) < HEADER.size:
+        return None
+    kind, length = HEADER.unpack_from(buffer)
+    end = HEADER.size + length
+    if len(buffer) < end:
+        return None
+    message = decode(kind, buffer[HEADER.size:end])
+    del buffer[:end]
+    return message
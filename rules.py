@@ -0,0 +1,158 @@
+"""
+  Headless rules core for a game of chess. Nothing here imports pygame or loads images,
+  so the server and batch tools can replay and check games without a display.
+  Board in board.py keeps one Game and only draws the pieces it reports.
+"""
+
+from bitboard import *
+
+ONGOING, CHECKMATE, STALEMATE = 0, 1, 2
+
+
+class Game:
+    """
+        Tracks the position and last move of one game and applies moves given as board coordinates.
+        The legal moves for the side to move are generated once per position and cached under its Zobrist hash,
+        so highlighting, drop validation and game end checks during a ply all share one generation.
+    """
+
+    def __init__(self, position=None):
+        self.position = position if position else Position.initial()
+        self.lastMove = []
+        self.cacheKey = None
+        self.moves = []
+        self.movesBySquare = {}
+        self.targetsBySquare = {}
+
+    @classmethod
+    def fromFen(cls, fen):
+        """ Starts a game from a FEN string.
+
+        Returns:
+            Game: The game, with lastMove set to the double pawn push if the FEN has an en passant square.
+        """
+        game = cls(Position.fromFen(fen))
+        epSquare = game.position.epSquare
+        if epSquare >= 0:
+            row, col = coords(epSquare)
+            step = 1 if game.position.side == WHITE else -1  # the pushed pawn moved towards the side to move
+            game.lastMove = [(row - step, col), (row + step, col)]
+        return game
+
+    def toFen(self):
+        return self.position.toFen()
+
+    def sideToMove(self):
+        return self.position.side
+
+    def legalMoves(self):
+        """ Returns the legal moves for the side to move, generating them only if the position changed since the last call.
+
+        Returns:
+            list[int]: The encoded moves. The list is shared with the cache, so it shouldn't be modified.
+        """
+        key = self.position.hash
+        if key != self.cacheKey:
+            self.moves = self.position.legalMoves()
+            movesBySquare = {}
+            targetsBySquare = {}
+            for move in self.moves:
+                frm = moveFrom(move)
+                movesBySquare.setdefault(frm, []).append(move)
+                targets = targetsBySquare.setdefault(frm, [])
+                target = coords(moveTo(move))
+                if target not in targets:  # the four promotions share one target square
+                    targets.append(target)
+            self.movesBySquare = movesBySquare
+            self.targetsBySquare = targetsBySquare
+            self.cacheKey = key
+        return self.moves
+
+    def movesFrom(self, row, col):
+        """ Lists the squares the piece at (row, col) can legally move to.
+
+        Returns:
+            list[tuple]: A list of tuples representing the coordinates that the piece can move to.
+        """
+        self.legalMoves()
+        return self.targetsBySquare.get(square(row, col), [])
+
+    def findMove(self, row, col, newRow, newCol, promotion=QUEEN):
+        """ Looks up the legal move from (row, col) to (newRow, newCol).
+
+        Args:
+            promotion (int, optional): The piece type a pawn promotes to. Defaults to QUEEN, like the UI.
+
+        Returns:
+            int | None: The encoded move, or None if the move isn't legal.
+        """
+        self.legalMoves()
+        frm, to = square(row, col), square(newRow, newCol)
+        for move in self.movesBySquare.get(frm, []):
+            if moveTo(move) == to and (moveFlag(move) < PROMOTE_KNIGHT or moveFlag(move) == promotion - KNIGHT + PROMOTE_KNIGHT):
+                return move
+        return None
+
+    def play(self, move):
+        """ Applies a legal move and records it in the same format that is sent between clients.
+
+        Args:
+            move (int): An encoded move from findMove() or Position.legalMoves().
+
+        Returns:
+            list[tuple]: The start and end coordinates, followed by the captured pawn's square for en passant
+                or the rook's start and end coordinates for castling.
+        """
+        frm, to, flag = moveFrom(move), moveTo(move), moveFlag(move)
+        lastMove = [coords(frm), coords(to)]
+        if flag == EN_PASSANT:
+            lastMove.append(coords(to + 8 if self.position.side == WHITE else to - 8))
+        elif flag == CASTLE:
+            rookFrom, rookTo = CASTLING_ROOKS[to]
+            lastMove.extend([coords(rookFrom), coords(rookTo)])
+        self.position.makeMove(move)
+        self.lastMove = lastMove
+        return lastMove
+
+    def tryPlay(self, move):
+        """ Applies an encoded move, such as one received from the opponent, if it's legal.
+            Uses the move cache if it's already filled for this position, and otherwise validates just this move.
+
+        Returns:
+            list[tuple] | None: The move's coordinates like play() returns, or None if it wasn't legal and nothing changed.
+        """
+        if self.cacheKey == self.position.hash:
+            legal = move in self.moves
+        else:
+            legal = self.position.isLegalMove(move)
+        if not legal:
+            return None
+        return self.play(move)
+
+    def playCoords(self, moves):
+        """ Applies a move received as a list of coordinates, such as an opponent's lastMove.
+
+        Args:
+            moves (list[tuple]): A list with coordinates from a move. Only the first two are needed.
+
+        Returns:
+            int | None: The encoded move that was played, or None if it wasn't legal and nothing changed.
+        """
+        if len(moves) < 2:
+            return None
+        (row, col), (newRow, newCol) = moves[0], moves[1]
+        move = self.findMove(row, col, newRow, newCol)
+        if move is not None:
+            self.play(move)
+        return move
+
+    def result(self):
+        """ Tests if the game is over for the side to move.
+
+        Returns:
+            int: ONGOING, CHECKMATE if the side to move has lost, or STALEMATE.
+        """
+        hasMove = len(self.moves) > 0 if self.cacheKey == self.position.hash else self.position.hasLegalMove()
+        if hasMove:
+            return ONGOING
+        return CHECKMATE if self.position.checkers() else STALEMATE
@@ -1,62 +1,87 @@
+import os
+import signal
 import socket
+import struct
 from _thread import *
-import pickle
+import selectors
 import threading
+import time
+from collections import deque
+from protocol import *
+from rules import Game, CHECKMATE, STALEMATE
+from matchmaking import Matchmaker, TICK_INTERVAL
+from journal import Journal, WHITE_WINS, BLACK_WINS, DRAWN, UNFINISHED, NORMAL, ABANDONED
+from metrics import Registry, MetricsEndpoint, formatMicros, METRICS_PORT, SUMMARY_INTERVAL
 
 
 # When updating the HOST and PORT constants, also change client.py
 HOST = "localhost"
 PORT = 9593
 
+# connection limit for the event loop server, each connection also needs a file descriptor (see raiseFileLimit)
+MAX_CONNECTIONS = 20000
+
+# spectators connect here instead of PORT, so they're never queued for a game
+SPECTATOR_PORT = 9595
+SPECTATOR_BUFFER = 4096  # bytes a spectator can fall behind before it's skipped ahead to a snapshot
+SPECTATOR_TIMEOUT = 30.0  # seconds a skipped spectator has to take what it was sent before it's dropped
+FANOUT_BATCH = 512  # spectator sends per round of the event loop, so players' moves never wait behind a whole broadcast
+
+# what spectators are told when a game ends, by the journal's result
+SPECTATOR_RESULTS = {WHITE_WINS: WHITE_WON, BLACK_WINS: BLACK_WON, DRAWN: DRAW}
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.bind((HOST, PORT))
-server.listen(10)
-print("Server has been started. Waiting for connection.")
 
 """
     Games dictionary stores each client connection and opponent for current games.
-    Waiting list stores a client until someone else joins to play against them.
-    currentConnections stores the number of active connections and won't allow for more than 10 simultaneous games.
+    The waiting Matchmaker queues a client until someone else joins to play against them.
+    currentConnections stores the number of active connections, the thread per connection server refuses clients past 20.
     threadingLock prevents errors by only allowing one thread to access shared resources at a time.
+    These are only used by the thread per connection server (runThreaded, "--threaded").
+    The default event loop server (GameServer) has no fixed game limit: it holds up to MAX_CONNECTIONS connections
+    ("--max-connections"), fewer if the open file limit can't be raised that far (see raiseFileLimit), and refuses
+    clients past that. With "--workers" the limit is split evenly between the worker processes.
 """
 games = {}
-waiting = []
+waiting = Matchmaker()
 currentConnections = 0
 threadingLock = threading.Lock()
 
 
 def handleClient(connection):
     """
-        handleClient first sends 1 to the client connection, signaling a successful connection to the server.
-        Then, the connection is either added to waiting or is matched to an opponent in waiting. 
+        handleClient first sends a CONNECTED message to the client connection, signaling a successful connection to the server.
+        Then, the connection is either added to waiting or is matched to an opponent in waiting.
         Matched players are sent opposing numbers that tell main.py which player the user is and that the game has started.
-        While the player sends a last move, forward that data to its opponent, and if a user disconnects, notify their opponent.
+        While the player sends a last move, forward the complete frames to its opponent, and if a user disconnects, notify their opponent.
         Remove the user's presence from games/waiting, decrement current connections, and close their socket.
     """
     global games, waiting, currentConnections
-    connection.send(str(1).encode())
+    connection.send(encodeConnected(1))
 
     with threadingLock:
         currentConnections += 1
-        if not waiting:
-            waiting.append(connection)
-        else:
-            opponent = waiting.pop()
-            games[connection] = opponent
-            games[opponent] = connection
-            connection.send(pickle.dumps("1"))
-            opponent.send(pickle.dumps("0"))
+        waiting.enqueue(connection)
+        for opponent, player in waiting.tick():
+            games[player] = opponent
+            games[opponent] = player
+            player.send(encodeMatched(1))
+            opponent.send(encodeMatched(0))
 
+    buffer = bytearray()
     while True:
         try:
             data = connection.recv(4096)
             if data:
-                games[connection].send(data)
+                buffer += data
+                boundary = frameBoundary(buffer)
+                if boundary:
+                    if connection in games:  # anything sent before a match, like SEEK, isn't relayed
+                        games[connection].send(bytes(buffer[:boundary]))
+                    del buffer[:boundary]
             elif not data:
                 print("Player disconnected")
                 if connection in games and games[connection] in games:
-                    games[connection].send(pickle.dumps([(1, 1)]))
+                    games[connection].send(encodeGameOver(DISCONNECT))
                 break
         except Exception as e:
             print(f"Error receiving data: {e}")
@@ -64,25 +89,936 @@ def handleClient(connection):
 
     with threadingLock:
         currentConnections -= 1
-        if connection in waiting:
-            waiting.remove(connection)
+        waiting.cancel(connection)
         if connection in games:
             del games[connection]
 
     connection.close()
 
 
-"""
-    Continuously accepts new connections and starts a separate thread for each one until reaching 20 active connections.
-    Sends 0 to client socket if connection limit is reached. Closes server socket at the end.
-"""
-try:
-    while True:
-        connection, address = server.accept()
-        if currentConnections >= 20:
-            connection.send(str(0).encode())
-            connection.close()
-            continue
-        start_new_thread(handleClient, (connection,))
-finally:
-    server.close()
+def runThreaded(host=HOST, port=PORT):
+    """
+        Continuously accepts new connections and starts a separate thread for each one until reaching 20 active connections.
+        Sends a refused CONNECTED message to client socket if connection limit is reached. Closes server socket at the end.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind((host, port))
+    server.listen(10)
+    print("Server has been started. Waiting for connection.")
+    try:
+        while True:
+            connection, address = server.accept()
+            if currentConnections >= 20:
+                connection.send(encodeConnected(0))
+                connection.close()
+                continue
+            start_new_thread(handleClient, (connection,))
+    finally:
+        server.close()
+
+
+def raiseFileLimit(connections):
+    """ Raises the soft open file limit towards the hard limit so the event loop can hold the requested connections.
+
+    Returns:
+        int: The number of connections the file limit allows.
+    """
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return connections
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = connections + 64  # room for the listening socket and anything else the process has open
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError) as e:
+            print(f"Could not raise open file limit: {e}")
+    return connections if soft == resource.RLIM_INFINITY else min(connections, soft - 64)
+
+
+def openListener(host, port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(socket.SOMAXCONN)
+    return listener
+
+
+class Connection:
+    """ The state the event loop keeps for one client socket. """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.incoming = bytearray()
+        self.outgoing = bytearray()
+        self.opponent = None
+        self.match = None
+        self.player = None
+        self.closed = False
+        self.spectator = False  # connected to the spectator port
+        self.watching = None  # the Match a spectator is subscribed to
+        self.ply = 0  # how far into the watched game the spectator has been sent
+        self.staleSince = None  # when a slow spectator was last skipped ahead, it gets a snapshot once it catches up
+
+
+class Match:
+    """
+        The server's own copy of one game. Every move is checked against it before being relayed,
+        and it decides checkmate and stalemate instead of trusting the clients.
+    """
+
+    def __init__(self, gameId=0):
+        self.id = gameId
+        self.game = Game()
+        self.finished = False
+        self.started = time.time()
+        self.spectators = set()
+        self.snapshot = None  # the SNAPSHOT frame for snapshotPly, shared by every spectator who joins at that ply
+        self.snapshotPly = -1
+        self.resultFrame = None  # the GAME_OVER spectators are sent, once the game is over
+
+    def moves(self):
+        return [entry[0] for entry in self.game.position.history]
+
+
+class ServerMetrics:
+    """
+        What the event loop server measures about itself, see metrics.py. Everything is updated from the event loop's
+        thread without locks, so it's always on. The registry is served at http://localhost:port/metrics if a port
+        is given, and a summary of the last interval is printed every interval seconds.
+    """
+
+    def __init__(self, server, name="server", port=None, interval=SUMMARY_INTERVAL):
+        """
+        Args:
+            server (GameServer): The server being measured.
+            name (str, optional): Added to every sample as the worker label and to the summary lines.
+            port (int, optional): Port for the HTTP endpoint, none is started if it's not given.
+            interval (float, optional): Seconds between summary lines, 0 for none. Defaults to SUMMARY_INTERVAL.
+        """
+        self.name = name
+        registry = self.registry = Registry(labels={"worker": name})
+        self.accepted = registry.counter("connections_accepted_total", "Connections accepted.")
+        self.refused = registry.counter("connections_refused_total", "Connections refused at the connection limit.")
+        self.disconnects = registry.counter("disconnects_total", "Connections closed by the client, an error, or shutdown.")
+        self.handoffs = registry.counter("handoffs_total", "Unmatched connections handed to the coordinator.")
+        self.gamesStarted = registry.counter("games_started_total", "Games started.")
+        self.gamesFinished = registry.counter("games_finished_total", "Games ended by checkmate, stalemate, or a player leaving.")
+        self.movesRelayed = registry.counter("moves_relayed_total", "Legal moves relayed to the opponent.")
+        self.movesRejected = registry.counter("moves_rejected_total", "Moves rejected as illegal or out of turn.")
+        self.bytesReceived = registry.counter("received_bytes_total", "Bytes read from clients.")
+        self.bytesSent = registry.counter("sent_bytes_total", "Bytes written to clients.")
+        self.busy = registry.counter("event_loop_busy_seconds_total", "Time the event loop spent handling events instead of waiting in select.")
+        self.connectionsOpen = registry.gauge("connections_open", "Open client connections.", lambda: len(server.connections))
+        self.playersWaiting = registry.gauge("players_waiting", "Players in the matchmaking queue.", lambda: len(server.matchmaker))
+        self.gamesActive = registry.gauge("games_active", "Games being played.")
+        self.spectators = registry.gauge("spectators", "Connections on the spectator port.")
+        self.spectatorFrames = registry.counter("spectator_frames_total", "Moves and results broadcast to spectators.")
+        self.snapshots = registry.counter("snapshots_total", "Position snapshots sent to spectators.")
+        self.slowSpectators = registry.counter("slow_spectators_total", "Times a spectator fell behind and was skipped ahead.")
+        self.droppedSpectators = registry.counter("dropped_spectators_total", "Spectators dropped for not catching up.")
+        self.acceptLatency = registry.histogram("accept_seconds", "Time to register a new connection and queue it for a game.")
+        self.validationLatency = registry.histogram("validation_seconds", "Time to check a move against the server's copy of the game.")
+        self.relayLatency = registry.histogram("relay_seconds", "Time from reading a move to sending it to the opponent.")
+        self.matchWait = registry.histogram("match_wait_seconds", "Time players waited in the matchmaking queue.")
+        self.fanoutLatency = registry.histogram("fanout_seconds", "Time from relaying a move to sending it to the game's last spectator.")
+        self.endpoint = MetricsEndpoint(registry, port=port) if port else None
+        self.interval = interval
+        self.last = self.sample(time.monotonic())
+
+    def sample(self, now):
+        return now, self.movesRelayed.value, self.bytesReceived.value, self.bytesSent.value, self.busy.value
+
+    def report(self, now):
+        # prints a summary once the interval is up, called by the event loop after every round of events
+        if self.interval and now - self.last[0] >= self.interval:
+            print(self.summary(now))
+
+    def summary(self, now):
+        """ One line with the gauges, and the rates and latency percentiles since the last summary. """
+        (then, moves, received, sent, busy), self.last = self.last, self.sample(now)
+        seconds = max(now - then, 1e-9)
+
+        def percentiles(histogram):
+            counts = histogram.sinceMark()
+            return f"p50 {formatMicros(histogram.percentile(0.5, counts))} p99 {formatMicros(histogram.percentile(0.99, counts))}"
+
+        return (f"Metrics ({self.name}): {self.connectionsOpen.get()} connections, {self.gamesActive.get()} games, "
+                f"{self.playersWaiting.get()} waiting, {self.spectators.get()} spectators, "
+                f"{(self.movesRelayed.value - moves) / seconds:.1f} moves/s, "
+                f"relay {percentiles(self.relayLatency)}, validation {percentiles(self.validationLatency)}, "
+                f"fanout {percentiles(self.fanoutLatency)}, "
+                f"match wait {percentiles(self.matchWait)}, accept {percentiles(self.acceptLatency)}, "
+                f"in {(self.bytesReceived.value - received) / seconds / 1024:.1f}KB/s "
+                f"out {(self.bytesSent.value - sent) / seconds / 1024:.1f}KB/s, "
+                f"busy {100 * (self.busy.value - busy) / seconds:.0f}%")
+
+    def close(self):
+        if self.endpoint:
+            self.endpoint.close()
+
+
+class GameServer:
+    """
+        Serves every client from a single thread using a selectors event loop.
+        Sockets are non-blocking: accepting, matchmaking, and relaying moves all happen in callbacks,
+        and anything a socket can't take right away is buffered until it becomes writable again.
+        Uses the same protocol.py messages as handleClient, so main.py and client.py work with either server.
+        Unlike handleClient, moves are validated against a Match before they're relayed (see handleMove).
+
+        Spectators connect to a second port and send WATCH. A spectator joining late is sent one SNAPSHOT of the position
+        instead of the move list, then each move frame is broadcast to every spectator of the game as the same bytes
+        object the opponent got. Broadcasts are queued and sent after the round of events that relayed them, at most
+        FANOUT_BATCH sends per round, so a game with thousands of spectators doesn't hold up any player's move.
+        A spectator whose socket falls SPECTATOR_BUFFER bytes behind skips the moves it can't take and is sent a fresh
+        snapshot once it catches up, or is dropped after SPECTATOR_TIMEOUT.
+    """
+
+    def __init__(self, host=HOST, port=PORT, maxConnections=MAX_CONNECTIONS, listener=None, coordinator=None, journal=None,
+                 name="server", metricsPort=None, metricsInterval=SUMMARY_INTERVAL, spectatorPort=None,
+                 spectatorListener=None, gameIds=(1, 1)):
+        """
+        Args:
+            listener (socket.socket, optional): An already bound listening socket, e.g. one of the SO_REUSEPORT sockets from runWorkers.
+            coordinator (socket.socket, optional): A socket to the Coordinator process. When given, unmatched connections are
+                handed to it instead of waiting here, and the pairs it sends back are played on this server.
+            journal (Journal, optional): Where finished games are recorded. Games aren't stored if it's None.
+            name (str, optional): Labels this server's metrics, e.g. "worker-3".
+            metricsPort (int, optional): Serves the metrics at http://localhost:metricsPort/metrics. Not served if it's None.
+            metricsInterval (float, optional): Seconds between metrics summaries in the log, 0 for none. Defaults to SUMMARY_INTERVAL.
+            spectatorPort (int, optional): Accepts spectators on this port. There's no spectator port if it's None.
+            spectatorListener (socket.socket, optional): An already bound listening socket for spectators, instead of spectatorPort.
+            gameIds (tuple, optional): (first, step) for numbering games, so workers' game ids don't overlap. Defaults to (1, 1).
+        """
+        self.maxConnections = raiseFileLimit(maxConnections)
+        self.selector = selectors.DefaultSelector()
+        self.connections = {}
+        self.metrics = ServerMetrics(self, name, metricsPort, metricsInterval)
+        self.matchmaker = Matchmaker(waitHistogram=self.metrics.matchWait)
+        self.nextTick = 0.0
+        if listener is None:
+            listener = openListener(host, port)
+        listener.setblocking(False)
+        self.listener = listener
+        self.selector.register(listener, selectors.EVENT_READ, self.accept)
+        if spectatorListener is None and spectatorPort:
+            spectatorListener = openListener(host, spectatorPort)
+        self.spectatorListener = spectatorListener
+        if spectatorListener is not None:
+            spectatorListener.setblocking(False)
+            self.selector.register(spectatorListener, selectors.EVENT_READ, self.acceptSpectators)
+        self.games = {}  # game id -> Match, for games spectators can join
+        self.firstGameId, self.gameIdStep = gameIds
+        self.nextGameId = self.firstGameId
+        if journal and journal.nextId > self.firstGameId:  # carry on after the journal's ids so they stay unique
+            self.nextGameId += -(-(journal.nextId - self.firstGameId) // self.gameIdStep) * self.gameIdStep
+        self.broadcasts = deque()  # [match, frame, ply, spectators, next index, queued at], oldest first
+        self.stale = set()  # spectators skipped ahead that haven't taken what they were sent yet
+        self.nextStaleCheck = 0.0
+        self.journal = journal
+        self.coordinator = coordinator
+        if coordinator is not None:
+            coordinator.settimeout(HANDOFF_TIMEOUT)
+            self.selector.register(coordinator, selectors.EVENT_READ, self.adopt)
+        self.running = False
+
+    def serve(self):
+        print("Server has been started. Waiting for connection.")
+        self.running = True
+        try:
+            while self.running:
+                timeout = 1.0 if len(self.matchmaker) < 2 else max(self.nextTick - time.monotonic(), 0.0)
+                if self.broadcasts:
+                    timeout = 0.0
+                ready = self.selector.select(timeout=timeout)
+                started = time.perf_counter()
+                for key, events in ready:
+                    if callable(key.data):  # the listener or the coordinator socket
+                        key.data(key.fileobj)
+                    else:
+                        connection = key.data
+                        if events & selectors.EVENT_READ:
+                            self.read(connection)
+                        if events & selectors.EVENT_WRITE and not connection.closed:
+                            self.flush(connection)
+                self.tick()
+                if self.broadcasts:
+                    self.fanOut()
+                if self.stale:
+                    self.expireSpectators(time.monotonic())
+                if self.journal:
+                    self.journal.maintain()
+                self.metrics.busy.inc(time.perf_counter() - started)
+                self.metrics.report(time.monotonic())
+        finally:
+            self.close()
+
+    def tick(self):
+        # pairs waiting clients in batches, at most once every TICK_INTERVAL
+        now = time.monotonic()
+        if now < self.nextTick or len(self.matchmaker) < 2:
+            return
+        self.nextTick = now + TICK_INTERVAL
+        for white, black in self.matchmaker.tick(now):
+            self.pair(white, black)
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        if self.matchmaker.matched:
+            print(self.matchmaker.summary())
+        print(self.metrics.summary(time.monotonic()))
+        for connection in list(self.connections.values()):
+            self.disconnect(connection, notify=False)
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        if self.spectatorListener is not None:
+            self.selector.unregister(self.spectatorListener)
+            self.spectatorListener.close()
+        if self.coordinator is not None:
+            self.selector.unregister(self.coordinator)
+            self.coordinator.close()
+        if self.journal:
+            self.journal.close()
+        self.metrics.close()
+        self.selector.close()
+
+    def accept(self, listener, spectator=False):
+        # accept everything that's queued, the listener is non-blocking so this stops once the backlog is empty
+        while True:
+            try:
+                sock, address = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:  # e.g. out of file descriptors, try again on the next event
+                print(f"Error accepting connection: {e}")
+                return
+            if len(self.connections) >= self.maxConnections:
+                self.metrics.refused.inc()
+                try:
+                    sock.send(encodeConnected(0))
+                finally:
+                    sock.close()
+                continue
+            start = time.perf_counter_ns()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = self.register(sock)
+            self.send(connection, encodeConnected(1))
+            if spectator:
+                connection.spectator = True
+                self.metrics.spectators.inc()
+            else:
+                self.matchmake(connection)
+            self.metrics.accepted.inc()
+            self.metrics.acceptLatency.record((time.perf_counter_ns() - start) // 1000)
+
+    def acceptSpectators(self, listener):
+        self.accept(listener, spectator=True)
+
+    def register(self, sock):
+        sock.setblocking(False)
+        connection = Connection(sock)
+        self.connections[sock.fileno()] = connection
+        self.selector.register(sock, selectors.EVENT_READ, connection)
+        return connection
+
+    def matchmake(self, connection):
+        # queues the new connection until a pairing tick finds it an opponent, see matchmaking.py
+        if self.coordinator is not None and not connection.outgoing and self.handOff(connection):
+            return
+        self.matchmaker.enqueue(connection)
+
+    def pair(self, opponent, connection):
+        # opponent plays white and connection plays black
+        connection.opponent = opponent
+        opponent.opponent = connection
+        match = connection.match = opponent.match = Match(self.nextGameId)
+        self.nextGameId += self.gameIdStep
+        self.games[match.id] = match
+        connection.player, opponent.player = 1, 0
+        self.metrics.gamesStarted.inc()
+        self.metrics.gamesActive.inc()
+        self.send(connection, encodeMatched(1))
+        self.send(opponent, encodeMatched(0))
+
+    def handOff(self, connection, message=None):
+        """ Passes an unmatched connection's socket to the coordinator, which pairs it with a client from any worker.
+            Spectators are passed with a WATCHER message instead, for the coordinator to send to the worker playing their game.
+
+        Returns:
+            bool: False if the coordinator couldn't take it, in which case the connection waits on this server instead.
+        """
+        try:
+            socket.send_fds(self.coordinator, [message or HANDOFF], [connection.sock.fileno()])
+        except OSError as e:
+            print(f"Error handing off connection: {e}")
+            return False
+        # the coordinator now holds its own copy of the socket, so this one is forgotten without notifying anyone
+        self.metrics.handoffs.inc()
+        if connection.spectator:
+            self.metrics.spectators.dec()
+        connection.closed = True
+        del self.connections[connection.sock.fileno()]
+        self.selector.unregister(connection.sock)
+        connection.sock.close()
+        return True
+
+    def adopt(self, coordinator):
+        # receives a pair from the coordinator, the longest waiting client first, and starts their game here
+        try:
+            message, fds, flags, address = socket.recv_fds(coordinator, WATCHER_MESSAGE.size, 2)
+        except OSError as e:
+            print(f"Error receiving from coordinator: {e}")
+            return
+        if not message:
+            print("Coordinator closed, stopping worker")
+            self.stop()
+            return
+        socks = [socket.socket(fileno=fd) for fd in fds]
+        if message[:1] == WATCHER:  # a spectator of one of this worker's games, it was already sent CONNECTED
+            for sock in socks:
+                if len(self.connections) >= self.maxConnections:
+                    sock.close()
+                    continue
+                connection = self.register(sock)
+                connection.spectator = True
+                self.metrics.spectators.inc()
+                self.watch(connection, WATCHER_MESSAGE.unpack(message)[1])
+            return
+        if len(socks) != 2 or len(self.connections) + 2 > self.maxConnections:
+            for sock in socks:
+                sock.close()
+            return
+        white, black = (self.register(sock) for sock in socks)
+        self.pair(white, black)
+
+    def read(self, connection):
+        try:
+            data = connection.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            print(f"Error receiving data: {e}")
+            self.disconnect(connection)
+            return
+        if not data:
+            print("Player disconnected")
+            self.disconnect(connection)
+            return
+        received = time.perf_counter_ns()
+        self.metrics.bytesReceived.inc(len(data))
+        # only whole frames are handled so a server message never lands in the middle of a move
+        incoming = connection.incoming
+        incoming += data
+        boundary = frameBoundary(incoming)
+        offset = 0
+        while offset < boundary:
+            kind, length = HEADER.unpack_from(incoming, offset)
+            end = offset + HEADER.size + length
+            if kind == MOVE and length == MOVE_PAYLOAD.size:
+                move = MOVE_PAYLOAD.unpack_from(incoming, offset + HEADER.size)[0]
+                self.handleMove(connection, move, bytes(incoming[offset:end]), received)
+            elif kind == SEEK and length == SEEK_PAYLOAD.size and connection in self.matchmaker:
+                rating, timeControl = SEEK_PAYLOAD.unpack_from(incoming, offset + HEADER.size)
+                self.matchmaker.enqueue(connection, rating, timeControl)
+            elif kind == WATCH and length == WATCH_PAYLOAD.size and connection.spectator:
+                self.watch(connection, WATCH_PAYLOAD.unpack_from(incoming, offset + HEADER.size)[0])
+                if connection.closed:  # handed to another worker
+                    return
+            # anything else a client sends, such as claiming a win, is dropped since the server decides how games end
+            offset = end
+        if boundary:
+            del incoming[:boundary]
+
+    def handleMove(self, connection, move, frame, received=None):
+        """ Validates a move against the server's copy of the game, relays it if it's legal, and ends the game on checkmate or stalemate.
+
+        Args:
+            connection (Connection): The player who sent the move.
+            move (int): The encoded move.
+            frame (bytes): The move's frame as received, relayed to the opponent unchanged.
+            received (int, optional): time.perf_counter_ns() when the frame was read, where the relay latency is measured from.
+        """
+        metrics = self.metrics
+        start = time.perf_counter_ns()
+        match = connection.match
+        if match is None or match.finished or match.game.sideToMove() != connection.player \
+                or match.game.tryPlay(move) is None:
+            metrics.movesRejected.inc()
+            self.send(connection, encodeRejected(move))
+            return
+        metrics.validationLatency.record((time.perf_counter_ns() - start) // 1000)
+        if connection.opponent:
+            self.send(connection.opponent, frame)
+            metrics.relayLatency.record((time.perf_counter_ns() - (received or start)) // 1000)
+        metrics.movesRelayed.inc()
+        if match.finished:  # the relay failed and the opponent's disconnect already ended the match
+            return
+        if match.spectators:
+            self.broadcast(match, frame, len(match.game.position.history))
+        result = match.game.result()
+        if result == CHECKMATE:
+            self.finish(match, WHITE_WINS if connection.player == 0 else BLACK_WINS)
+            self.send(connection, encodeGameOver(WIN))
+        elif result == STALEMATE:
+            self.finish(match, DRAWN)
+            self.send(connection, encodeGameOver(DRAW))
+
+    def finish(self, match, result, termination=NORMAL):
+        # ends a match and records it, the journal only buffers it so this doesn't wait on the disk
+        if match.finished:
+            return
+        match.finished = True
+        self.metrics.gamesFinished.inc()
+        self.metrics.gamesActive.dec()
+        self.games.pop(match.id, None)
+        if result in SPECTATOR_RESULTS:
+            match.resultFrame = encodeGameOver(SPECTATOR_RESULTS[result])
+            if match.spectators:
+                self.broadcast(match, match.resultFrame, len(match.game.position.history) + 1)
+        if self.journal:
+            self.journal.append(match.moves(), result, termination, match.started, match.id)
+
+    def watch(self, connection, gameId):
+        """ Subscribes a spectator to a game and sends it a snapshot of the position, replacing any game it was watching.
+            In a worker, a game that belongs to another worker is passed on through the coordinator.
+
+        Args:
+            connection (Connection): A connection from the spectator port.
+            gameId (int): The game to watch, 0 for the game on this server with the most spectators.
+        """
+        if connection.watching:
+            connection.watching.spectators.discard(connection)
+            connection.watching = None
+        connection.staleSince = None
+        self.stale.discard(connection)
+        if gameId:
+            match = self.games.get(gameId)
+        else:
+            match = max(self.games.values(), key=lambda match: (len(match.spectators), -match.id), default=None)
+        if match is None:
+            if gameId and self.coordinator is not None and (gameId - self.firstGameId) % self.gameIdStep \
+                    and not connection.outgoing and self.handOff(connection, WATCHER_MESSAGE.pack(WATCHER, gameId)):
+                return
+            self.send(connection, encodeGameOver(UNKNOWN_GAME))
+            return
+        connection.watching = match
+        match.spectators.add(connection)
+        self.sendSnapshot(connection)
+
+    def sendSnapshot(self, spectator):
+        # the position as of now, followed by the result if the game is already over
+        match = spectator.watching
+        history = match.game.position.history
+        ply = len(history)
+        if match.snapshotPly != ply:
+            match.snapshot = encodeSnapshot(match.id, history[-1][0] if history else 0, match.game.position.pack())
+            match.snapshotPly = ply
+        spectator.staleSince = None
+        self.stale.discard(spectator)
+        self.send(spectator, match.snapshot)
+        if match.resultFrame:
+            self.send(spectator, match.resultFrame)
+            ply += 1
+        spectator.ply = ply
+        self.metrics.snapshots.inc()
+
+    def broadcast(self, match, frame, ply):
+        # queues a frame for the game's spectators as they are now, fanOut() sends it after this round of events
+        self.broadcasts.append([match, frame, ply, list(match.spectators), 0, time.perf_counter_ns()])
+
+    def fanOut(self):
+        """ Sends queued broadcasts to spectators in order, stopping after FANOUT_BATCH sends until the next round. """
+        budget = FANOUT_BATCH
+        now = time.monotonic()
+        while self.broadcasts and budget:
+            entry = self.broadcasts[0]
+            match, frame, ply, spectators, index, queued = entry
+            end = min(index + budget, len(spectators))
+            for spectator in spectators[index:end]:
+                self.deliver(spectator, match, frame, ply, now)
+            budget -= end - index
+            if end < len(spectators):
+                entry[4] = end
+                return
+            self.broadcasts.popleft()
+            self.metrics.fanoutLatency.record((time.perf_counter_ns() - queued) // 1000)
+
+    def expireSpectators(self, now):
+        # drops stalled spectators once a second, deliver() only sees them while their game has moves to send
+        if now < self.nextStaleCheck:
+            return
+        self.nextStaleCheck = now + 1.0
+        for spectator in [spectator for spectator in self.stale if now - spectator.staleSince > SPECTATOR_TIMEOUT]:
+            self.metrics.droppedSpectators.inc()
+            self.disconnect(spectator)
+
+    def deliver(self, spectator, match, frame, ply, now):
+        # sends one broadcast frame to one spectator, unless it already has it or is too far behind to take it
+        if spectator.closed or spectator.watching is not match or spectator.ply >= ply:
+            return
+        if spectator.staleSince is not None:
+            if now - spectator.staleSince > SPECTATOR_TIMEOUT:
+                self.metrics.droppedSpectators.inc()
+                self.disconnect(spectator)
+            return
+        if len(spectator.outgoing) >= SPECTATOR_BUFFER:
+            # skips this and later moves, flush() sends a snapshot once the socket takes what's already buffered
+            spectator.staleSince = now
+            self.stale.add(spectator)
+            self.metrics.slowSpectators.inc()
+            return
+        spectator.ply = ply
+        self.metrics.spectatorFrames.inc()
+        self.send(spectator, frame)
+
+    def send(self, connection, data):
+        """ Sends as much as the socket accepts right now and buffers the rest until it's writable. """
+        if connection.closed:
+            return
+        if connection.outgoing:
+            connection.outgoing += data
+            return
+        try:
+            sent = connection.sock.send(data)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self.disconnect(connection)
+            return
+        self.metrics.bytesSent.inc(sent)
+        if sent < len(data):
+            connection.outgoing += data[sent:]
+            self.selector.modify(connection.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, connection)
+
+    def flush(self, connection):
+        try:
+            sent = connection.sock.send(connection.outgoing)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.disconnect(connection)
+            return
+        self.metrics.bytesSent.inc(sent)
+        del connection.outgoing[:sent]
+        if not connection.outgoing:
+            self.selector.modify(connection.sock, selectors.EVENT_READ, connection)
+            if connection.staleSince is not None and connection.watching:
+                self.sendSnapshot(connection)
+
+    def disconnect(self, connection, notify=True):
+        if connection.closed:
+            return
+        connection.closed = True
+        self.metrics.disconnects.inc()
+        self.matchmaker.cancel(connection)
+        if connection.spectator:
+            self.metrics.spectators.dec()
+            self.stale.discard(connection)
+            if connection.watching:
+                connection.watching.spectators.discard(connection)
+        opponent = connection.opponent
+        if opponent:
+            opponent.opponent = None
+            if not connection.match.finished:
+                if notify:  # the player who left loses
+                    self.finish(connection.match, BLACK_WINS if connection.player == 0 else WHITE_WINS, ABANDONED)
+                    self.send(opponent, encodeGameOver(DISCONNECT))
+                else:  # the server is shutting down
+                    self.finish(connection.match, UNFINISHED)
+        del self.connections[connection.sock.fileno()]
+        self.selector.unregister(connection.sock)
+        connection.sock.close()
+
+
+# messages between workers and the coordinator, each carries socket file descriptors as SCM_RIGHTS ancillary data
+HANDOFF, PAIRED, WATCHER = b"H", b"P", b"W"
+WATCHER_MESSAGE = struct.Struct("!cI")  # WATCHER and the game id the spectator asked for
+
+# how long a worker or the coordinator waits for the other side to take a message before giving up on it
+HANDOFF_TIMEOUT = 1.0
+
+# the longest payload a waiting client sends (SEEK, or a MOVE or WATCH sent early), longer frames get it dropped
+WAITING_PAYLOAD_LIMIT = max(MOVE_PAYLOAD.size, SEEK_PAYLOAD.size, WATCH_PAYLOAD.size)
+STALLED_RECHECK = 0.05  # seconds between peeks at a waiting socket that has only sent part of a frame
+STALLED_TIMEOUT = 5.0  # seconds a waiting client has to finish a frame before it's dropped
+
+
+class Coordinator:
+    """
+        Matchmaking for runWorkers. The kernel spreads connections across the workers' SO_REUSEPORT sockets,
+        so two clients looking for a game usually land on different workers. Workers hand their unmatched
+        sockets here over a Unix socket, where they wait in a Matchmaker like a single server's clients do.
+        Once a tick pairs two of them, both sockets are sent to one worker, which plays the whole game without
+        talking to any other process. Waiting sockets are watched for SEEK messages and for clients that leave.
+        Spectators asking for a game on another worker are passed through here too, to the worker whose game ids match.
+    """
+
+    def __init__(self, workers, metricsPort=None):
+        """
+        Args:
+            workers (list[socket.socket]): The coordinator's ends of the socket pairs shared with each worker.
+            metricsPort (int, optional): Serves the coordinator's metrics at http://localhost:metricsPort/metrics.
+        """
+        self.selector = selectors.DefaultSelector()
+        self.workers = set()
+        self.order = list(workers)  # worker N numbers its games N + 1, N + 1 + len(workers), ...
+        self.registry = Registry(labels={"worker": "coordinator"})
+        self.handoffs = self.registry.counter("handoffs_total", "Unmatched connections received from workers.")
+        self.pairsSent = self.registry.counter("pairs_sent_total", "Pairs sent to a worker to play.")
+        self.registry.gauge("players_waiting", "Players in the matchmaking queue.", lambda: len(self.matchmaker))
+        self.matchmaker = Matchmaker(waitHistogram=self.registry.histogram("match_wait_seconds",
+                                                                           "Time players waited in the matchmaking queue."))
+        self.endpoint = MetricsEndpoint(self.registry, port=metricsPort) if metricsPort else None
+        self.origins = {}  # waiting socket -> the worker it came from
+        self.stalled = {}  # waiting socket with only part of a frame -> when it stalled, these aren't selected
+        self.nextTick = 0.0
+        for worker in workers:
+            worker.settimeout(HANDOFF_TIMEOUT)
+            self.workers.add(worker)
+            self.selector.register(worker, selectors.EVENT_READ, self.receive)
+
+    def serve(self):
+        try:
+            while self.workers:
+                timeout = 1.0 if len(self.matchmaker) < 2 else max(self.nextTick - time.monotonic(), 0.0)
+                if self.stalled:
+                    timeout = min(timeout, STALLED_RECHECK)
+                for key, events in self.selector.select(timeout=timeout):
+                    key.data(key.fileobj)
+                if self.stalled:
+                    self.recheck()
+                self.tick()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.matchmaker.matched:
+            print(self.matchmaker.summary())
+        for sock in list(self.origins):
+            self.forget(sock)
+        for sock in self.workers:
+            self.selector.unregister(sock)
+            sock.close()
+        self.workers.clear()
+        if self.endpoint:
+            self.endpoint.close()
+        self.selector.close()
+
+    def receive(self, worker):
+        try:
+            message, fds, flags, address = socket.recv_fds(worker, WATCHER_MESSAGE.size, 1)
+        except OSError as e:
+            print(f"Error receiving from worker: {e}")
+            return
+        if not message:  # the worker exited
+            self.workers.discard(worker)
+            self.selector.unregister(worker)
+            worker.close()
+            return
+        if message[:1] == WATCHER:
+            self.forward(message, fds)
+            return
+        for fd in fds:
+            self.handoffs.inc()
+            sock = socket.socket(fileno=fd)
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, self.watch)
+            self.origins[sock] = worker
+            self.matchmaker.enqueue(sock)
+
+    def watch(self, sock):
+        """ Reads a waiting socket's SEEK messages and notices when it leaves.
+            Only whole frames are taken off the socket, so the worker that gets it next never starts reading mid frame.
+            A socket holding only part of a frame is left unselected, since it would be readable on every select,
+            and recheck() peeks at it until the rest arrives.
+        """
+        try:
+            data = sock.recv(4096, socket.MSG_PEEK)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:  # left before being matched
+            self.drop(sock)
+            return
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            kind, length = HEADER.unpack_from(data, offset)
+            if length > WAITING_PAYLOAD_LIMIT:  # not something a client sends, and it could never fit in a peek
+                self.drop(sock)
+                return
+            if offset + HEADER.size + length > len(data):
+                break
+            if kind == SEEK and length == SEEK_PAYLOAD.size:
+                rating, timeControl = SEEK_PAYLOAD.unpack_from(data, offset + HEADER.size)
+                self.matchmaker.enqueue(sock, rating, timeControl)
+            offset += HEADER.size + length
+        if offset:
+            sock.recv(offset)
+        else:
+            self.selector.unregister(sock)
+            self.stalled[sock] = time.monotonic()
+
+    def recheck(self):
+        # peeks at sockets that stalled mid frame, and selects them again once a whole frame is there
+        now = time.monotonic()
+        for sock, since in list(self.stalled.items()):
+            try:
+                data = sock.recv(4096, socket.MSG_PEEK)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                data = b""
+            if not data or now - since > STALLED_TIMEOUT:
+                self.drop(sock)
+            elif frameBoundary(data) or (len(data) >= HEADER.size
+                                         and HEADER.unpack_from(data)[1] > WAITING_PAYLOAD_LIMIT):
+                del self.stalled[sock]
+                self.selector.register(sock, selectors.EVENT_READ, self.watch)
+                self.watch(sock)
+
+    def forward(self, message, fds):
+        # passes a spectator on to the worker playing the game it asked for, which tells it if the game is over
+        target = self.order[(WATCHER_MESSAGE.unpack(message)[1] - 1) % len(self.order)]
+        if target in self.workers:
+            try:
+                socket.send_fds(target, [message], fds)
+            except OSError as e:
+                print(f"Error sending spectator to worker: {e}")
+        for fd in fds:
+            os.close(fd)
+
+    def drop(self, sock):
+        self.matchmaker.cancel(sock)
+        self.forget(sock)
+
+    def forget(self, sock):
+        # closes the coordinator's copy of a waiting socket
+        del self.origins[sock]
+        if self.stalled.pop(sock, None) is None:
+            self.selector.unregister(sock)
+        sock.close()
+
+    def tick(self):
+        now = time.monotonic()
+        if now < self.nextTick or len(self.matchmaker) < 2:
+            return
+        self.nextTick = now + TICK_INTERVAL
+        for white, black in self.matchmaker.tick(now):
+            self.sendPair(white, black)
+
+    def sendPair(self, white, black):
+        # the game goes to the newer client's worker, which keeps the kernel's load balancing, or any other worker if that fails
+        preferred = self.origins[black]
+        for worker in [preferred] + [worker for worker in self.workers if worker is not preferred]:
+            if worker not in self.workers:
+                continue
+            try:
+                socket.send_fds(worker, [PAIRED], [white.fileno(), black.fileno()])
+                self.pairsSent.inc()
+                break
+            except OSError as e:
+                print(f"Error sending pair to worker: {e}")
+        for sock in (white, black):
+            self.forget(sock)
+
+
+def reusePortListener(host, port):
+    # every worker binds its own socket to the same port and the kernel balances new connections between them
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listener.bind((host, port))
+    listener.listen(socket.SOMAXCONN)
+    return listener
+
+
+def runWorkers(host=HOST, port=PORT, workers=None, maxConnections=MAX_CONNECTIONS, journal=None,
+               metricsPort=None, metricsInterval=SUMMARY_INTERVAL, spectatorPort=None):
+    """
+        Forks one GameServer per worker, each with its own SO_REUSEPORT listening socket, so games are spread across cores.
+        The parent process runs the Coordinator that matches clients across workers. Needs Linux (SO_REUSEPORT load balancing,
+        fork, and passing sockets between processes).
+
+    Args:
+        workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+        maxConnections (int, optional): The connection limit, split evenly between the workers.
+        journal (str, optional): A directory to record games in. Each worker writes its own journal in a worker-N subdirectory.
+        metricsPort (int, optional): The coordinator serves its metrics on this port and worker N on metricsPort + 1 + N.
+        metricsInterval (float, optional): Seconds between each worker's metrics summaries, 0 for none.
+        spectatorPort (int, optional): Every worker accepts spectators on this port too. Game ids are numbered so the
+            coordinator can pass a spectator to the worker playing its game.
+    """
+    workers = workers or os.cpu_count() or 1
+    perWorker = max(maxConnections // workers, 2)
+    pids, coordinatorEnds = [], []
+    for number in range(workers):
+        coordinatorEnd, workerEnd = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        pid = os.fork()
+        if pid == 0:
+            coordinatorEnd.close()
+            for sock in coordinatorEnds:
+                sock.close()
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C goes to the parent, which stops the workers
+            server = GameServer(maxConnections=perWorker, listener=reusePortListener(host, port), coordinator=workerEnd,
+                                journal=Journal(os.path.join(journal, f"worker-{number}")) if journal else None,
+                                name=f"worker-{number}", metricsPort=metricsPort + 1 + number if metricsPort else None,
+                                metricsInterval=metricsInterval, gameIds=(number + 1, workers),
+                                spectatorListener=reusePortListener(host, spectatorPort) if spectatorPort else None)
+            signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+            try:
+                server.serve()
+            finally:
+                os._exit(0)
+        workerEnd.close()
+        pids.append(pid)
+        coordinatorEnds.append(coordinatorEnd)
+    print(f"Started {workers} workers.")
+    try:
+        Coordinator(coordinatorEnds, metricsPort).serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Chess game server.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="connection limit for the event loop server")
+    parser.add_argument("--threaded", action="store_true",
+                        help="use the original thread per connection server, limited to 20 connections")
+    parser.add_argument("--journal", help="directory to record finished games in, export them with pgn.py")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of event loop processes sharing the port, 0 for one per CPU (Linux only)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="serve Prometheus metrics on localhost at this port, 0 to turn off; with --workers, "
+                             "worker N uses the port + 1 + N")
+    parser.add_argument("--metrics-interval", type=float, default=SUMMARY_INTERVAL,
+                        help="seconds between metrics summaries in the log, 0 to turn off")
+    parser.add_argument("--spectator-port", type=int, default=SPECTATOR_PORT,
+                        help="port spectators connect to and watch games on, 0 to turn off")
+    args = parser.parse_args()
+    if args.threaded:
+        runThreaded(args.host, args.port)
+    elif args.workers != 1:
+        runWorkers(args.host, args.port, args.workers, args.max_connections, args.journal,
+                   args.metrics_port, args.metrics_interval, args.spectator_port)
+    else:
+        GameServer(args.host, args.port, args.max_connections, journal=Journal(args.journal) if args.journal else None,
+                   metricsPort=args.metrics_port, metricsInterval=args.metrics_interval,
+                   spectatorPort=args.spectator_port).serve()
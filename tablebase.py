@@ -0,0 +1,583 @@
+"""
+  Endgame tablebases for up to four pieces, generated by retrograde analysis and probed from memory-mapped files.
+  A table covers one material balance, named like "KQvK" or "KBNvK" (white's pieces, "v", black's pieces),
+  and stores one byte per position: 0 for a draw, 255 for an index that isn't a legal position,
+  or the distance to mate in plies plus one, which is a win for the side to move when the distance is odd
+  and a loss when it's even. Positions are indexed by the piece squares and the side to move, with the board's symmetry
+  folded out: the white King is kept in the a1-d1-d4 triangle when there are no pawns and on files a-d when there are.
+  Tables assume no castling rights and no en passant capture.
+
+  Generation works backwards from the checkmates. Every position first counts its legal moves, and moves that capture
+  or promote are looked up in the smaller tables they lead to, which are generated first. Then, one ply at a time,
+  the positions resolved at the previous ply are unmoved: a predecessor of a lost position is won, and a predecessor
+  whose every move leads to a won position is lost. The first pass and each ply's unmoves are split across a process pool.
+  Run "python tablebase.py generate KQvK KRvK KPvK KBNvK --directory tables", then "python tablebase.py probe --fen FEN".
+"""
+
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bitboard import *
+
+MAGIC = b"CHESSTB1"
+HEADER = struct.Struct("<8s16sQ")  # magic, table name, number of positions
+SUFFIX = ".tb"
+
+MAX_PIECES = 4
+DRAW_VALUE, INVALID = 0, 255
+WIN, DRAW, LOSS = 1, 0, -1
+
+LETTERS = "PNBRQK"
+INIT_CHUNK = 1 << 15  # positions per task in the first pass
+UNMOVE_CHUNK = 4096  # resolved positions per task when unmoving
+
+TRANSFORMS = []  # the 8 symmetries of the board, as square maps
+for _transpose in (False, True):
+    for _flipRows in (False, True):
+        for _flipCols in (False, True):
+            _map = []
+            for _sq in range(64):
+                _row, _col = divmod(_sq, 8)
+                if _transpose:
+                    _row, _col = _col, _row
+                _map.append(square(7 - _row if _flipRows else _row, 7 - _col if _flipCols else _col))
+            TRANSFORMS.append(_map)
+MIRROR = TRANSFORMS[1]  # files a-h become h-a, the only symmetry left once there are pawns
+
+TRIANGLE = [sq for sq in range(64) if sq % 8 <= 3 and 7 - sq // 8 <= sq % 8]  # a1, b1, b2, c1 ... d4
+QUEEN_SIDE = [sq for sq in range(64) if sq % 8 <= 3]
+
+SLIDERS = {BISHOP: bishopAttacks, ROOK: rookAttacks, QUEEN: queenAttacks}
+
+
+def parseMaterial(name):
+    """ Splits a table name like "KBNvK" into white's and black's piece types, Kings left out.
+
+    Raises:
+        ValueError: If the name isn't two sides of piece letters, each with one King first, and at most MAX_PIECES pieces.
+    """
+    sides = name.split("v")
+    if len(sides) != 2 or not all(side.startswith("K") and "K" not in side[1:] for side in sides) \
+            or any(letter not in LETTERS for letter in "".join(sides)) or len(name) - 1 > MAX_PIECES:
+        raise ValueError(f"Not a table name: {name}")
+    return [LETTERS.index(letter) for letter in sides[0][1:]], [LETTERS.index(letter) for letter in sides[1][1:]]
+
+
+def materialName(white, black):
+    # pieces are written strongest first, e.g. "KRNvKP"
+    return "K" + "".join(LETTERS[t] for t in sorted(white, reverse=True)) + "vK" + \
+        "".join(LETTERS[t] for t in sorted(black, reverse=True))
+
+
+def normalize(white, black):
+    """ The name of the table that holds a material balance, which always has the stronger side as white.
+
+    Returns:
+        tuple: (name, flipped), flipped is True if the colors have to be swapped to look the position up.
+    """
+    whiteKey = (len(white), sorted(white, reverse=True))
+    blackKey = (len(black), sorted(black, reverse=True))
+    if blackKey > whiteKey:
+        return materialName(black, white), True
+    return materialName(white, black), False
+
+
+def dependencies(name):
+    """ Every table that positions in this one can reach by captures and promotions, smallest first. """
+    found = set()
+    pending = [name]
+    while pending:
+        white, black = parseMaterial(pending.pop())
+        children = []
+        for mine, theirs, isWhite in ((white, black, True), (black, white, False)):
+            for i, pieceType in enumerate(mine):
+                rest = mine[:i] + mine[i + 1:]
+                children.append((rest, theirs, isWhite))  # the piece is captured
+                if pieceType == PAWN:  # it promotes, maybe capturing on the way
+                    for promoted in (KNIGHT, BISHOP, ROOK, QUEEN):
+                        children.append((rest + [promoted], theirs, isWhite))
+                        children += [(rest + [promoted], theirs[:j] + theirs[j + 1:], isWhite) for j in range(len(theirs))]
+        for mine, theirs, isWhite in children:
+            child = normalize(mine, theirs)[0] if isWhite else normalize(theirs, mine)[0]
+            if child not in found and child != name:
+                found.add(child)
+                pending.append(child)
+    return sorted(found, key=lambda child: (len(child), child))
+
+
+class Material:
+    """
+        The index layout of one table: which pieces it has, and how positions map to indexes and back.
+        Pieces are ordered white King, black King, white's other pieces, then black's, strongest first.
+    """
+
+    def __init__(self, name):
+        white, black = parseMaterial(name)
+        self.name = name
+        self.pieces = [(WHITE, KING), (BLACK, KING)] + [(WHITE, t) for t in sorted(white, reverse=True)] + \
+            [(BLACK, t) for t in sorted(black, reverse=True)]
+        self.colors = [color for color, _ in self.pieces]
+        self.types = [pieceType for _, pieceType in self.pieces]
+        self.bySide = [[i for i, color in enumerate(self.colors) if color == side] for side in (WHITE, BLACK)]
+        self.pawns = PAWN in self.types
+        self.kingSquares = QUEEN_SIDE if self.pawns else TRIANGLE
+        self.kingIndex = {sq: index for index, sq in enumerate(self.kingSquares)}
+        symmetries = [TRANSFORMS[0], MIRROR] if self.pawns else TRANSFORMS
+        # the symmetries that bring a white King on each square into kingSquares, two of them on the diagonal
+        self.transforms = [[t for t in symmetries if t[sq] in self.kingIndex] for sq in range(64)]
+        # identical pieces are kept in square order, so swapping them doesn't give a second index
+        self.pairs = [(i, i + 1) for i in range(2, len(self.pieces) - 1) if self.pieces[i] == self.pieces[i + 1]]
+        kings = len(self.kingSquares)
+        self.weights = [2 * kings * 64 ** i for i in range(len(self.pieces) - 1)]
+        self.size = 2 * kings * 64 ** (len(self.pieces) - 1)
+
+    def encode(self, side, sqs):
+        """ The index of a position, after moving it to its symmetric form.
+
+        Args:
+            side (int): The side to move.
+            sqs (list[int]): The square of each piece, in self.pieces order.
+        """
+        best = -1
+        for transform in self.transforms[sqs[0]]:
+            mapped = [transform[sq] for sq in sqs]
+            for a, b in self.pairs:
+                if mapped[a] > mapped[b]:
+                    mapped[a], mapped[b] = mapped[b], mapped[a]
+            index = side + 2 * self.kingIndex[mapped[0]]
+            for sq, weight in zip(mapped[1:], self.weights):
+                index += sq * weight
+            if best < 0 or index < best:
+                best = index
+        return best
+
+    def decode(self, index):
+        side = index & 1
+        rest = index >> 1
+        sqs = [self.kingSquares[rest % len(self.kingSquares)]]
+        rest //= len(self.kingSquares)
+        for _ in range(len(self.pieces) - 1):
+            sqs.append(rest & 63)
+            rest >>= 6
+        return side, sqs
+
+    def attacked(self, target, byColor, sqs, occupied):
+        # whether any piece of byColor that's still on the board attacks the square
+        bit = 1 << target
+        for i in self.bySide[byColor]:
+            sq = sqs[i]
+            if sq < 0:
+                continue
+            pieceType = self.types[i]
+            if pieceType == PAWN:
+                attacks = PAWN_ATTACKS[byColor][sq]
+            elif pieceType == KNIGHT:
+                attacks = KNIGHT_ATTACKS[sq]
+            elif pieceType == KING:
+                attacks = KING_ATTACKS[sq]
+            else:
+                attacks = SLIDERS[pieceType](sq, occupied)
+            if attacks & bit:
+                return True
+        return False
+
+    def valid(self, index, side, sqs):
+        # a legal position in its symmetric form: no shared squares, no pawns on the back ranks, the side not to move not in check
+        occupied = 0
+        for i, sq in enumerate(sqs):
+            if occupied >> sq & 1 or (self.types[i] == PAWN and sq // 8 in (0, 7)):
+                return False
+            occupied |= 1 << sq
+        if self.encode(side, sqs) != index:
+            return False
+        return not self.attacked(sqs[1 - side], side, sqs, occupied)
+
+    def moves(self, side, sqs):
+        """ Yields the legal moves of the side to move.
+
+        Yields:
+            tuple: (squares after the move with -1 for a captured piece, the moved piece's index,
+                the captured piece's index or -1, the promotion piece type or None).
+        """
+        occupied = own = 0
+        for i, sq in enumerate(sqs):
+            occupied |= 1 << sq
+            if self.colors[i] == side:
+                own |= 1 << sq
+        enemy = occupied & ~own
+        for i in self.bySide[side]:
+            frm = sqs[i]
+            pieceType = self.types[i]
+            if pieceType == PAWN:
+                forward = -8 if side == WHITE else 8
+                targets = PAWN_ATTACKS[side][frm] & enemy
+                if not occupied >> (frm + forward) & 1:
+                    targets |= 1 << (frm + forward)
+                    start = 6 if side == WHITE else 1
+                    if frm // 8 == start and not occupied >> (frm + 2 * forward) & 1:
+                        targets |= 1 << (frm + 2 * forward)
+            elif pieceType == KNIGHT:
+                targets = KNIGHT_ATTACKS[frm] & ~own
+            elif pieceType == KING:
+                targets = KING_ATTACKS[frm] & ~own
+            else:
+                targets = SLIDERS[pieceType](frm, occupied) & ~own
+            for to in squares(targets):
+                after = list(sqs)
+                after[i] = to
+                captured = -1
+                if enemy >> to & 1:
+                    captured = sqs.index(to)
+                    after[captured] = -1
+                if self.attacked(after[side], 1 - side, after, (occupied & ~(1 << frm)) | (1 << to)):
+                    continue
+                if pieceType == PAWN and to // 8 in (0, 7):
+                    for promoted in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        yield after, i, captured, promoted
+                else:
+                    yield after, i, captured, None
+
+    def unmoves(self, side, sqs):
+        """ The indexes of every position that reaches this one with a move that doesn't capture or promote. """
+        mover = 1 - side
+        occupied = 0
+        for sq in sqs:
+            occupied |= 1 << sq
+        found = set()
+        for i in self.bySide[mover]:
+            to = sqs[i]
+            pieceType = self.types[i]
+            if pieceType == PAWN:
+                back = 8 if mover == WHITE else -8
+                origins = 0
+                origin = to + back
+                if 1 <= origin // 8 <= 6 and not occupied >> origin & 1:
+                    origins |= 1 << origin
+                    if to // 8 == (4 if mover == WHITE else 3) and not occupied >> (origin + back) & 1:
+                        origins |= 1 << (origin + back)
+            elif pieceType == KNIGHT:
+                origins = KNIGHT_ATTACKS[to] & ~occupied
+            elif pieceType == KING:
+                origins = KING_ATTACKS[to] & ~occupied
+            else:
+                origins = SLIDERS[pieceType](to, occupied) & ~occupied
+            for frm in squares(origins):
+                before = list(sqs)
+                before[i] = frm
+                # the side that didn't move can't have been left in check
+                if self.attacked(before[side], mover, before, (occupied & ~(1 << to)) | (1 << frm)):
+                    continue
+                found.add(self.encode(mover, before))
+        return found
+
+
+class Tablebases:
+    """ Probes the tables in a directory, mapping each file the first time it's needed. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.names = {}  # the pieces on the board, sorted, to (table name, flipped)
+
+    def table(self, name):
+        """
+        Returns:
+            tuple | None: (Material, mapped bytes) for the table, or None if it hasn't been generated.
+        """
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + SUFFIX)
+            if not os.path.exists(path):
+                return None
+            material = Material(name)
+            with open(path, "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, stored, size = HEADER.unpack_from(data)
+            if magic != MAGIC or stored.rstrip(b"\0").decode() != name or size != material.size \
+                    or len(data) != HEADER.size + size:
+                data.close()
+                raise ValueError(f"Not a table for {name}: {path}")
+            self.tables[name] = (material, data)
+        return self.tables[name]
+
+    def probeSquares(self, side, placed):
+        """ Looks up a position given as a list of pieces.
+
+        Args:
+            side (int): The side to move.
+            placed (list[tuple]): (color, pieceType, sq) for every piece on the board, Kings included.
+
+        Returns:
+            int | None: The stored byte, or None if the table for the material isn't there.
+        """
+        pieces = tuple(sorted((color, t) for color, t, _ in placed))
+        if pieces not in self.names:
+            self.names[pieces] = normalize([t for color, t in pieces if color == WHITE and t != KING],
+                                           [t for color, t in pieces if color == BLACK and t != KING])
+        name, flipped = self.names[pieces]
+        table = self.tables.get(name) or self.table(name)
+        if table is None:
+            return None
+        material, data = table
+        if flipped:  # black is the stronger side, so look up the position with the colors and ranks swapped
+            placed = [(1 - color, t, sq ^ 56) for color, t, sq in placed]
+            side = 1 - side
+        sqs = [-1] * len(material.pieces)
+        for color, t, sq in placed:
+            i = material.pieces.index((color, t))
+            if sqs[i] >= 0:  # the second of two identical pieces
+                i += 1
+            sqs[i] = sq
+        return data[HEADER.size + material.encode(side, sqs)]
+
+    def probe(self, position):
+        """ Looks up a position.
+
+        Returns:
+            tuple | None: (WIN, DRAW or LOSS for the side to move, plies to mate), or None if there's no table for it,
+                or it has castling rights or an en passant capture.
+        """
+        if position.castling:
+            return None
+        side = position.side
+        if position.epSquare >= 0 and PAWN_ATTACKS[1 - side][position.epSquare] & position.pieces[side * 6 + PAWN]:
+            return None
+        placed = []
+        for piece in range(12):
+            if position.pieces[piece]:
+                placed += [(piece // 6, piece % 6, sq) for sq in squares(position.pieces[piece])]
+        if len(placed) > MAX_PIECES:
+            return None
+        value = self.probeSquares(position.side, placed)
+        if value is None or value == INVALID:
+            return None
+        if value == DRAW_VALUE:
+            return DRAW, 0
+        plies = value - 1
+        return (WIN if plies % 2 else LOSS), plies
+
+    def bestMove(self, position):
+        """ Picks the move that mates fastest, or holds the draw, or loses slowest.
+
+        Returns:
+            int | None: The move, or None if the position or one of its moves isn't covered by the tables.
+        """
+        best, bestRank = None, None
+        for move in position.legalMoves():
+            position.makeMove(move)
+            result = self.probe(position)
+            position.unmakeMove()
+            if result is None:
+                return None
+            outcome, plies = result
+            # the result is for the opponent, so their loss is our win
+            rank = (1, -plies) if outcome == LOSS else (0, 0) if outcome == DRAW else (-1, plies)
+            if bestRank is None or rank > bestRank:
+                best, bestRank = move, rank
+        return best
+
+    def close(self):
+        for _, data in self.tables.values():
+            data.close()
+        self.tables = {}
+
+
+worker = None
+materials = {}
+
+
+def getMaterial(name):
+    if name not in materials:
+        materials[name] = Material(name)
+    return materials[name]
+
+
+def startWorker(directory):
+    global worker
+    worker = Tablebases(directory)
+
+
+def initChunk(name, low, high):
+    """ The first pass over positions low to high, run in a worker process.
+
+    Returns:
+        tuple: (low, values, counts, events). values holds 1 for checkmates and INVALID for illegal indexes.
+            counts holds each position's number of moves that aren't yet known to lose. events lists
+            (index, plies) for moves out of the table into a position mated in plies, or won in plies,
+            which the retrograde pass applies along with the positions resolved at that many plies.
+    """
+    material = getMaterial(name)
+    values = bytearray(high - low)
+    counts = bytearray(high - low)
+    events = []
+    for index in range(low, high):
+        side, sqs = material.decode(index)
+        if not material.valid(index, side, sqs):
+            values[index - low] = INVALID
+            continue
+        children = set()
+        count = 0
+        anyMove = False
+        for after, moved, captured, promoted in material.moves(side, sqs):
+            anyMove = True
+            if captured < 0 and promoted is None:
+                children.add(material.encode(1 - side, after))
+                continue
+            placed = [(material.colors[i], promoted if i == moved and promoted is not None else material.types[i], sq)
+                      for i, sq in enumerate(after) if sq >= 0]
+            value = worker.probeSquares(1 - side, placed)
+            if value is None:
+                raise ValueError(f"{name} needs the tables it captures or promotes into, generate them first")
+            count += 1  # a move out of the table that draws is never taken off the count, so the position can't be lost
+            if value != DRAW_VALUE:
+                events.append((index, value - 1))
+        if not anyMove:
+            if material.attacked(sqs[side], 1 - side, sqs, sum(1 << sq for sq in sqs)):
+                values[index - low] = 1  # checkmated
+            continue
+        counts[index - low] = len(children) + count
+    return low, values, counts, events
+
+
+def unmoveChunk(name, indexes):
+    # the predecessors of resolved positions, run in a worker process
+    material = getMaterial(name)
+    return [list(material.unmoves(*material.decode(index))) for index in indexes]
+
+
+def generate(name, directory, workers=None, log=print):
+    """ Generates one table, and any smaller table it depends on that isn't in the directory yet.
+
+    Args:
+        name (str): The material, e.g. "KRvK".
+        directory (str): Where tables are read from and written to.
+        workers (int, optional): Worker processes. Defaults to the number of CPUs.
+        log (callable, optional): Progress messages go here. Defaults to print.
+
+    Returns:
+        dict: Position counts for the new table: wins, losses, draws, and the longest mate in plies.
+    """
+    name = normalize(*parseMaterial(name))[0]
+    os.makedirs(directory, exist_ok=True)
+    for child in dependencies(name):
+        if not os.path.exists(os.path.join(directory, child + SUFFIX)):
+            generate(child, directory, workers, log)
+    workers = workers or os.cpu_count() or 1
+    material = Material(name)
+    start = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=startWorker, initargs=(directory,)) \
+        if workers > 1 else None
+    if executor is None:
+        startWorker(directory)
+
+    def run(function, tasks):
+        if executor is None:
+            return [function(*task) for task in tasks]
+        return executor.map(function, *zip(*tasks)) if tasks else []
+
+    try:
+        values = bytearray(material.size)
+        counts = bytearray(material.size)
+        events = {}
+        frontier = []
+        tasks = [(name, low, min(low + INIT_CHUNK, material.size)) for low in range(0, material.size, INIT_CHUNK)]
+        for low, chunkValues, chunkCounts, chunkEvents in run(initChunk, tasks):
+            values[low:low + len(chunkValues)] = chunkValues
+            counts[low:low + len(chunkCounts)] = chunkCounts
+            frontier += [low + offset for offset, value in enumerate(chunkValues) if value == 1]
+            for index, plies in chunkEvents:
+                events.setdefault(plies, []).append(index)
+
+        # positions resolved at `plies` decide their predecessors at plies + 1
+        plies = 0
+        while frontier or any(level >= plies for level in events):
+            lost = plies % 2 == 0  # everything at an even distance is a loss for the side to move
+            resolved = []
+            updates = []
+            if len(frontier) > UNMOVE_CHUNK and executor is not None:
+                chunks = [(name, frontier[i:i + UNMOVE_CHUNK]) for i in range(0, len(frontier), UNMOVE_CHUNK)]
+                for predecessors in run(unmoveChunk, chunks):
+                    updates += predecessors
+            elif frontier:
+                updates = unmoveChunk(name, frontier)
+            updates.append(events.pop(plies, []))
+            for predecessors in updates:
+                for index in predecessors:
+                    if values[index]:
+                        continue
+                    if not lost:
+                        counts[index] -= 1
+                        if counts[index]:
+                            continue
+                    values[index] = plies + 2  # plies + 1 to mate, stored plus one
+                    resolved.append(index)
+            frontier = resolved
+            plies += 1
+            if plies > 252:
+                raise ValueError(f"{name} has mates longer than a table can store")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        else:
+            worker.close()
+
+    path = os.path.join(directory, name + SUFFIX)
+    with open(path + ".tmp", "wb") as file:
+        file.write(HEADER.pack(MAGIC, name.encode(), material.size))
+        file.write(values)
+    os.replace(path + ".tmp", path)
+
+    wins = losses = draws = longest = 0
+    for value in values:
+        if value == INVALID:
+            continue
+        if value == DRAW_VALUE:
+            draws += 1
+        else:
+            longest = max(longest, value - 1)
+            if value % 2 == 0:
+                wins += 1
+            else:
+                losses += 1
+    stats = {"wins": wins, "losses": losses, "draws": draws, "longest": longest}
+    log(f"{name}: {wins} wins, {losses} losses, {draws} draws, longest mate {longest} plies, "
+        f"{time.perf_counter() - start:.1f}s")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate endgame tables by retrograde analysis, or probe them.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="generate tables and the smaller tables they need")
+    build.add_argument("names", nargs="+", help='materials like "KQvK" or "KBNvK"')
+    build.add_argument("--directory", default="tables", help="where the tables go")
+    build.add_argument("--workers", type=int, default=0, help="worker processes, 0 for one per CPU")
+    probe = commands.add_parser("probe", help="look a position up")
+    probe.add_argument("--fen", required=True, help="position to look up")
+    probe.add_argument("--directory", default="tables", help="where the tables are")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for name in args.names:
+            generate(name, args.directory, args.workers)
+    else:
+        from pgn import san
+        tablebases = Tablebases(args.directory)
+        position = Position.fromFen(args.fen)
+        start = time.perf_counter()
+        result = tablebases.probe(position)
+        elapsed = time.perf_counter() - start
+        if result is None:
+            print("not in the tables")
+        else:
+            outcome, plies = result
+            text = {WIN: "win", DRAW: "draw", LOSS: "loss"}[outcome]
+            print(f"{text} for the side to move" + (f", mate in {plies} plies" if outcome != DRAW else "") +
+                  f", probed in {elapsed * 1e6:.1f}us")
+            move = tablebases.bestMove(position)
+            if move is not None:
+                print("best move", san(position, move))
+        tablebases.close()
@@ -0,0 +1,87 @@
+"""
+  Fixed-size transposition table keyed by the Zobrist hash from bitboard.py.
+  Anything that depends only on the position (perft counts, search results, move lists) can be cached here.
+  Memory is bounded because the table never grows past the number of slots it was created with.
+"""
+
+
+class TranspositionTable:
+    """
+        Stores entries in preallocated parallel lists, two slots per bucket.
+        The first slot of a bucket keeps the deepest entry seen in the current search and the second slot
+        is always replaced, so shallow results still get cached without pushing out expensive deep ones.
+        Entries from an earlier search (see newSearch()) can always be replaced.
+    """
+
+    def __init__(self, bits=20):
+        """
+        Args:
+            bits (int, optional): The table holds 2 ** bits buckets of two entries each. Defaults to 20.
+        """
+        size = 2 << bits
+        self.mask = (1 << bits) - 1
+        self.keys = [0] * size
+        self.depths = [-1] * size
+        self.values = [None] * size
+        self.generations = bytearray(size)
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def __len__(self):
+        return sum(1 for depth in self.depths if depth >= 0)
+
+    def capacity(self):
+        return len(self.keys)
+
+    def newSearch(self):
+        # ages every stored entry so a new search can replace them
+        self.generation = (self.generation + 1) & 0xFF
+
+    def clear(self):
+        size = len(self.keys)
+        self.keys = [0] * size
+        self.depths = [-1] * size
+        self.values = [None] * size
+        self.generations = bytearray(size)
+
+    def probe(self, key, depth=None):
+        """ Looks up a position.
+
+        Args:
+            key (int): The position's Zobrist hash.
+            depth (int, optional): If given, only an entry stored with this exact depth counts as a hit.
+
+        Returns:
+            tuple | None: (depth, value) for the stored entry, or None if the position isn't in the table.
+        """
+        self.probes += 1
+        slot = (key & self.mask) << 1
+        for index in (slot, slot + 1):
+            if self.keys[index] == key and self.depths[index] >= 0 and (depth is None or self.depths[index] == depth):
+                self.hits += 1
+                return self.depths[index], self.values[index]
+        return None
+
+    def store(self, key, depth, value):
+        """ Saves a value for a position, replacing an older entry if the bucket is full.
+
+        Args:
+            key (int): The position's Zobrist hash.
+            depth (int): How much work the value represents, such as the search depth. Deeper entries are kept longer.
+            value (object): The data to cache.
+        """
+        slot = (key & self.mask) << 1
+        keys, depths = self.keys, self.depths
+        if keys[slot] == key or depths[slot] < 0 or depth >= depths[slot] \
+                or self.generations[slot] != self.generation:
+            index = slot
+        else:
+            index = slot + 1
+        keys[index] = key
+        depths[index] = depth
+        self.values[index] = value
+        self.generations[index] = self.generation
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0